@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Inserting N shape records : Window.insert_shapes against the former loop
+# adding items one at a time while the scene BSP index is live. Both are
+# timed up to the first scene query and the first paint, when the deferred
+# index work has been done.
+#   QT_QPA_PLATFORM=offscreen python3 benchmarks/bench_bulk_insert.py 1000000
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PyQt5 import QtCore, QtWidgets
+
+from window import Window
+from shapes import shape_to_item
+from suite import make_shapes, new_document
+
+def per_item(window, shapes):
+    items = []
+    for shape in shapes:
+        item = shape_to_item(shape)
+        if item:
+            window.scene.addItem(item)
+            items.append(item)
+    window.view.index_items(items)
+
+def bulk(window, shapes):
+    window.insert_shapes(shapes)
+
+def run(app, window, insert, shapes):
+    new_document(window)
+    app.processEvents()
+    start = time.perf_counter()
+    insert(window, shapes)
+    inserted = time.perf_counter()
+    window.scene.items(QtCore.QRectF(0, 0, 1, 1))  # builds the BSP tree if it is stale
+    queried = time.perf_counter()
+    window.view.viewport().repaint()
+    painted = time.perf_counter()
+    return (inserted - start) * 1000, (queried - inserted) * 1000, (painted - queried) * 1000
+
+if __name__ == "__main__":
+    app = QtWidgets.QApplication(sys.argv)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    window = Window(dimension=(1000, 800))
+    window.autosave_timer.stop()
+    window.resize(1000, 800)
+    window.show()
+    shapes = make_shapes(count)
+    print("{} items".format(count))
+    print("{:12} {:>12} {:>12} {:>12} {:>12}".format("", "insert ms", "index ms", "paint ms", "total ms"))
+    for name, insert in (("per item", per_item), ("bulk", bulk)):
+        insert_ms, index_ms, paint_ms = run(app, window, insert, shapes)
+        print("{:12} {:12.0f} {:12.0f} {:12.0f} {:12.0f}".format(name, insert_ms, index_ms, paint_ms,
+                                                                 insert_ms + index_ms + paint_ms))
+    new_document(window)
+    window.close()
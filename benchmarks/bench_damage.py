@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Pixels repainted per mouse move for each tool, against the whole viewport
+# that used to be repainted on every move.
+#   QT_QPA_PLATFORM=offscreen python3 benchmarks/bench_damage.py 200
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+from window import Window
+
+def send(app, view, kind, pos, button=QtCore.Qt.LeftButton):
+    buttons = QtCore.Qt.NoButton if kind == QtCore.QEvent.MouseButtonRelease else button
+    event = QtGui.QMouseEvent(kind, QtCore.QPointF(pos), button, buttons, QtCore.Qt.NoModifier)
+    app.sendEvent(view.viewport(), event)
+
+def settle(app, view):
+    time.sleep(view.damage.FRAME_MS / 1000)
+    app.processEvents()
+
+def gesture(app, view, tool, moves, press=True):
+    view.tool = tool
+    start = QtCore.QPoint(300, 300)
+    if press:
+        send(app, view, QtCore.QEvent.MouseButtonPress, start)
+    settle(app, view)
+    meter = view.repaint_meter
+    pixels, paints = meter.total, meter.paints
+    for i in range(moves):
+        send(app, view, QtCore.QEvent.MouseMove, start + QtCore.QPoint(i % 97 + 1, i % 89 + 1),
+             QtCore.Qt.LeftButton if press else QtCore.Qt.NoButton)
+        settle(app, view)
+    pixels, paints = meter.total - pixels, meter.paints - paints
+    if press:
+        send(app, view, QtCore.QEvent.MouseButtonRelease, start + QtCore.QPoint(20, 20))
+    settle(app, view)
+    return pixels / moves, paints
+
+if __name__ == "__main__":
+    app = QtWidgets.QApplication(sys.argv)
+    moves = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    window = Window(dimension=(1000, 800))
+    window.resize(1000, 800)
+    window.show()
+    view = window.view
+    app.processEvents()
+    area = view.viewport().width() * view.viewport().height()
+    rows = [("hover (select)",) + gesture(app, view, "select", moves, press=False),
+            ("pen",) + gesture(app, view, "pen", moves),
+            ("line",) + gesture(app, view, "line", moves),
+            ("rectangle",) + gesture(app, view, "rectangle", moves)]
+    view.selection.set([view.item_at(QtCore.QPoint(300, 300)) or view.scene().items()[0]])
+    rows.append(("drag selection",) + gesture(app, view, "select", moves))
+    view.tool = "polygon"
+    send(app, view, QtCore.QEvent.MouseButtonPress, QtCore.QPoint(200, 200))
+    send(app, view, QtCore.QEvent.MouseButtonRelease, QtCore.QPoint(200, 200))
+    rows.append(("polygon rubber line",) + gesture(app, view, "polygon", moves, press=False))
+    print("viewport                  {} px".format(area))
+    for name, pixels, paints in rows:
+        print("{:20} {:10.0f} px/move  {:5.1f}% of viewport  {} paints".format(
+            name, pixels, 100.0 * pixels / area, paints))
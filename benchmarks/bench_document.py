@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Memory per shape of the Document arrays against live scene items, and
+# save time from the document against the former scene snapshot. Memory is
+# the growth of the resident set (Linux), so the document is built first.
+#   QT_QPA_PLATFORM=offscreen python3 benchmarks/bench_document.py 100000
+import gc
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PyQt5 import QtWidgets
+
+from binary_format import write_binary
+from document import Document
+from shapes import snapshot_scene, snapshot_to_shape
+from suite import make_shapes
+
+def resident():
+    gc.collect()
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+def save_scene(scene, filename):
+    snapshot, snapshot_ms = timed(snapshot_scene, scene)
+    _, write_ms = timed(lambda: write_binary(filename, [snapshot_to_shape(s) for s in snapshot]))
+    return snapshot_ms, write_ms
+
+def save_document(document, filename):
+    snapshot, snapshot_ms = timed(document.snapshot)
+    _, write_ms = timed(snapshot.write_binary, filename)
+    return snapshot_ms, write_ms
+
+if __name__ == "__main__":
+    app = QtWidgets.QApplication(sys.argv)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    shapes = make_shapes(count)
+    print("{} shapes".format(count))
+
+    before = resident()
+    document = Document()
+    ids, add_ms = timed(document.add, shapes)
+    document_bytes = resident() - before
+    before = resident()
+    scene = QtWidgets.QGraphicsScene()
+    scene.setItemIndexMethod(QtWidgets.QGraphicsScene.NoIndex)
+    items, build_ms = timed(document.build_items, ids)
+    for item in items:
+        scene.addItem(item)
+    item_bytes = resident() - before
+
+    print("{:12} {:>12} {:>12}".format("", "bytes/shape", "build ms"))
+    print("{:12} {:12.0f} {:12.0f}".format("document", document_bytes / count, add_ms))
+    print("{:12} {:12.0f} {:12.0f}".format("items", item_bytes / count, build_ms))
+    print("arrays only {:.0f} bytes/shape".format(document.memory_usage()['per_shape']))
+
+    filename = os.path.join(tempfile.mkdtemp(), "bench.pbin")
+    print("{:12} {:>12} {:>12}".format("save", "snapshot ms", "write ms"))
+    for name, save, source in (("scene", save_scene, scene), ("document", save_document, document)):
+        snapshot_ms, write_ms = save(source, filename)
+        print("{:12} {:12.0f} {:12.0f}".format(name, snapshot_ms, write_ms))
+    os.remove(filename)
@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Jumping across a long history : View.jump_to, restoring the nearest
+# checkpoint, against stepping with undo/redo one command at a time.
+# Then checks that jumping while the history spills to disk reaches the
+# same documents as a history kept in memory.
+#   QT_QPA_PLATFORM=offscreen python3 benchmarks/bench_history_jump.py 10000
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+from view import View, AddItemCommand, MoveItemsCommand, RemoveItemCommand, TransformCommand
+from history import History
+from transform import item_positions, rotation, transform_items
+
+WORLD = 5000.0
+JUMPS = 20
+
+def build_history(view, steps):
+    # Mostly moves of a few existing strokes at once, as a drag of the
+    # selection does, with some adds, deletes and rotations
+    random.seed(1)
+    scene = view.scene()
+    items = []
+    for step in range(steps):
+        r = random.random()
+        if r < 0.2 or len(items) < 10:
+            x, y = random.uniform(0, WORLD), random.uniform(0, WORLD)
+            path = QtGui.QPainterPath(QtCore.QPointF(x, y))
+            for _ in range(20):
+                x, y = x + random.uniform(-8, 8), y + random.uniform(-8, 8)
+                path.lineTo(x, y)
+            item = QtWidgets.QGraphicsPathItem(path)
+            items.append(item)
+            view.execute_command(AddItemCommand(scene, item))
+        elif r < 0.25:
+            item = items.pop(random.randrange(len(items)))
+            view.execute_command(RemoveItemCommand(scene, item))
+        elif r < 0.35:
+            chosen = random.sample(items, 5)
+            transform = rotation(random.uniform(-45, 45), chosen[0].sceneBoundingRect().center())
+            old, new = transform_items(chosen, transform)
+            view.execute_command(TransformCommand(chosen, old, new, transform))
+        else:
+            chosen = random.sample(items, random.randint(1, 5))
+            offset = (random.uniform(-20, 20), random.uniform(-20, 20))
+            view.execute_command(MoveItemsCommand(chosen, item_positions(chosen), offset))
+
+def step_to(view, position):
+    # former behaviour : one command, and one scene update, per step
+    while view.history.position() > position:
+        view.undo()
+    while view.history.position() < position:
+        view.redo()
+
+def timed_jumps(view, targets, jump):
+    start = time.perf_counter()
+    for target in targets:
+        jump(view, target)
+    return time.perf_counter() - start
+
+def state(scene):
+    return sorted((round(item.pos().x(), 6), round(item.pos().y(), 6),
+                   round(item.transform().m11(), 6), round(item.transform().m12(), 6))
+                  for item in scene.items())
+
+def make_view(steps, max_entries, checkpoint_interval=History.CHECKPOINT_INTERVAL):
+    view = View()
+    view.setScene(QtWidgets.QGraphicsScene(0, 0, WORLD, WORLD))
+    view.history = History(view.restore_command, view.find_items, max_entries=max_entries)
+    view.history.CHECKPOINT_INTERVAL = checkpoint_interval
+    build_history(view, steps)
+    return view
+
+def check_spilling(steps, jumps=200):
+    # Spilled records must hold the items as they are at their position,
+    # not as a jump left them before replaying its commands. Transform
+    # commands are spilled with both their states.
+    kept = make_view(steps, steps + 1)
+    spilled = make_view(steps, 7, checkpoint_interval=5)
+    length = len(kept.history)
+    random.seed(3)
+    for _ in range(jumps):
+        target = random.randint(0, length)
+        kept.jump_to(target)
+        spilled.jump_to(target)
+        assert state(spilled.scene()) == state(kept.scene()), "jump to {} while spilling".format(target)
+    return spilled.history.memory_usage()['spilled_entries']
+
+if __name__ == "__main__":
+    app = QtWidgets.QApplication(sys.argv)
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    view = View()
+    view.setScene(QtWidgets.QGraphicsScene(0, 0, WORLD, WORLD))
+    view.history = History(view.restore_command, view.find_items, max_entries=steps + 1)
+    start = time.perf_counter()
+    build_history(view, steps)
+    build = time.perf_counter() - start
+    length = len(view.history)
+    random.seed(2)
+    targets = [random.randint(0, length) for _ in range(JUMPS)] + [0, length]
+    checkpoint = timed_jumps(view, targets, View.jump_to)
+    reached = state(view.scene())
+    step_to(view, 0)
+    step_to(view, length)
+    stepped = timed_jumps(view, targets, step_to)
+    assert state(view.scene()) == reached
+    usage = view.history.memory_usage()
+    print("history entries       {}".format(length))
+    print("items in scene        {}".format(len(view.scene().items())))
+    print("checkpoints           {} ({} item states)".format(usage['checkpoints'], usage['checkpoint_states']))
+    print("build                 {:10.1f} ms".format(build * 1000))
+    print("jump, step by step    {:10.1f} ms".format(stepped / len(targets) * 1000))
+    print("jump, checkpoints     {:10.1f} ms".format(checkpoint / len(targets) * 1000))
+    print("jumps while spilling  ok ({} entries spilled)".format(check_spilling(300)))
@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Repaint of a zoomed out drawing of N long strokes and N/10 texts, with
+# full resolution painting and with the level of detail paths.
+#   QT_QPA_PLATFORM=offscreen python3 benchmarks/bench_lod.py 20000
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+from lod import LodPathItem, LodTextItem
+from view import View
+
+WORLD = 20000.0
+POINTS = 200
+REPAINTS = 5
+
+def make_items(count):
+    random.seed(1)
+    pen = QtGui.QPen(QtCore.Qt.blue)
+    items = []
+    for i in range(count):
+        x, y = random.uniform(0, WORLD), random.uniform(0, WORLD)
+        path = QtGui.QPainterPath(QtCore.QPointF(x, y))
+        for _ in range(POINTS):
+            x, y = x + random.uniform(-2, 3), y + random.uniform(-2, 3)
+            path.lineTo(x, y)
+        item = LodPathItem(path)
+        item.setPen(pen)
+        items.append(item)
+        if i % 10 == 0:
+            text = LodTextItem("note {}".format(i))
+            text.setPos(random.uniform(0, WORLD), random.uniform(0, WORLD))
+            items.append(text)
+    return items
+
+def repaint_time(view):
+    start = time.perf_counter()
+    for _ in range(REPAINTS):
+        view.viewport().repaint()
+    return (time.perf_counter() - start) / REPAINTS
+
+if __name__ == "__main__":
+    app = QtWidgets.QApplication(sys.argv)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    scene = QtWidgets.QGraphicsScene(0, 0, WORLD, WORLD)
+    view = View()
+    view.setScene(scene)
+    view.resize(1000, 1000)
+    view.show()
+    items = make_items(count)
+    for item in items:
+        scene.addItem(item)
+    view.index_items(items)
+    view.lod_builder.clear()  # levels are built below, not in the event loop
+    view.fitInView(scene.sceneRect())
+    app.processEvents()
+    full = repaint_time(view)
+    start = time.perf_counter()
+    for item in items:
+        if isinstance(item, LodPathItem):
+            item.build_levels()
+    build = time.perf_counter() - start
+    lod = repaint_time(view)
+    print("strokes x points          {} x {}".format(count, POINTS))
+    print("zoom                      {:.3f}".format(view.transform().m11()))
+    print("level build (background)  {:10.1f} ms".format(build * 1000))
+    print("repaint, full paths       {:10.1f} ms".format(full * 1000))
+    print("repaint, levels of detail {:10.1f} ms".format(lod * 1000))
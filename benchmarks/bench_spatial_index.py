@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Rubber-band selection and click picking over N items : GridIndex against
+# the former full scan of scene.items() and scene.itemAt().
+#   QT_QPA_PLATFORM=offscreen python3 benchmarks/bench_spatial_index.py 100000
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+from spatial_index import GridIndex
+
+WORLD = 20000.0
+QUERIES = 200
+
+def make_items(count):
+    random.seed(1)
+    pen = QtGui.QPen(QtCore.Qt.red)
+    items = []
+    for i in range(count):
+        x, y = random.uniform(0, WORLD), random.uniform(0, WORLD)
+        if i % 2:
+            item = QtWidgets.QGraphicsLineItem(x, y, x + random.uniform(-40, 40), y + random.uniform(-40, 40))
+        else:
+            path = QtGui.QPainterPath(QtCore.QPointF(x, y))
+            for _ in range(10):
+                x, y = x + random.uniform(-8, 8), y + random.uniform(-8, 8)
+                path.lineTo(x, y)
+            item = QtWidgets.QGraphicsPathItem(path)
+        item.setPen(pen)
+        items.append(item)
+    return items
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+def scan_rect(scene, rects):
+    # former View.select_items_in_rect
+    return [[item for item in scene.items() if rect.intersects(item.sceneBoundingRect())] for rect in rects]
+
+def index_rect(index, rects):
+    return [index.query_rect(rect) for rect in rects]
+
+def scene_pick(scene, points):
+    return [scene.itemAt(point, QtGui.QTransform()) for point in points]
+
+def index_pick(index, points):
+    return [index.nearest(point, 4.0) for point in points]
+
+if __name__ == "__main__":
+    app = QtWidgets.QApplication(sys.argv)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    items = make_items(count)
+    scene = QtWidgets.QGraphicsScene(0, 0, WORLD, WORLD)
+    for item in items:
+        scene.addItem(item)
+    index = GridIndex()
+    build, _ = timed(index.rebuild, items)
+    random.seed(2)
+    rects = [QtCore.QRectF(random.uniform(0, WORLD), random.uniform(0, WORLD), 300, 200) for _ in range(QUERIES)]
+    points = [QtCore.QPointF(random.uniform(0, WORLD), random.uniform(0, WORLD)) for _ in range(QUERIES)]
+    scan, scanned = timed(scan_rect, scene, rects[:10])
+    query, queried = timed(index_rect, index, rects)
+    assert [set(a) for a in scanned] == [set(b) for b in queried[:10]]
+    pick_scene, _ = timed(scene_pick, scene, points)
+    pick_index, _ = timed(index_pick, index, points)
+    print("items                 {}".format(count))
+    print("index build           {:10.1f} ms".format(build * 1000))
+    print("rect query, full scan {:10.3f} ms".format(scan / 10 * 1000))
+    print("rect query, index     {:10.3f} ms".format(query / QUERIES * 1000))
+    print("pick, scene.itemAt    {:10.3f} ms".format(pick_scene / QUERIES * 1000))
+    print("pick, index.nearest   {:10.3f} ms".format(pick_index / QUERIES * 1000))
@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Cold start of main.py : process start to the first paint of the view,
+# with the startup report of each run. Exits with status 1 when the median
+# is over the budget.
+#   QT_QPA_PLATFORM=offscreen python3 benchmarks/bench_startup.py 5
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from startup import StartupReport
+
+def cold_start(home):
+    report = os.path.join(home, "startup.json")
+    env = dict(os.environ, HOME=home,  # no journal left by another session
+               PAINT_STARTUP_REPORT=report, PAINT_STARTUP_QUIT="1", PAINT_STALL_MS="0")
+    start = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(ROOT, "main.py")], cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    elapsed = (time.perf_counter() - start) * 1000
+    with open(report) as file:
+        return elapsed, json.load(file)
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    budget = int(os.environ.get("PAINT_STARTUP_BUDGET_MS", StartupReport.BUDGET_MS))
+    totals, processes = [], []
+    with tempfile.TemporaryDirectory() as home:
+        for _ in range(runs):
+            elapsed, report = cold_start(home)
+            processes.append(elapsed)
+            totals.append(report['total_ms'])
+            print("process {:7.1f} ms   in main.py {:7.1f} ms   {}".format(
+                elapsed, report['total_ms'],
+                "  ".join("{} {:.1f}".format(*phase) for phase in report['phases_ms'].items())))
+    median = statistics.median(totals)
+    print("median {:.1f} ms in main.py, {:.1f} ms with the interpreter, budget {} ms".format(
+        median, statistics.median(processes), budget))
+    if median > budget:
+        sys.exit("startup over budget")
@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Freehand stroke cost : legacy remove/addPath per mouse move against the
+# in-place LiveStrokeItem.
+#   QT_QPA_PLATFORM=offscreen python3 benchmarks/bench_stroke.py 10000 20000
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+from stroke import LiveStrokeItem
+
+FRAME_EVERY = 16  # mouse moves between two processed frames
+
+def stroke_points(count):
+    for i in range(count):
+        t = i / 50.0
+        yield QtCore.QPointF(300 + 250 * math.cos(t) * (1 + i / count), 200 + 150 * math.sin(1.3 * t))
+
+def legacy_stroke(app, scene, pen, count):
+    points = stroke_points(count)
+    path = QtGui.QPainterPath()
+    path.moveTo(next(points))
+    temp_item = scene.addPath(path, pen)
+    for i, point in enumerate(points):
+        path.lineTo(point)
+        scene.removeItem(temp_item)
+        temp_item = scene.addPath(path, pen)
+        if i % FRAME_EVERY == 0:
+            app.processEvents()
+    scene.removeItem(temp_item)
+    final_item = QtWidgets.QGraphicsPathItem(path)
+    final_item.setPen(QtGui.QPen(pen))
+    scene.addItem(final_item)
+    app.processEvents()
+
+def live_stroke(app, scene, pen, count):
+    points = stroke_points(count)
+    temp_item = LiveStrokeItem(next(points), pen)
+    scene.addItem(temp_item)
+    for i, point in enumerate(points):
+        temp_item.add_point(point)
+        if i % FRAME_EVERY == 0:
+            app.processEvents()
+    scene.removeItem(temp_item)
+    scene.addItem(temp_item.commit())
+    app.processEvents()
+
+def run(app, stroke, count):
+    scene = QtWidgets.QGraphicsScene(0, 0, 600, 400)
+    view = QtWidgets.QGraphicsView(scene)
+    view.resize(600, 400)
+    view.show()
+    app.processEvents()
+    pen = QtGui.QPen(QtCore.Qt.red)
+    start = time.perf_counter()
+    stroke(app, scene, pen, count)
+    elapsed = time.perf_counter() - start
+    view.close()
+    return elapsed
+
+if __name__ == "__main__":
+    app = QtWidgets.QApplication(sys.argv)
+    counts = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 20000]
+    print("{:>8} {:>12} {:>12} {:>8}".format("points", "legacy (s)", "live (s)", "speedup"))
+    for count in counts:
+        legacy = run(app, legacy_stroke, count)
+        live = run(app, live_stroke, count)
+        print("{:>8} {:>12.3f} {:>12.3f} {:>7.1f}x".format(count, legacy, live, legacy / live))
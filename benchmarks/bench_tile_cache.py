@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Repaint cost of the whole viewport over N committed strokes, with the
+# scene painting every item and with the flattened tile layer.
+#   QT_QPA_PLATFORM=offscreen python3 benchmarks/bench_tile_cache.py 100000
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+from view import View
+
+WORLD = 1000.0
+REPAINTS = 20
+
+def make_items(count):
+    random.seed(1)
+    pen = QtGui.QPen(QtCore.Qt.blue)
+    items = []
+    for _ in range(count):
+        x, y = random.uniform(0, WORLD), random.uniform(0, WORLD)
+        path = QtGui.QPainterPath(QtCore.QPointF(x, y))
+        for _ in range(10):
+            x, y = x + random.uniform(-4, 4), y + random.uniform(-4, 4)
+            path.lineTo(x, y)
+        item = QtWidgets.QGraphicsPathItem(path)
+        item.setPen(pen)
+        items.append(item)
+    return items
+
+def repaint_time(view, repaints=REPAINTS):
+    start = time.perf_counter()
+    for _ in range(repaints):
+        view.viewport().repaint()
+    return (time.perf_counter() - start) / repaints
+
+if __name__ == "__main__":
+    app = QtWidgets.QApplication(sys.argv)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    scene = QtWidgets.QGraphicsScene(0, 0, WORLD, WORLD)
+    view = View()
+    view.setScene(scene)
+    view.resize(1000, 1000)
+    view.show()
+    items = make_items(count)
+    for item in items:
+        scene.addItem(item)
+    view.index_items(items)
+    app.processEvents()
+    scene_paint = repaint_time(view, 3)
+    view.set_flattened(True)
+    start = time.perf_counter()
+    view.viewport().repaint()
+    cold = time.perf_counter() - start
+    warm = repaint_time(view)
+    print("items                     {}".format(count))
+    print("full repaint, scene       {:10.1f} ms".format(scene_paint * 1000))
+    print("full repaint, tiles cold  {:10.1f} ms".format(cold * 1000))
+    print("full repaint, tiles warm  {:10.1f} ms".format(warm * 1000))
+    print("cached tiles              {}".format(len(view.tile_cache)))
@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Rotating N selected strokes as one history entry, then undoing and
+# redoing it. The transform itself (new positions and item transforms,
+# document coords) is timed apart from the whole command, which also
+# reindexes and journals the items. Each of the rotate, undo and redo is
+# meant to stay well under a second at 50000 strokes.
+#   QT_QPA_PLATFORM=offscreen python3 benchmarks/bench_transform.py 50000
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PyQt5 import QtWidgets
+
+from bench_virtual import make_strokes
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+if __name__ == "__main__":
+    from shapes import item_id
+    from transform import rotation, transform_items
+    from window import Window
+
+    app = QtWidgets.QApplication(sys.argv)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    window = Window(dimension=(1000, 800))
+    window.autosave_timer.stop()
+    window.show()
+    app.processEvents()
+    shapes, side = make_strokes(count)
+    window.insert_shapes(shapes)
+    items = list(window.view.spatial_index.entries)
+    window.view.selection.set(items)
+    app.processEvents()
+    print("{} strokes".format(count))
+
+    center = window.selection_center()
+    transform = rotation(30, center)
+    (old, new), items_ms = timed(transform_items, items, transform)
+    ids = [item_id(item) for item in items]
+    _, document_ms = timed(window.document.transform, ids, transform)
+    _, back_ms = timed(window.document.transform, ids, transform.inverted()[0])
+    print("{:24} {:10.0f}".format("transform_items ms", items_ms))
+    print("{:24} {:10.0f}".format("Document.transform ms", document_ms))
+
+    _, rotate_ms = timed(window.transform_selection, lambda center: rotation(30, center))
+    _, undo_ms = timed(window.view.undo)
+    _, redo_ms = timed(window.view.redo)
+    _, repaint_ms = timed(window.view.viewport().repaint)
+    print("{:24} {:10.0f}".format("rotate command ms", rotate_ms))
+    print("{:24} {:10.0f}".format("undo ms", undo_ms))
+    print("{:24} {:10.0f}".format("redo ms", redo_ms))
+    print("{:24} {:10.0f}".format("repaint ms", repaint_ms))
+    window.journal.discard()
@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Loading N strokes spread over a large drawing with every item live
+# against virtual items, each mode in its own process so the resident set
+# growth (Linux) is its own. Also times a scroll across the drawing.
+#   QT_QPA_PLATFORM=offscreen python3 benchmarks/bench_virtual.py 1000000
+import gc
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+MODES = ("full", "virtual")
+
+def make_strokes(count, seed=1):
+    # Strokes about 40 units apart, whatever the count
+    random.seed(seed)
+    side = math.sqrt(count) * 40
+    shapes = []
+    for _ in range(count):
+        x, y = random.uniform(0, side), random.uniform(0, side)
+        points = []
+        for _ in range(10):
+            points.append((x, y))
+            x, y = x + random.uniform(-4, 4), y + random.uniform(-4, 4)
+        shapes.append({'type': 'path', 'path': [points], 'color': '#0000ff', 'width': 1})
+    return shapes, side
+
+def resident():
+    gc.collect()
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def run(count, mode):
+    from PyQt5 import QtWidgets
+    from window import Window
+
+    app = QtWidgets.QApplication(sys.argv)
+    window = Window(dimension=(1000, 800))
+    window.autosave_timer.stop()
+    window.resize(1000, 800)
+    window.show()
+    app.processEvents()
+    window.action_tools_virtual.setChecked(mode == "virtual")
+    shapes, side = make_strokes(count)
+
+    before = resident()
+    start = time.perf_counter()
+    window.insert_shapes(shapes)
+    window.view.viewport().repaint()
+    insert_ms = (time.perf_counter() - start) * 1000
+    grown = resident() - before
+    del shapes
+
+    start = time.perf_counter()
+    steps = 20
+    for step in range(steps):
+        window.view.centerOn(side * step / steps, side * step / steps)
+        window.virtualizer.sync()
+        window.view.viewport().repaint()
+    scroll_ms = (time.perf_counter() - start) * 1000 / steps
+    print("{:8} {:12.0f} {:12.0f} {:12.1f} {:12}".format(mode, insert_ms, grown / count, scroll_ms,
+                                                        len(window.view.spatial_index)))
+    window.journal.discard()
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    if len(sys.argv) > 2:
+        run(count, sys.argv[2])
+    else:
+        print("{} strokes".format(count))
+        print("{:8} {:>12} {:>12} {:>12} {:>12}".format("", "load ms", "bytes/shape", "scroll ms", "live items"))
+        sys.stdout.flush()
+        for mode in MODES:
+            subprocess.run([sys.executable, os.path.abspath(__file__), str(count), mode], check=True)
@@ -0,0 +1,421 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Headless benchmark suite : drives Window/View with synthetic mouse and key
+# events for every tool, times saving and loading documents of several
+# sizes, writes the timings as JSON and compares them to a stored baseline.
+# baseline.json keeps one baseline per environment (CPU, Python, Qt...) :
+# timings are only compared with the one taken on the same environment.
+#   python3 benchmarks/suite.py                      compare to the baseline of
+#                                                    this environment, created
+#                                                    by its first run
+#   python3 benchmarks/suite.py --update-baseline    store a new baseline
+#   python3 benchmarks/suite.py --sizes 1000,1000000 --output results.json
+# Exits with status 1 when a timing is slower than its baseline by more
+# than --tolerance, or a streaming load slower than a blocking load of the
+# same file by more than --streaming-factor.
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+from PyQt5.QtTest import QTest
+
+from shapes import item_id
+from window import Window
+from binary_format import SUFFIX as BINARY_SUFFIX
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+SIZES = (1000, 10000, 100000, 1000000)
+TOLERANCE = 0.25    # allowed slowdown against the baseline
+STREAMING_FACTOR = 3.0  # allowed slowdown of a streaming load against a blocking one
+MIN_DELTA_MS = 5.0  # smaller differences are noise
+FRAME_EVERY = 16    # synthetic events between two processed frames
+WINDOW_SIZE = (1000, 800)
+DRAWING = QtCore.QRectF(100, 100, 800, 600)  # scene area of generated items
+# Documents from this size are loaded with Tools > Virtualize off-screen
+# items, as the whole drawing's items would not fit in memory, and spread
+# over a larger area with the item density of a 10k items document.
+VIRTUAL_ITEMS = 1000000
+
+# Synthetic input
+
+def mouse(view, kind, pos, button=QtCore.Qt.LeftButton, modifiers=QtCore.Qt.NoModifier):
+    buttons = QtCore.Qt.NoButton if kind == QtCore.QEvent.MouseButtonRelease else button
+    event = QtGui.QMouseEvent(kind, QtCore.QPointF(pos), button, buttons, modifiers)
+    QtWidgets.QApplication.sendEvent(view.viewport(), event)
+
+def click(view, pos):
+    mouse(view, QtCore.QEvent.MouseButtonPress, pos)
+    mouse(view, QtCore.QEvent.MouseButtonRelease, pos)
+
+def drag(app, view, points):
+    # Press at the first point, move through the others, release at the last
+    points = list(points)
+    mouse(view, QtCore.QEvent.MouseButtonPress, points[0])
+    for i, point in enumerate(points[1:]):
+        mouse(view, QtCore.QEvent.MouseMove, point)
+        if i % FRAME_EVERY == 0:
+            app.processEvents()
+    mouse(view, QtCore.QEvent.MouseButtonRelease, points[-1])
+    app.processEvents()
+
+def key(widget, key, modifiers=QtCore.Qt.NoModifier):
+    # Through QTest so that shortcuts (Ctrl+Z...) are dispatched as well
+    QTest.keyClick(widget, key, modifiers)
+
+def line_points(start, end, count):
+    for i in range(count + 1):
+        t = i / count
+        yield QtCore.QPoint(round(start.x() + (end.x() - start.x()) * t), round(start.y() + (end.y() - start.y()) * t))
+
+def star_points(center, count):
+    # Polygon vertices : none of them comes back near the first one, which
+    # would close the polygon
+    yield center + QtCore.QPoint(350, 0)
+    for i in range(1, count):
+        angle, radius = 2 * math.pi * i / count, 300 if i % 2 else 100
+        yield QtCore.QPoint(round(center.x() + radius * math.cos(angle)), round(center.y() + radius * math.sin(angle)))
+
+def spiral_points(center, count):
+    for i in range(count):
+        t = i / 50.0
+        radius = 50 + 250 * i / count
+        yield QtCore.QPoint(round(center.x() + radius * math.cos(t)), round(center.y() + radius * math.sin(t)))
+
+# Documents
+
+def make_shapes(count, seed=1, area=DRAWING):
+    random.seed(seed)
+    shapes = []
+    for _ in range(count):
+        x, y = random.uniform(area.left(), area.right()), random.uniform(area.top(), area.bottom())
+        points = []
+        for _ in range(10):
+            points.append((x, y))
+            x, y = x + random.uniform(-4, 4), y + random.uniform(-4, 4)
+        shapes.append({'type': 'path', 'path': [points], 'color': '#0000ff', 'width': 1})
+    return shapes
+
+def new_document(window):
+    # As File > New without the prompt : the journal forgets the old items
+    window.clear_scene()
+    window.set_clean(None)
+
+def populate(app, window, count, area=DRAWING):
+    new_document(window)
+    window.insert_shapes(make_shapes(count, area=area))
+    app.processEvents()
+
+def spread_area(count):
+    # DRAWING scaled to hold count items at the density of 10k items
+    scale = max(math.sqrt(count / 10000), 1.0)
+    return QtCore.QRectF(DRAWING.topLeft(), DRAWING.size() * scale)
+
+def wait_for_save(app, window):
+    while window.saver.is_busy():
+        app.processEvents()
+        time.sleep(0.001)
+    app.processEvents()
+
+def wait_for_load(app, window):
+    # The loader is dropped once it has finished or failed
+    while window.loader is not None:
+        app.processEvents()
+        time.sleep(0.001)
+    app.processEvents()
+
+# Scenarios : each returns {metric: milliseconds}
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return (time.perf_counter() - start) * 1000
+
+def pen_stroke(app, window, points):
+    new_document(window)
+    view = window.view
+    view.tool = "pen"
+    center = view.mapFromScene(DRAWING.center())
+    return {'pen_stroke.{}_points'.format(points): timed(drag, app, view, spiral_points(center, points))}
+
+def rubber_band(app, window, items):
+    populate(app, window, items)
+    view = window.view
+    view.tool = "select"
+    start = view.mapFromScene(DRAWING.topLeft() - QtCore.QPointF(50, 50))
+    end = view.mapFromScene(DRAWING.center())
+    elapsed = timed(drag, app, view, line_points(start, end, 50))
+    assert view.selection, "rubber band selected nothing"
+    return {'rubber_band.{}_items'.format(items): elapsed}
+
+def drag_move(app, window, items):
+    populate(app, window, items)
+    view = window.view
+    view.tool = "select"
+    view.selection.set(view.spatial_index.query_rect(DRAWING))
+    # the press lands on the first point of a stroke, every stroke is selected
+    grabbed = next(iter(view.selection))
+    start = view.mapFromScene(grabbed.mapToScene(grabbed.path().pointAtPercent(0)))
+    elapsed = timed(drag, app, view, line_points(start, start + QtCore.QPoint(200, 100), 50))
+    assert grabbed.pos() != QtCore.QPointF(), "drag did not move the selection"
+    return {'drag_move.{}_items'.format(items): elapsed}
+
+def polygon(app, window, vertices):
+    new_document(window)
+    view = window.view
+    view.tool = "polygon"
+    center = view.mapFromScene(DRAWING.center())
+    def draw():
+        for i, point in enumerate(star_points(center, vertices)):
+            click(view, point)
+            mouse(view, QtCore.QEvent.MouseMove, point + QtCore.QPoint(3, 3), QtCore.Qt.NoButton)
+            if i % FRAME_EVERY == 0:
+                app.processEvents()
+        view.finish_polygon()
+        app.processEvents()
+    elapsed = timed(draw)
+    assert len(view.scene().items()) == 1, "polygon left items in the scene"
+    return {'polygon.{}_vertices'.format(vertices): elapsed}
+
+def nudges(app, window, items):
+    populate(app, window, items)
+    view = window.view
+    view.tool = "select"
+    view.selection.set(view.spatial_index.query_rect(DRAWING))
+    def press():
+        for i in range(100):
+            key(view, QtCore.Qt.Key_Right, QtCore.Qt.ShiftModifier if i % 2 else QtCore.Qt.NoModifier)
+        app.processEvents()
+    return {'nudge_keys.{}_items'.format(items): timed(press)}
+
+def virtual_undo(app, window, items):
+    # Transform, scroll away, spill the history, undo : the transformed
+    # items come back where they were. They were edited before items went
+    # virtual, so the history rebuilds them from its records.
+    populate(app, window, items, spread_area(items * 25))
+    view = window.view
+    view.tool = "select"
+    view.selection.set(view.spatial_index.query_rect(DRAWING))
+    before = {item_id(item): item.sceneBoundingRect() for item in view.selection}
+    view.transform_selection(QtGui.QTransform().rotate(30))
+    view.selection.clear()
+    window.set_virtual(True)
+    max_entries, view.history.max_entries = view.history.max_entries, 1
+    try:
+        view.centerOn(view.sceneRect().bottomRight())
+        window.virtualizer.sync()
+        for item in view.spatial_index.query_rect(view.mapToScene(view.viewport().rect()).boundingRect())[:3]:
+            view.selection.set([item])
+            key(view, QtCore.Qt.Key_Right)
+        view.selection.clear()
+        assert view.history.memory_usage()['spilled_entries'], "the transform was not spilled"
+        def undo_all():
+            while view.history.can_undo():
+                key(window, QtCore.Qt.Key_Z, QtCore.Qt.ControlModifier)
+            app.processEvents()
+        elapsed = timed(undo_all)
+        view.centerOn(DRAWING.center())
+        window.virtualizer.sync()
+        for id_, rect in before.items():
+            moved = window.virtualizer.items[id_].sceneBoundingRect()
+            assert max(abs(a - b) for a, b in zip(moved.getCoords(), rect.getCoords())) < 1e-6, \
+                "undo did not restore a virtual item"
+    finally:
+        view.history.max_entries = max_entries
+        new_document(window)
+        window.set_virtual(False)
+    return {'virtual_undo.{}_items'.format(items): elapsed}
+
+def undo_redo(app, window, commands):
+    new_document(window)
+    view = window.view
+    view.tool = "pen"
+    for i in range(commands):
+        start = view.mapFromScene(DRAWING.topLeft()) + QtCore.QPoint(i % 700, (i // 700) % 500)
+        drag(app, view, line_points(start, start + QtCore.QPoint(10, 5), 4))
+    def storm(shortcut):
+        for _ in range(commands):
+            key(window, QtCore.Qt.Key_Z if shortcut == "undo" else QtCore.Qt.Key_Y, QtCore.Qt.ControlModifier)
+        app.processEvents()
+    undo = timed(storm, "undo")
+    assert not view.scene().items(), "Ctrl+Z did not undo every stroke"
+    redo = timed(storm, "redo")
+    return {'undo_storm.{}_commands'.format(commands): undo, 'redo_storm.{}_commands'.format(commands): redo}
+
+def save_load(app, window, items):
+    virtual = items >= VIRTUAL_ITEMS
+    window.set_virtual(virtual)
+    populate(app, window, items, spread_area(items) if virtual else DRAWING)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for suffix in (".json", BINARY_SUFFIX):
+            name = "{}.{}_items".format(suffix.lstrip("."), items)
+            filename = os.path.join(directory, "document" + suffix)
+            start = time.perf_counter()
+            window.save_shapes(filename)
+            results['save_blocking.' + name] = (time.perf_counter() - start) * 1000
+            wait_for_save(app, window)
+            results['save.' + name] = (time.perf_counter() - start) * 1000
+            # as File > Open of a large file : items are added in slices
+            # between frames
+            start = time.perf_counter()
+            window.load_shapes_streaming(filename)
+            results['load_start.' + name] = (time.perf_counter() - start) * 1000
+            wait_for_load(app, window)
+            results['load.' + name] = (time.perf_counter() - start) * 1000
+            assert len(window.document) == items, "load lost items"
+            # and of a small one : at once, up to the first repaint
+            start = time.perf_counter()
+            window.load_shapes(filename)
+            app.processEvents()
+            results['load_blocking.' + name] = (time.perf_counter() - start) * 1000
+            assert len(window.document) == items, "load lost items"
+    new_document(window)
+    window.set_virtual(False)
+    return results
+
+def interaction_scenarios():
+    return [(pen_stroke, 2000), (pen_stroke, 20000),
+            (rubber_band, 10000), (rubber_band, 100000),
+            (drag_move, 1000), (drag_move, 10000),
+            (polygon, 1000),
+            (nudges, 10000),
+            (undo_redo, 500),
+            (virtual_undo, 20000)]
+
+# Runner
+
+def run(sizes, repeat, only=None):
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+    scenarios = interaction_scenarios() + [(save_load, size) for size in sizes]
+    if only:
+        scenarios = [(s, n) for s, n in scenarios if s.__name__ in only]
+    samples = {}
+    window = Window(dimension=WINDOW_SIZE)
+    window.autosave_timer.stop()  # no journal compaction in the timed scenarios
+    window.resize(*WINDOW_SIZE)
+    window.show()
+    app.processEvents()
+    for scenario, size in scenarios:
+        # documents over 100k items are only timed once
+        for _ in range(repeat if size < 100000 or scenario is not save_load else 1):
+            for metric, value in scenario(app, window, size).items():
+                samples.setdefault(metric, []).append(value)
+        print("{:<12} {:>8}".format(scenario.__name__, size), file=sys.stderr)
+    new_document(window)
+    window.close()
+    return {metric: round(statistics.median(values), 3) for metric, values in samples.items()}
+
+def compare(results, baseline, tolerance):
+    # Prints every metric against the baseline, returns the regressions
+    regressions = []
+    print("{:<40} {:>12} {:>12} {:>8}".format("metric", "baseline ms", "current ms", "ratio"))
+    for metric, value in sorted(results.items()):
+        reference = baseline.get(metric)
+        if reference is None:
+            print("{:<40} {:>12} {:>12.1f} {:>8}".format(metric, "-", value, "new"))
+            continue
+        ratio = value / reference if reference else float('inf')
+        slower = value > reference * (1 + tolerance) and value - reference > MIN_DELTA_MS
+        if slower:
+            regressions.append(metric)
+        print("{:<40} {:>12.1f} {:>12.1f} {:>7.2f}x{}".format(metric, reference, value, ratio,
+                                                            "  REGRESSION" if slower else ""))
+    return regressions
+
+def check_streaming(results, factor):
+    # Streaming loads against blocking loads of the same file, whatever the
+    # baseline : returns the slower ones
+    slow = []
+    for metric, value in sorted(results.items()):
+        if metric.startswith('load.'):
+            blocking = results.get('load_blocking.' + metric[len('load.'):])
+            if blocking is not None and value > blocking * factor and value - blocking > MIN_DELTA_MS:
+                print("{:<40} {:>12.1f} {:>12.1f} {:>7.2f}x  STREAMING OVERHEAD".format(
+                    metric, blocking, value, value / blocking))
+                slow.append(metric)
+    return slow
+
+def cpu_name():
+    try:
+        with open("/proc/cpuinfo") as file:
+            for line in file:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+def environment():
+    # What the timings depend on : baselines are only compared on the same
+    return {'python': platform.python_version(), 'qt': QtCore.QT_VERSION_STR, 'pyqt': QtCore.PYQT_VERSION_STR,
+            'machine': platform.machine(), 'system': platform.system(), 'platform': os.environ["QT_QPA_PLATFORM"],
+            'cpu': cpu_name(), 'cpus': os.cpu_count()}
+
+def read_baselines(filename):
+    # [{'environment': ..., 'results': ...}], one per environment
+    if not os.path.exists(filename):
+        return []
+    with open(filename) as file:
+        stored = json.load(file)
+    if 'baselines' not in stored:
+        return [stored]  # a single baseline, as first written
+    return stored['baselines']
+
+def write_baselines(filename, baselines):
+    with open(filename, 'w') as file:
+        json.dump({'baselines': baselines}, file, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless benchmark suite")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in SIZES),
+                        help="document sizes for save/load, comma separated")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per scenario, the median is kept")
+    parser.add_argument("--only", help="scenario names to run, comma separated")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--streaming-factor", type=float, default=STREAMING_FACTOR,
+                        help="allowed ratio of streaming to blocking load times")
+    parser.add_argument("--update-baseline", action="store_true", help="store the results as the new baseline")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    results = run(sizes, args.repeat, args.only.split(",") if args.only else None)
+    report = {'environment': environment(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+    slow = check_streaming(results, args.streaming_factor)
+    if slow:
+        print("\n{} streaming load(s) over {}x a blocking one: {}".format(len(slow), args.streaming_factor,
+                                                                          ", ".join(slow)), file=sys.stderr)
+    baselines = read_baselines(args.baseline)
+    baseline = next((entry for entry in baselines if entry['environment'] == report['environment']), None)
+    if args.update_baseline or baseline is None:
+        if baseline is None:
+            # timings taken elsewhere say nothing about this environment
+            print("no baseline for this environment ({cpu}, Python {python}, Qt {qt})".format(**report['environment']))
+            baseline = {'environment': report['environment'], 'results': {}}
+            baselines.append(baseline)
+        baseline['results'].update(results)
+        write_baselines(args.baseline, baselines)
+        print("baseline written to {}".format(args.baseline))
+        sys.exit(1 if slow else 0)
+    regressions = compare(results, baseline['results'], args.tolerance)
+    if regressions:
+        print("\n{} REGRESSION(S) over {:.0%}: {}".format(len(regressions), args.tolerance, ", ".join(regressions)),
+              file=sys.stderr)
+    if regressions or slow:
+        sys.exit(1)
+    print("\nno regression")
@@ -0,0 +1,278 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Compact binary shape format (.pbin), the native alternative to JSON.
+#
+#   header | styles | items | runs | coords | strings | string blob
+#
+# Every table is a fixed-width NumPy record array aligned on 8 bytes.
+# Styles (pen color/width, brush color/style) are stored once and shared
+# by index, every point of every shape lives in one contiguous float64
+# coords array, and runs are (offset, length) slices of it : one run per
+# line, rect (x, y), (w, h), polygon or path subpath. Text and font strings
+# are UTF-8 slices of the blob. Reading maps the file and only builds
+# NumPy views on it.
+#
+# Conversion : python3 binary_format.py drawing.json drawing.pbin
+#              python3 binary_format.py drawing.pbin drawing.json
+import json
+import mmap
+import struct
+import sys
+
+import numpy as np
+
+SUFFIX = ".pbin"
+MAGIC = b"PAINTBIN"
+VERSION = 2
+
+HEADER = struct.Struct("<8sIIQQQQ")  # magic, version, reserved, styles, items, runs, coords
+STRING_HEADER = struct.Struct("<QQ")  # strings, blob size
+
+KINDS = ['line', 'rect', 'path', 'polygon', 'text']
+KIND_CODES = {kind: code for code, kind in enumerate(KINDS)}
+NO_STRING = 0xffffffff
+
+STYLE_DTYPE = np.dtype([
+    ('color', '<u4'),
+    ('width', '<i4'),
+    ('brush_color', '<u4'),
+    ('brush_style', '<i4'),
+])
+
+ITEM_DTYPE = np.dtype([
+    ('id', '<u8'),     # 0 when the record had no id
+    ('kind', 'u1'),
+    ('has_pos', 'u1'),
+    ('style', '<u4'),
+    ('pos', '<f8', (2,)),
+    ('first_run', '<u4'),
+    ('run_count', '<u4'),
+    ('text', '<u4'),   # string index of the text, NO_STRING otherwise
+    ('font', '<u4'),   # string index of the font description
+], align=True)
+
+RUN_DTYPE = np.dtype([
+    ('offset', '<u8'),  # in points
+    ('length', '<u8'),
+])
+
+STRING_DTYPE = np.dtype([
+    ('offset', '<u8'),  # in bytes
+    ('length', '<u8'),
+])
+
+def is_binary(filename):
+    return filename.lower().endswith(SUFFIX)
+
+def color_code(name):
+    return int(name[1:], 16)
+
+def color_name(code):
+    return "#{:06x}".format(int(code))
+
+def aligned(size):
+    return (size + 7) & ~7
+
+def shape_runs(shape):
+    kind = shape['type']
+    if kind == 'line':
+        return [[shape['start'], shape['end']]]
+    if kind == 'rect':
+        x, y, w, h = shape['rect']
+        return [[(x, y), (w, h)]]
+    if kind == 'path':
+        return shape['path']
+    if kind == 'polygon':
+        return [shape['points']]
+    return []
+
+def write_binary(filename, shapes):
+    styles, style_index = [], {}
+    strings, string_index = [], {}
+
+    def intern_string(text):
+        if text not in string_index:
+            string_index[text] = len(strings)
+            strings.append(text.encode('utf-8'))
+        return string_index[text]
+
+    items = []
+    runs = []
+    coords = []
+    point_count = 0
+    for shape in shapes:
+        kind = shape['type']
+        if kind not in KIND_CODES:
+            continue
+        key = (color_code(shape['color']), shape.get('width', 0),
+               color_code(shape.get('brush-color', '#000000')), int(shape.get('brush-style', 0)))
+        if key not in style_index:
+            style_index[key] = len(styles)
+            styles.append(key)
+        shape_runs_ = shape_runs(shape)
+        first_run = len(runs)
+        for run in shape_runs_:
+            run = np.asarray(run, dtype=np.float64).reshape(-1, 2)
+            runs.append((point_count, len(run)))
+            coords.append(run)
+            point_count += len(run)
+        text = intern_string(shape['text']) if kind == 'text' else NO_STRING
+        font = intern_string(shape['font']) if kind == 'text' else NO_STRING
+        pos = shape.get('pos')
+        items.append((shape.get('id', 0), KIND_CODES[kind], pos is not None, style_index[key],
+                      pos if pos is not None else (0.0, 0.0), first_run, len(shape_runs_), text, font))
+
+    write_tables(filename, np.array(styles, dtype=STYLE_DTYPE), np.array(items, dtype=ITEM_DTYPE),
+                 np.array(runs, dtype=RUN_DTYPE),
+                 np.concatenate(coords) if coords else np.empty((0, 2), dtype=np.float64), strings)
+
+def write_tables(filename, style_table, item_table, run_table, coord_table, strings):
+    # strings : UTF-8 encoded bytes, indexed by the text and font of items
+    blob = b"".join(strings)
+    string_table = np.zeros(len(strings), dtype=STRING_DTYPE)
+    if strings:
+        lengths = np.array([len(s) for s in strings], dtype=np.uint64)
+        string_table['length'] = lengths
+        string_table['offset'][1:] = np.cumsum(lengths)[:-1]
+
+    with open(filename, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, 0, len(style_table), len(item_table), len(run_table), len(coord_table)))
+        file.write(STRING_HEADER.pack(len(string_table), len(blob)))
+        for table in (style_table, item_table, run_table, coord_table, string_table):
+            data = table.tobytes()
+            file.write(data)
+            file.write(b"\0" * (aligned(len(data)) - len(data)))
+        file.write(blob)
+
+class BinaryDocument:
+    # Read-only view of a .pbin file, every table is a NumPy view on the map.
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            self.file.close()
+            raise ValueError("empty shape file")
+        magic, version, _, styles, items, runs, coords = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("not a binary shape file")
+        if version != VERSION:
+            self.close()
+            raise ValueError("unsupported binary shape file version {}".format(version))
+        strings, blob_size = STRING_HEADER.unpack_from(self.map, HEADER.size)
+        offset = HEADER.size + STRING_HEADER.size
+        self.styles, offset = self.table(STYLE_DTYPE, styles, offset)
+        self.items, offset = self.table(ITEM_DTYPE, items, offset)
+        self.runs, offset = self.table(RUN_DTYPE, runs, offset)
+        self.coords, offset = self.table(np.dtype(('<f8', (2,))), coords, offset)
+        self.strings, offset = self.table(STRING_DTYPE, strings, offset)
+        self.blob = memoryview(self.map)[offset:offset + blob_size]
+
+    def table(self, dtype, count, offset):
+        view = np.frombuffer(self.map, dtype=dtype, count=count, offset=offset)
+        return view, offset + aligned(dtype.itemsize * count)
+
+    def __len__(self):
+        return len(self.items)
+
+    def close(self):
+        # Views kept by the caller, e.g. the tables a Document took over,
+        # keep the file mapped until they are gone
+        self.styles = self.items = self.runs = self.coords = self.strings = None
+        if getattr(self, 'blob', None) is not None:
+            self.blob.release()
+            self.blob = None
+        if getattr(self, 'map', None) is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                pass
+            self.map = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def string(self, index):
+        offset, length = self.strings[index]
+        return bytes(self.blob[offset:offset + length]).decode('utf-8')
+
+    def string_list(self):
+        # Every string, decoded in one pass over the blob
+        blob = bytes(self.blob)
+        return [blob[offset:offset + length].decode('utf-8')
+                for offset, length in zip(self.strings['offset'].tolist(), self.strings['length'].tolist())]
+
+    def run(self, index):
+        offset, length = self.runs[index]
+        return self.coords[offset:offset + length]
+
+    def shape(self, index):
+        # Geometry of the returned record is a view on the map : copy it if
+        # it has to outlive the document.
+        item = self.items[index]
+        kind = KINDS[item['kind']]
+        style = self.styles[item['style']]
+        shape = {'type': kind, 'color': color_name(style['color'])}
+        if item['id']:
+            shape['id'] = int(item['id'])
+        first, count = int(item['first_run']), int(item['run_count'])
+        if kind == 'line':
+            (x1, y1), (x2, y2) = self.run(first)
+            shape['start'], shape['end'] = (float(x1), float(y1)), (float(x2), float(y2))
+        elif kind == 'rect':
+            (x, y), (w, h) = self.run(first)
+            shape['rect'] = (float(x), float(y), float(w), float(h))
+        elif kind == 'path':
+            shape['path'] = [self.run(i) for i in range(first, first + count)]
+        elif kind == 'polygon':
+            shape['points'] = self.run(first)
+        if kind == 'text':
+            shape['text'] = self.string(item['text'])
+            shape['font'] = self.string(item['font'])
+        else:
+            shape['width'] = int(style['width'])
+        if kind in ('rect', 'polygon'):
+            shape['brush-color'] = color_name(style['brush_color'])
+            shape['brush-style'] = int(style['brush_style'])
+        if item['has_pos']:
+            shape['pos'] = (float(item['pos'][0]), float(item['pos'][1]))
+        return shape
+
+    def shapes(self):
+        for index in range(len(self.items)):
+            yield self.shape(index)
+
+def read_binary(filename):
+    # Plain JSON-compatible records, detached from the file.
+    shapes = []
+    with BinaryDocument(filename) as document:
+        for shape in document.shapes():
+            if shape['type'] == 'path':
+                shape['path'] = [run.tolist() for run in shape['path']]
+            elif shape['type'] == 'polygon':
+                shape['points'] = shape['points'].tolist()
+            shapes.append(shape)
+    return shapes
+
+def json_to_binary(source, destination):
+    with open(source, 'r') as file:
+        write_binary(destination, json.load(file))
+
+def binary_to_json(source, destination):
+    with open(destination, 'w') as file:
+        json.dump(read_binary(source), file)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage : binary_format.py <input.json|input.pbin> <output.pbin|output.json>")
+        sys.exit(1)
+    source, destination = sys.argv[1:]
+    if is_binary(source):
+        binary_to_json(source, destination)
+    else:
+        json_to_binary(source, destination)
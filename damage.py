@@ -0,0 +1,62 @@
+import collections
+
+from PyQt5 import QtCore, QtGui
+
+class DamageRegion(QtCore.QObject):
+    # Viewport rects reported by the tools are united and handed to the
+    # widget at most once per FRAME_MS, however many mouse moves arrive in
+    # between. The first damage after an idle frame is flushed at once.
+    FRAME_MS = 16
+
+    def __init__(self, widget, parent=None):
+        super().__init__(parent)
+        self.widget = widget
+        self.region = QtGui.QRegion()
+        self.clock = QtCore.QElapsedTimer()
+        self.clock.start()
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.flush)
+
+    def add(self, rect):
+        if rect.isEmpty():
+            return
+        self.region = self.region.united(rect)
+        if not self.timer.isActive():
+            self.timer.start(max(0, self.FRAME_MS - self.clock.elapsed()))
+
+    def flush(self):
+        self.timer.stop()
+        self.clock.restart()
+        if not self.region.isEmpty():
+            self.widget.update(self.region)
+            self.region = QtGui.QRegion()
+
+class RepaintMeter:
+    # Pixels repainted over the last WINDOW_MS, fed from paintEvent
+    WINDOW_MS = 1000
+
+    def __init__(self):
+        self.clock = QtCore.QElapsedTimer()
+        self.clock.start()
+        self.samples = collections.deque()  # (time ms, pixels)
+        self.pixels = 0
+        self.total = 0
+        self.paints = 0
+
+    def add(self, region):
+        pixels = sum(rect.width() * rect.height() for rect in region.rects())
+        self.samples.append((self.clock.elapsed(), pixels))
+        self.pixels += pixels
+        self.total += pixels
+        self.paints += 1
+        self.expire()
+
+    def expire(self):
+        limit = self.clock.elapsed() - self.WINDOW_MS
+        while self.samples and self.samples[0][0] < limit:
+            self.pixels -= self.samples.popleft()[1]
+
+    def pixels_per_second(self):
+        self.expire()
+        return self.pixels * 1000 // self.WINDOW_MS
@@ -0,0 +1,617 @@
+import json
+import sys
+
+import numpy as np
+
+from binary_format import (KINDS, KIND_CODES, NO_STRING, ITEM_DTYPE, RUN_DTYPE, STYLE_DTYPE,
+                           color_code, color_name, shape_runs, write_tables)
+from shapes import claim_item_id, in_document, item_id, item_to_shape, new_item_id, shapes_to_items
+import shapes as shape_ids
+
+# Compact model of the drawing, the source of truth for saving, searching
+# and bulk edits : none of them touches a Qt object.
+#
+# It holds the tables of the binary format in growable NumPy arrays : one
+# row per shape with its scene bounds, (offset, length) runs into a single
+# float64 coords array, shared styles and interned strings. Rows are found
+# by item id, 'order' is the stacking order and survives edits. Scene items
+# are built from rows. Commands edit the rows first and their items are
+# then updated from the changed rows, see View.run_command : moves and
+# transforms work in place on the arrays, deletes take rows out and
+# undoing them puts the same rows back.
+# Removed rows and replaced geometry are garbage until compact() packs the
+# arrays, which happens on its own once garbage outweighs live data.
+# A binary file loaded into an empty document lends it its runs and coords
+# as read-only views on the mapped file : they are copied by writable()
+# before the first edit that writes them in place.
+
+ROW_DTYPE = np.dtype([
+    ('id', '<u8'),
+    ('order', '<u8'),
+    ('kind', 'u1'),
+    ('has_pos', 'u1'),
+    ('alive', 'u1'),
+    ('style', '<u4'),
+    ('pos', '<f8', (2,)),
+    ('first_run', '<u4'),
+    ('run_count', '<u4'),
+    ('text', '<u4'),
+    ('font', '<u4'),
+    ('bounds', '<f8', (4,)),  # scene left, top, right, bottom of the geometry, pen excluded,
+                              # estimated from the font size for text
+], align=True)
+
+RECT = KIND_CODES['rect']
+TEXT = KIND_CODES['text']
+
+def text_extent(text, font):
+    # Rough width and height of a text item from its QFont string, a point
+    # size of -1 means the font has a pixel size
+    fields = font.split(',')
+    try:
+        size = float(fields[1]) if float(fields[1]) > 0 else float(fields[2]) * 0.75
+    except (IndexError, ValueError):
+        size = 12.0
+    lines = text.split('\n')
+    return max(len(line) for line in lines) * size * 0.8 + 8, len(lines) * size * 1.6 + 8
+
+def exclusive_sum(counts):
+    # Start of each group of counts laid end to end
+    starts = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(counts[:-1], out=starts[1:])
+    return starts
+
+def ranges(starts, counts):
+    # Concatenation of range(start, start + count) for every pair
+    counts = counts.astype(np.int64)
+    return np.repeat(starts.astype(np.int64) - exclusive_sum(counts), counts) + np.arange(counts.sum())
+
+def grown(array, used, size):
+    # array, or a larger copy of its used part, with room for size rows
+    if size <= len(array):
+        return array
+    larger = np.zeros((max(size, 2 * len(array), 64),) + array.shape[1:], dtype=array.dtype)
+    larger[:used] = array[:used]
+    return larger
+
+def json_shape(shape):
+    # Record with its NumPy geometry turned into lists
+    if shape['type'] == 'path':
+        shape['path'] = [run.tolist() for run in shape['path']]
+    elif shape['type'] == 'polygon':
+        shape['points'] = shape['points'].tolist()
+    return shape
+
+class Document:
+    COMPACT_MIN = 1 << 16  # garbage points or rows tolerated before compacting
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.rows = np.zeros(0, dtype=ROW_DTYPE)
+        self.row_count = 0
+        self.runs = np.zeros(0, dtype=RUN_DTYPE)
+        self.run_count = 0
+        self.coords = np.zeros((0, 2), dtype=np.float64)
+        self.point_count = 0
+        self.styles = np.zeros(0, dtype=STYLE_DTYPE)
+        self.style_index = {}  # style tuple -> row of self.styles
+        self.strings = []
+        self.string_index = {}
+        self.index = {}  # id -> row
+        self.next_order = 0
+        self.garbage_points = 0
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, id_):
+        return id_ in self.index
+
+    def live_rows(self):
+        return np.flatnonzero(self.rows['alive'][:self.row_count])
+
+    def ids(self, kind=None):
+        # Ids of the shapes, of one kind if given
+        rows = self.live_rows()
+        if kind is not None:
+            rows = rows[self.rows['kind'][rows] == KIND_CODES[kind]]
+        return self.rows['id'][rows]
+
+    def orders(self, ids):
+        return self.rows['order'][self.rows_of(ids)]
+
+    def rows_of(self, ids):
+        # NumPy ids hash like ints : no conversion per id
+        return np.fromiter(map(self.index.__getitem__, ids), dtype=np.int64, count=len(ids))
+
+    # Interning
+
+    def intern_style(self, key):
+        style = self.style_index.get(key)
+        if style is None:
+            style = self.style_index[key] = len(self.style_index)
+            self.styles = grown(self.styles, style, style + 1)
+            self.styles[style] = key
+        return style
+
+    def intern_string(self, text):
+        index = self.string_index.get(text)
+        if index is None:
+            index = self.string_index[text] = len(self.strings)
+            self.strings.append(text)
+        return index
+
+    def intern_styles(self, table):
+        # Rows of self.styles for a STYLE_DTYPE table, the new styles are
+        # appended at once
+        keys = table.tolist()
+        new = [key for key in dict.fromkeys(keys) if key not in self.style_index]
+        if new:
+            start = len(self.style_index)
+            self.styles = grown(self.styles, start, start + len(new))
+            self.styles[start:start + len(new)] = np.array(new, dtype=STYLE_DTYPE)
+            self.style_index.update(zip(new, range(start, start + len(new))))
+        return np.fromiter(map(self.style_index.__getitem__, keys), dtype=np.uint32, count=len(keys))
+
+    def intern_strings(self, strings):
+        # Indexes of strings in self.strings, the new ones are appended at once
+        new = [text for text in dict.fromkeys(strings) if text not in self.string_index]
+        self.string_index.update(zip(new, range(len(self.strings), len(self.strings) + len(new))))
+        self.strings.extend(new)
+        return np.fromiter(map(self.string_index.__getitem__, strings), dtype=np.uint32, count=len(strings))
+
+    # Edits
+
+    def writable(self):
+        # Copies the tables still mapped from a binary file, see add_binary.
+        # The mapping goes once the last view on it does.
+        if not self.coords.flags.writeable:
+            self.coords = self.coords.copy()
+        if not self.runs.flags.writeable:
+            self.runs = self.runs.copy()
+
+    def append_runs(self, runs):
+        self.writable()
+        runs = [np.asarray(run, dtype=np.float64).reshape(-1, 2) for run in runs]
+        size = sum(len(run) for run in runs)
+        self.coords = grown(self.coords, self.point_count, self.point_count + size)
+        self.runs = grown(self.runs, self.run_count, self.run_count + len(runs))
+        first_run = self.run_count
+        for run in runs:
+            self.runs[self.run_count] = (self.point_count, len(run))
+            self.coords[self.point_count:self.point_count + len(run)] = run
+            self.run_count += 1
+            self.point_count += len(run)
+        return first_run, len(runs), self.coords[self.point_count - size:self.point_count]
+
+    def put(self, id_, shape):
+        # Adds the record under id_, replacing the shape that had it.
+        # Returns the row, None for unsupported records.
+        kind = shape['type']
+        if kind not in KIND_CODES:
+            return None
+        old = self.index.pop(id_, None)
+        if old is not None:
+            self.kill(old)
+            order = self.rows['order'][old]
+        else:
+            order = self.next_order
+            self.next_order += 1
+        claim_item_id(id_)
+        style = self.intern_style((color_code(shape['color']), shape.get('width', 0),
+                                   color_code(shape.get('brush-color', '#000000')),
+                                   int(shape.get('brush-style', 0))))
+        first_run, run_count, points = self.append_runs(shape_runs(shape))
+        pos = shape.get('pos')
+        x, y = pos if pos is not None else (0.0, 0.0)
+        if kind == 'rect':
+            (left, top), (width, height) = points
+            bounds = (min(left, left + width), min(top, top + height),
+                      max(left, left + width), max(top, top + height))
+        elif kind == 'text':
+            width, height = text_extent(shape['text'], shape['font'])
+            bounds = (0.0, 0.0, width, height)
+        elif len(points):
+            (left, top), (right, bottom) = points.min(axis=0), points.max(axis=0)
+            bounds = (left, top, right, bottom)
+        else:
+            bounds = (0.0, 0.0, 0.0, 0.0)
+        row = self.row_count
+        self.rows = grown(self.rows, row, row + 1)
+        self.rows[row] = (id_, order, KIND_CODES[kind], pos is not None, 1, style, (x, y), first_run, run_count,
+                          self.intern_string(shape['text']) if kind == 'text' else NO_STRING,
+                          self.intern_string(shape['font']) if kind == 'text' else NO_STRING,
+                          (bounds[0] + x, bounds[1] + y, bounds[2] + x, bounds[3] + y))
+        self.row_count += 1
+        self.index[id_] = row
+        return row
+
+    def add(self, shapes):
+        # New shapes : records without an id, or with one already in use,
+        # get a fresh id. The batch is turned into tables and appended at
+        # once. Returns the ids of the added shapes.
+        rows, lengths, points = [], [], []
+        used = set()
+        for shape in shapes:
+            kind = shape['type']
+            if kind not in KIND_CODES:
+                continue
+            id_ = shape.get('id')
+            if id_ is None or id_ in self.index or id_ in used:
+                id_ = new_item_id()
+            else:
+                claim_item_id(id_)
+            used.add(id_)
+            style = self.intern_style((color_code(shape['color']), shape.get('width', 0),
+                                       color_code(shape.get('brush-color', '#000000')),
+                                       int(shape.get('brush-style', 0))))
+            runs = shape_runs(shape)
+            pos = shape.get('pos')
+            rows.append((id_, 0, KIND_CODES[kind], pos is not None, 1, style,
+                         pos if pos is not None else (0.0, 0.0), len(lengths), len(runs),
+                         self.intern_string(shape['text']) if kind == 'text' else NO_STRING,
+                         self.intern_string(shape['font']) if kind == 'text' else NO_STRING,
+                         (0.0, 0.0, 0.0, 0.0)))
+            for run in runs:
+                lengths.append(len(run))
+                points.extend(run)
+        lengths = np.array(lengths, dtype=np.uint64)
+        runs = np.zeros(len(lengths), dtype=RUN_DTYPE)
+        runs['offset'] = exclusive_sum(lengths)
+        runs['length'] = lengths
+        return self.append(np.array(rows, dtype=ROW_DTYPE), runs,
+                           np.array(points, dtype=np.float64).reshape(-1, 2))
+
+    def add_binary(self, document):
+        # Appends every record of a BinaryDocument. Only the item table is
+        # converted to rows, with array operations. Into an empty document
+        # the runs and coords are not copied : they stay views on the file,
+        # which remains mapped until the first edit copies them. Returns
+        # the ids of the added shapes.
+        items = document.items
+        styles = self.intern_styles(document.styles)
+        strings = np.append(self.intern_strings(document.string_list()), np.uint32(NO_STRING))
+        ids = items['id'].astype(np.uint64)
+        fresh = ids == 0
+        if self.index:
+            fresh |= np.isin(ids, np.fromiter(self.index, dtype=np.uint64, count=len(self.index)))
+        if not fresh.all():
+            claim_item_id(int(ids[~fresh].max()))
+        if fresh.any():
+            first = shape_ids.last_item_id + 1
+            ids[fresh] = np.arange(first, first + fresh.sum(), dtype=np.uint64)
+            claim_item_id(int(ids[fresh][-1]))
+        rows = np.zeros(len(items), dtype=ROW_DTYPE)
+        rows['id'] = ids
+        rows['kind'] = items['kind']
+        rows['has_pos'] = items['has_pos']
+        rows['alive'] = 1
+        rows['style'] = styles[items['style']]
+        rows['pos'] = items['pos']
+        rows['first_run'] = items['first_run']
+        rows['run_count'] = items['run_count']
+        rows['text'] = strings[np.minimum(items['text'], len(strings) - 1)]
+        rows['font'] = strings[np.minimum(items['font'], len(strings) - 1)]
+        return self.append(rows, document.runs, document.coords, mapped=True)
+
+    def append(self, rows, runs, coords, mapped=False):
+        # Appends rows whose runs index runs, whose offsets index coords.
+        # Orders and bounds are filled in. Mapped runs and coords become the
+        # tables of a document without geometry yet, see writable. Returns
+        # the ids of the rows.
+        count = len(rows)
+        if not count:
+            return []
+        if mapped and not self.point_count and not self.run_count:
+            self.coords, self.runs = coords, runs
+        else:
+            self.writable()
+            self.coords = grown(self.coords, self.point_count, self.point_count + len(coords))
+            self.coords[self.point_count:self.point_count + len(coords)] = coords
+            self.runs = grown(self.runs, self.run_count, self.run_count + len(runs))
+            added = self.runs[self.run_count:self.run_count + len(runs)]
+            added['offset'] = runs['offset'] + self.point_count
+            added['length'] = runs['length']
+        start = self.row_count
+        self.rows = grown(self.rows, start, start + count)
+        self.rows[start:start + count] = rows
+        added = self.rows[start:start + count]
+        added['order'] = np.arange(self.next_order, self.next_order + count)
+        added['first_run'] += self.run_count
+        self.next_order += count
+        self.point_count += len(coords)
+        self.run_count += len(runs)
+        self.row_count += count
+        self.update_bounds(np.arange(start, start + count))
+        ids = rows['id'].tolist()
+        self.index.update(zip(ids, range(start, start + count)))
+        return ids
+
+    def update_bounds(self, rows):
+        # Recomputes the scene bounds of rows from their runs, vectorized
+        table = self.rows
+        bounds = np.zeros((len(rows), 4))
+        counts = table['run_count'][rows].astype(np.int64)
+        run_ids = ranges(table['first_run'][rows], counts)
+        lengths = self.runs['length'][run_ids].astype(np.int64)
+        ends = np.concatenate([[0], np.cumsum(lengths)])
+        first = exclusive_sum(counts)
+        totals = ends[first + counts] - ends[first]
+        points = self.coords[ranges(self.runs['offset'][run_ids], lengths)]
+        filled = totals > 0
+        if filled.any():
+            starts = exclusive_sum(totals)[filled]
+            bounds[filled, :2] = np.minimum.reduceat(points, starts, axis=0)
+            bounds[filled, 2:] = np.maximum.reduceat(points, starts, axis=0)
+        rects = np.flatnonzero(table['kind'][rows] == RECT)
+        if len(rects):
+            corner = self.coords[self.runs['offset'][table['first_run'][rows[rects]]].astype(np.int64)]
+            size = self.coords[self.runs['offset'][table['first_run'][rows[rects]]].astype(np.int64) + 1]
+            bounds[rects, :2] = np.minimum(corner, corner + size)
+            bounds[rects, 2:] = np.maximum(corner, corner + size)
+        for text in np.flatnonzero(table['kind'][rows] == TEXT):
+            bounds[text, 2:] = text_extent(self.strings[table['text'][rows[text]]],
+                                           self.strings[table['font'][rows[text]]])
+        pos = table['pos'][rows]
+        table['bounds'][rows] = bounds + np.hstack([pos, pos])
+
+    def kill(self, row):
+        self.rows['alive'][row] = 0
+        first, count = int(self.rows['first_run'][row]), int(self.rows['run_count'][row])
+        self.garbage_points += int(self.runs['length'][first:first + count].sum())
+
+    def remove(self, ids):
+        for id_ in ids:
+            row = self.index.pop(id_, None)
+            if row is not None:
+                self.kill(row)
+        self.compact_if_needed()
+
+    def take(self, ids):
+        # Removes the shapes ids, returns their (rows, runs, coords) tables
+        # for restore()
+        rows = self.rows[self.rows_of([id_ for id_ in ids if id_ in self.index])]
+        counts = rows['run_count'].astype(np.int64)
+        runs = self.runs[ranges(rows['first_run'], counts)]
+        lengths = runs['length'].astype(np.int64)
+        coords = self.coords[ranges(runs['offset'], lengths)]
+        runs['offset'] = exclusive_sum(lengths)
+        rows['first_run'] = exclusive_sum(counts)
+        self.remove(ids)
+        return rows, runs, coords
+
+    def restore(self, taken):
+        # Puts back shapes removed by take(), on top of the stacking order
+        rows, runs, coords = taken
+        return self.append(rows, runs, coords)
+
+    def update_items(self, items):
+        # Stores the records of scene items, items out of the scene are
+        # removed
+        for item in items:
+            id_ = item_id(item)
+            shape = item_to_shape(item) if in_document(item) else None
+            if shape is None:
+                row = self.index.pop(id_, None)
+                if row is not None:
+                    self.kill(row)
+            else:
+                self.put(id_, shape)
+        self.compact_if_needed()
+
+    def store(self, items):
+        # Stores the records of items whether they are in the scene or not,
+        # as commands do before adding them
+        for item in items:
+            shape = item_to_shape(item)
+            if shape is not None:
+                self.put(item_id(item), shape)
+        self.compact_if_needed()
+
+    def translate(self, ids, dx, dy):
+        # Bulk move without touching the geometry runs
+        rows = self.rows_of(ids)
+        self.rows['pos'][rows] += (dx, dy)
+        self.rows['has_pos'][rows] = 1
+        self.rows['bounds'][rows] += (dx, dy, dx, dy)
+
+    def transform(self, ids, transform):
+        # Applies the scene QTransform to the shapes ids the way
+        # transform.transform_items does to their items : positions go
+        # through it, coords through its linear part, in place. Text is only
+        # moved. Rects may turn into polygons, see transform_rects.
+        self.writable()
+        rows = self.rows_of(ids)
+        rows = rows[self.rows['kind'][rows] != RECT]
+        matrix = np.array([[transform.m11(), transform.m12()], [transform.m21(), transform.m22()]])
+        self.rows['pos'][rows] = self.rows['pos'][rows] @ matrix + (transform.dx(), transform.dy())
+        self.rows['has_pos'][rows] = 1
+        shapes = rows[self.rows['kind'][rows] != TEXT]
+        counts = self.rows['run_count'][shapes].astype(np.int64)
+        run_ids = ranges(self.rows['first_run'][shapes], counts)
+        points = ranges(self.runs['offset'][run_ids], self.runs['length'][run_ids])
+        if len(points) and points[-1] - points[0] + 1 == len(points) and (np.diff(points) == 1).all():
+            points = slice(points[0], points[-1] + 1)  # one block, as after loading or compacting
+        self.coords[points] = self.coords[points] @ matrix
+        self.update_bounds(rows)
+
+    def transform_rects(self, ids, transform, as_rects):
+        # Applies the scene QTransform to the shapes ids of rect items. A
+        # rect turned by other than quarter turns is stored as a polygon,
+        # see shapes.snapshot_item : as_rects tells, per shape, whether it
+        # is a rect again once transformed.
+        matrix = np.array([[transform.m11(), transform.m12()], [transform.m21(), transform.m22()]])
+        offset = np.array([transform.dx(), transform.dy()])
+        for id_, as_rect in zip(ids, as_rects):
+            shape = self.shape(id_)
+            if shape['type'] == 'rect':
+                x, y, width, height = shape.pop('rect')
+                points = np.array([(x, y), (x + width, y), (x + width, y + height), (x, y + height), (x, y)])
+            else:
+                points = shape.pop('points')
+            points = points @ matrix
+            shape['pos'] = tuple((np.array(shape.get('pos', (0.0, 0.0))) @ matrix + offset).tolist())
+            if as_rect:
+                (left, top), (right, bottom) = points.min(axis=0).tolist(), points.max(axis=0).tolist()
+                shape['type'], shape['rect'] = 'rect', (left, top, right - left, bottom - top)
+            else:
+                shape['type'], shape['points'] = 'polygon', points
+            self.put(id_, shape)
+        self.compact_if_needed()
+
+    def positions(self, ids, default):
+        # (n, 2) array of the positions of the shapes ids, default holds
+        # those of the ids without a shape
+        try:
+            return self.rows['pos'][self.rows_of(ids)]
+        except KeyError:
+            rows = np.fromiter((self.index.get(id_, -1) for id_ in ids), dtype=np.int64, count=len(ids))
+            positions = np.array(default, dtype=np.float64).reshape(-1, 2)
+            positions[rows >= 0] = self.rows['pos'][rows[rows >= 0]]
+            return positions
+
+    def set_widths(self, ids, widths):
+        # Gives the shapes ids these pen widths, each distinct style and
+        # width pair is interned once
+        rows = self.rows_of(ids)
+        if not len(rows):
+            return
+        pairs = np.stack([self.rows['style'][rows].astype(np.int64), np.asarray(widths, dtype=np.int64)], axis=1)
+        used, inverse = np.unique(pairs, axis=0, return_inverse=True)
+        styles = []
+        for style, width in used.tolist():
+            color, _, brush_color, brush_style = self.styles[style].tolist()
+            styles.append(self.intern_style((color, width, brush_color, brush_style)))
+        self.rows['style'][rows] = np.array(styles, dtype=np.uint32)[inverse.reshape(-1)]
+
+    def compact_if_needed(self):
+        dead_rows = self.row_count - len(self.index)
+        if (self.garbage_points > max(self.COMPACT_MIN, self.point_count // 2)
+                or dead_rows > max(self.COMPACT_MIN, self.row_count // 2)):
+            self.compact()
+
+    def compact(self):
+        # Packs the live rows and their geometry, in stacking order
+        rows = self.rows[self.live_rows()]
+        rows = rows[np.argsort(rows['order'], kind='stable')]
+        counts = rows['run_count'].astype(np.int64)
+        runs = self.runs[ranges(rows['first_run'], counts)]
+        lengths = runs['length'].astype(np.int64)
+        self.coords = self.coords[ranges(runs['offset'], lengths)]
+        runs['offset'] = exclusive_sum(lengths)
+        rows['first_run'] = exclusive_sum(counts)
+        self.rows, self.row_count = rows, len(rows)
+        self.runs, self.run_count = runs, len(runs)
+        self.point_count = len(self.coords)
+        self.garbage_points = 0
+        self.index = dict(zip(rows['id'].tolist(), range(len(rows))))
+
+    def pack(self):
+        # Compacts when removed or replaced shapes left garbage, live rows
+        # are otherwise already in stacking order
+        if self.row_count != len(self.index) or self.garbage_points:
+            self.compact()
+
+    def snapshot(self):
+        # Detached copy of the used part of the arrays, safe to read from
+        # another thread. It is not compacted here : the writers pack it on
+        # the thread that saves.
+        copy = Document()
+        copy.rows, copy.row_count = self.rows[:self.row_count].copy(), self.row_count
+        copy.runs, copy.run_count = self.runs[:self.run_count].copy(), self.run_count
+        copy.coords, copy.point_count = self.coords[:self.point_count].copy(), self.point_count
+        copy.styles, copy.style_index = self.styles.copy(), dict(self.style_index)
+        copy.strings, copy.string_index = list(self.strings), dict(self.string_index)
+        copy.index = dict(self.index)
+        copy.next_order = self.next_order
+        copy.garbage_points = self.garbage_points
+        return copy
+
+    # Queries
+
+    def run(self, index):
+        offset, length = self.runs[index]
+        return self.coords[offset:offset + length].copy()
+
+    def shape_at(self, row):
+        # Same records as BinaryDocument.shape, geometry copied out
+        item = self.rows[row]
+        kind = KINDS[item['kind']]
+        style = self.styles[item['style']]
+        shape = {'type': kind, 'id': int(item['id']), 'color': color_name(style['color'])}
+        first, count = int(item['first_run']), int(item['run_count'])
+        if kind == 'line':
+            (x1, y1), (x2, y2) = self.run(first)
+            shape['start'], shape['end'] = (float(x1), float(y1)), (float(x2), float(y2))
+        elif kind == 'rect':
+            (x, y), (w, h) = self.run(first)
+            shape['rect'] = (float(x), float(y), float(w), float(h))
+        elif kind == 'path':
+            shape['path'] = [self.run(i) for i in range(first, first + count)]
+        elif kind == 'polygon':
+            shape['points'] = self.run(first)
+        if kind == 'text':
+            shape['text'] = self.strings[item['text']]
+            shape['font'] = self.strings[item['font']]
+        else:
+            shape['width'] = int(style['width'])
+        if kind in ('rect', 'polygon'):
+            shape['brush-color'] = color_name(style['brush_color'])
+            shape['brush-style'] = int(style['brush_style'])
+        if item['has_pos']:
+            shape['pos'] = (float(item['pos'][0]), float(item['pos'][1]))
+        return shape
+
+    def shape(self, id_):
+        return self.shape_at(self.index[id_])
+
+    def shapes(self):
+        for row in self.live_rows():
+            yield self.shape_at(row)
+
+    def build_items(self, ids):
+        # Scene items of the shapes, sharing pens and brushes
+        return shapes_to_items(self.shape(id_) for id_ in ids)
+
+    def extent(self, ids):
+        # Scene (left, top, right, bottom) around the shapes ids
+        bounds = self.rows['bounds'][self.rows_of(ids)]
+        return (*bounds[:, :2].min(axis=0).tolist(), *bounds[:, 2:].max(axis=0).tolist())
+
+    def query_rect(self, rect):
+        # Ids of the shapes whose bounds, pen included, intersect the scene
+        # rect (left, top, right, bottom)
+        left, top, right, bottom = rect
+        rows = self.live_rows()
+        bounds = self.rows['bounds'][rows]
+        pad = self.styles['width'][self.rows['style'][rows]] / 2.0
+        pad[self.rows['kind'][rows] == TEXT] = 0.0  # the text color is stored as the pen
+        hit = ((bounds[:, 0] - pad <= right) & (bounds[:, 2] + pad >= left)
+               & (bounds[:, 1] - pad <= bottom) & (bounds[:, 3] + pad >= top))
+        return self.rows['id'][rows[hit]]
+
+    def memory_usage(self):
+        # Bytes held by the arrays and the id index
+        arrays = sum(table.nbytes for table in (self.rows, self.runs, self.coords, self.styles))
+        strings = sum(sys.getsizeof(text) for text in self.strings)
+        index = sys.getsizeof(self.index) + 2 * 32 * len(self.index)  # int keys and values
+        return {'arrays': arrays, 'strings': strings, 'index': index, 'total': arrays + strings + index,
+                'per_shape': (arrays + strings + index) / max(len(self), 1)}
+
+    # Files
+
+    def write_binary(self, filename):
+        self.pack()
+        rows = self.rows[:self.row_count]
+        items = np.zeros(len(rows), dtype=ITEM_DTYPE)
+        for field in ('id', 'kind', 'has_pos', 'style', 'pos', 'first_run', 'run_count', 'text', 'font'):
+            items[field] = rows[field]
+        write_tables(filename, self.styles[:len(self.style_index)], items, self.runs[:self.run_count],
+                     self.coords[:self.point_count], [text.encode('utf-8') for text in self.strings])
+
+    def write_json(self, filename):
+        self.pack()
+        with open(filename, 'w') as file:
+            json.dump([json_shape(shape) for shape in self.shapes()], file)
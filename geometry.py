@@ -0,0 +1,32 @@
+import numpy as np
+from PyQt5 import QtGui
+
+# Conversions between Qt geometry and (n, 2) float64 NumPy arrays.
+# QPolygonF stores its points as contiguous doubles, so both directions
+# are a single buffer copy instead of a Python loop over QPointF.
+
+def polygon_to_array(polygon):
+    size = polygon.size()
+    if size == 0:
+        return np.empty((0, 2), dtype=np.float64)
+    pointer = polygon.data()
+    pointer.setsize(size * 16)
+    return np.frombuffer(pointer, dtype=np.float64).reshape(-1, 2).copy()
+
+def array_to_polygon(points):
+    points = np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 2)
+    polygon = QtGui.QPolygonF(len(points))
+    if len(points):
+        pointer = polygon.data()
+        pointer.setsize(points.size * 8)
+        np.frombuffer(pointer, dtype=np.float64)[:] = points.ravel()
+    return polygon
+
+def path_to_arrays(path):
+    return [polygon_to_array(polygon) for polygon in path.toSubpathPolygons()]
+
+def arrays_to_path(arrays):
+    path = QtGui.QPainterPath()
+    for points in arrays:
+        path.addPolygon(array_to_polygon(points))
+    return path
@@ -0,0 +1,364 @@
+import pickle
+import tempfile
+
+from PyQt5 import QtGui, QtWidgets
+
+from shapes import in_document, item_id, shape_to_item
+
+ITEM_OVERHEAD = 200  # wrapper, pen, brush and item bookkeeping
+STATE_SIZE = 400  # item_state() tuple, its Qt value wrappers and the checkpoint dict entry
+
+def item_size(item):
+    # Rough memory footprint of an item, in bytes
+    if isinstance(item, QtWidgets.QGraphicsPathItem):
+        return ITEM_OVERHEAD + 40 * item.path().elementCount()
+    if isinstance(item, QtWidgets.QGraphicsPolygonItem):
+        return ITEM_OVERHEAD + 16 * item.polygon().size()
+    if isinstance(item, QtWidgets.QGraphicsTextItem):
+        return ITEM_OVERHEAD + 2 * len(item.toPlainText())
+    return ITEM_OVERHEAD
+
+def item_state(item):
+    # State a command may change : scene membership, position, transform
+    # and geometry. Qt value types are implicitly shared, so this copies no
+    # coordinates.
+    if isinstance(item, QtWidgets.QGraphicsPathItem):
+        geometry = item.path()
+    elif isinstance(item, QtWidgets.QGraphicsPolygonItem):
+        geometry = item.polygon()
+    elif isinstance(item, QtWidgets.QGraphicsRectItem):
+        geometry = item.rect()
+    elif isinstance(item, QtWidgets.QGraphicsLineItem):
+        geometry = item.line()
+    else:
+        geometry = None
+    return (in_document(item), item.pos(), item.transform(), geometry)
+
+GEOMETRY = ((QtWidgets.QGraphicsPathItem, QtWidgets.QGraphicsPathItem.path),
+            (QtWidgets.QGraphicsPolygonItem, QtWidgets.QGraphicsPolygonItem.polygon),
+            (QtWidgets.QGraphicsRectItem, QtWidgets.QGraphicsRectItem.rect),
+            (QtWidgets.QGraphicsLineItem, QtWidgets.QGraphicsLineItem.line))
+
+def item_states(items):
+    # {item: item_state()} of many items, as a bulk command touches them.
+    # Unbound methods are mapped over the items of each class, which skips
+    # the attribute lookup on every item wrapper.
+    items = list(dict.fromkeys(items))
+    classes = {}
+    for index, item in enumerate(items):
+        classes.setdefault(type(item), []).append(index)
+    geometries = [None] * len(items)
+    for cls, indexes in classes.items():
+        getter = next((getter for base, getter in GEOMETRY if issubclass(cls, base)), None)
+        if getter is not None:
+            for index, geometry in zip(indexes, map(getter, [items[index] for index in indexes])):
+                geometries[index] = geometry
+    return dict(zip(items, zip(map(in_document, items), map(QtWidgets.QGraphicsItem.pos, items),
+                               map(QtWidgets.QGraphicsItem.transform, items), geometries)))
+
+def apply_state(item, state):
+    # Restores everything but the scene membership, returns False when the
+    # item already had that state
+    in_scene, pos, transform, geometry = state
+    old_state = item_state(item)
+    if pos == old_state[1] and transform == old_state[2] and geometry == old_state[3]:
+        return False
+    item.setPos(pos)
+    item.setTransform(transform)
+    if isinstance(item, QtWidgets.QGraphicsPathItem):
+        item.setPath(geometry)
+    elif isinstance(item, QtWidgets.QGraphicsPolygonItem):
+        item.setPolygon(geometry)
+    elif isinstance(item, QtWidgets.QGraphicsRectItem):
+        item.setRect(geometry)
+    elif isinstance(item, QtWidgets.QGraphicsLineItem):
+        item.setLine(geometry)
+    return True
+
+class Checkpoint:
+    # Compact checkpoint : only items changed around it are recorded.
+    #   before  state at the checkpoint of the items changed after it,
+    #           recorded the first time each one is changed
+    #   after   state at the checkpoint of the items changed since the
+    #           previous checkpoint
+    # States are item_state() tuples.
+    # Going back to a checkpoint applies the before records of it and of
+    # every later checkpoint, the oldest record of an item winning. Going
+    # forward applies the after records of the checkpoints passed.
+    def __init__(self, after):
+        self.after = after
+        self.before = {}
+
+    def __len__(self):
+        return len(self.before) + len(self.after)
+
+class SpilledCommand:
+    # Placeholder for a command serialized to the spill file
+    def __init__(self, name, offset, length):
+        self.name = name
+        self.offset = offset
+        self.length = length
+
+def record_ids(record):
+    # Ids of the item records, {'id': ..., 'shape': ...}, within a command record
+    if isinstance(record, dict):
+        if 'id' in record and 'shape' in record:
+            yield record['id']
+            return
+        record = record.values()
+    elif not isinstance(record, (list, tuple)):
+        return
+    for value in record:
+        yield from record_ids(value)
+
+class History:
+    # Undo and redo stacks kept under a memory budget. Past max_bytes or
+    # max_entries, the oldest undo entries are pickled to a temporary spill
+    # file and only rebuilt, by restore(record, resolve), when the user
+    # undoes that far back. find_items(ids) returns {id: item} for the
+    # items of the document with those ids.
+    # Entries are [command or SpilledCommand, size]. Checkpoint states are
+    # charged to the budget as well.
+    #
+    # Position n is the document after the first n entries. Every
+    # CHECKPOINT_INTERVAL positions a checkpoint is taken, so jump() reaches
+    # any position by restoring the nearest one and replaying at most
+    # CHECKPOINT_INTERVAL commands.
+    MAX_BYTES = 64 << 20
+    MAX_ENTRIES = 500
+    CHECKPOINT_INTERVAL = 100
+
+    def __init__(self, restore, find_items, max_bytes=MAX_BYTES, max_entries=MAX_ENTRIES):
+        self.restore = restore
+        self.find_items = find_items
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.undo_stack = []
+        self.redo_stack = []
+        self.spilled = 0    # undo entries below this index are spilled, or pinned in
+                            # memory when their command has no record
+        self.bytes = 0      # size of the entries held in memory and of the checkpoint states
+        self.spill_file = None
+        self.checkpoints = {0: Checkpoint({})}  # position -> Checkpoint
+        self.changed_from = 0  # first entry changed since take_changes()
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def position(self):
+        return len(self.undo_stack)
+
+    def __len__(self):
+        return len(self.undo_stack) + len(self.redo_stack)
+
+    def name(self, index):
+        # Name of entry index, position index + 1 is the document after it
+        if index < len(self.undo_stack):
+            return self.undo_stack[index][0].name
+        return self.redo_stack[len(self) - 1 - index][0].name
+
+    def take_changes(self):
+        # Index of the first entry added or replaced since the last call
+        changed_from, self.changed_from = self.changed_from, len(self)
+        return changed_from
+
+    def top(self):
+        # The newest undo command while it is in memory, the one push may
+        # merge the next command into
+        if len(self.undo_stack) > self.spilled:
+            return self.undo_stack[-1][0]
+        return None
+
+    def push(self, command):
+        # Records an executed command, merging it into the previous one when
+        # possible. Starting a new branch drops the redo entries.
+        for entry in self.redo_stack:
+            self.bytes -= entry[1]
+        self.redo_stack.clear()
+        top = self.undo_stack[-1] if self.top() is not None else None
+        if top and top[0].merge(command):
+            size = top[0].size()
+            self.bytes += size - top[1]
+            top[1] = size
+        else:
+            size = command.size()
+            self.changed_from = min(self.changed_from, len(self.undo_stack))
+            self.undo_stack.append([command, size])
+            self.bytes += size
+        # Checkpoints of the dropped branch, or of the merged position, are stale
+        position = len(self.undo_stack)
+        self.drop_checkpoints([key for key in self.checkpoints if key >= position])
+        if position % self.CHECKPOINT_INTERVAL == 0:
+            self.capture(position)
+        self.enforce_budget()
+
+    def undo(self):
+        # Pops the command to undo, None when the history is empty
+        if not self.undo_stack:
+            return None
+        entry = self.undo_stack.pop()
+        self.spilled = min(self.spilled, len(self.undo_stack))
+        if isinstance(entry[0], SpilledCommand):
+            entry = [self.rehydrate(entry[0]), 0]
+            entry[1] = entry[0].size()
+            self.bytes += entry[1]
+        if not self.spilled and self.spill_file is not None:
+            self.spill_file.seek(0)
+            self.spill_file.truncate()
+        self.redo_stack.append(entry)
+        return entry[0]
+
+    def redo(self):
+        if not self.redo_stack:
+            return None
+        # The caller calls enforce_budget() once the command has run again
+        entry = self.redo_stack.pop()
+        self.undo_stack.append(entry)
+        return entry[0]
+
+    def jump(self, position):
+        # Moves the history to position. Returns (states, steps, replayed) :
+        # the caller restores the item states, then calls undo() and undoes
+        # the returned command steps times, and executes the replayed
+        # commands, in order. A spilled command is rebuilt by undo() from
+        # the items as the previous steps left them, so each one must run
+        # before the next undo(). Only then the caller calls
+        # enforce_budget() : spilling records the items of a command, which
+        # must not happen while they still hold the old position.
+        position = max(0, min(position, len(self)))
+        current = len(self.undo_stack)
+        keys = sorted(self.checkpoints)
+        if position < current:
+            # restore the checkpoint before position and replay forward
+            start = max([key for key in keys if key <= position], default=None)
+            if start is None or position - start >= current - position or position < self.spilled:
+                return {}, current - position, []
+            while len(self.undo_stack) > position:
+                self.redo_stack.append(self.undo_stack.pop())
+            # items changed after current were not changed since start either
+            states = {}
+            for key in reversed([key for key in keys if start <= key <= current]):
+                states.update(self.checkpoints[key].before)
+        else:
+            # apply the checkpoints between current and position
+            base = [key for key in keys if key <= current]
+            ahead = [key for key in keys if current < key <= position]
+            start = ahead[-1] if ahead else None
+            if not base or start is None or position - start >= position - current:
+                while len(self.undo_stack) < position:
+                    self.undo_stack.append(self.redo_stack.pop())
+                return {}, 0, [entry[0] for entry in self.undo_stack[current:]]
+            while len(self.undo_stack) < position:
+                self.undo_stack.append(self.redo_stack.pop())
+            states = {}
+            for key in ahead:
+                states.update(self.checkpoints[key].after)
+        replayed = [entry[0] for entry in self.undo_stack[start:position]]
+        return states, 0, replayed
+
+    def prepare(self, command):
+        # Called before command is executed : the newest checkpoint keeps
+        # the state of the items the first time they are changed after it
+        keys = [key for key in self.checkpoints if key <= len(self.undo_stack)]
+        if not keys:
+            return
+        before = self.checkpoints[max(keys)].before
+        new = [item for item in command.items() if item not in before]
+        if new:
+            count = len(before)
+            before.update(item_states(new))
+            self.bytes += STATE_SIZE * (len(before) - count)
+
+    def capture(self, position):
+        keys = [key for key in self.checkpoints if key < position]
+        previous = self.checkpoints[max(keys)] if keys else None
+        after = {}
+        if previous is not None:
+            after = item_states(previous.before)
+        self.checkpoints[position] = Checkpoint(after)
+        self.bytes += STATE_SIZE * len(after)
+
+    def drop_checkpoints(self, keys):
+        for key in keys:
+            self.bytes -= STATE_SIZE * len(self.checkpoints.pop(key))
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.checkpoints = {0: Checkpoint({})}
+        self.changed_from = 0
+        self.spilled = 0
+        self.bytes = 0
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+    def enforce_budget(self):
+        # The newest undo entry always stays in memory so it can be merged
+        while self.spilled < len(self.undo_stack) - 1:
+            in_memory = len(self.undo_stack) - self.spilled + len(self.redo_stack)
+            if self.bytes <= self.max_bytes and in_memory <= self.max_entries:
+                break
+            entry = self.undo_stack[self.spilled]
+            record = entry[0].to_record()
+            self.spilled += 1
+            # Commands without a record stay in memory, behind the frontier
+            if record is not None:
+                self.spill(entry, record)
+
+    def spill(self, entry, record):
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(prefix="paint-history-")
+        data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        self.spill_file.seek(0, 2)
+        offset = self.spill_file.tell()
+        self.spill_file.write(data)
+        self.bytes -= entry[1]
+        entry[0] = SpilledCommand(entry[0].name, offset, len(data))
+        entry[1] = 0
+        # Checkpoints behind the spilled entries can no longer be replayed from
+        self.drop_checkpoints([key for key in self.checkpoints if key <= self.spilled])
+
+    def rehydrate(self, spilled):
+        self.spill_file.seek(spilled.offset)
+        record = pickle.loads(self.spill_file.read(spilled.length))
+        return self.restore(record, self.resolver(record))
+
+    def resolver(self, record):
+        # Spilled records name items by id : the ids of the document map back
+        # to its items, others are rebuilt. The later commands have been
+        # undone, so an item out of the document can only still be held by
+        # an older command, pinned in memory behind the frontier.
+        ids = set(record_ids(record))
+        items = self.find_items(ids)
+        for entry in self.undo_stack[:self.spilled]:
+            if not isinstance(entry[0], SpilledCommand):
+                for item in entry[0].items():
+                    if item_id(item) in ids:
+                        items.setdefault(item_id(item), item)
+
+        def resolve(record):
+            item = items.get(record['id'])
+            if item is None and record['shape'] is not None:
+                item = items[record['id']] = shape_to_item(record['shape'])
+                if 'transform' in record:
+                    item.setTransform(QtGui.QTransform(*record['transform']))
+            return item
+        return resolve
+
+    def memory_usage(self):
+        spill_bytes = 0
+        if self.spill_file is not None:
+            spill_bytes = self.spill_file.seek(0, 2)
+        return {'undo_entries': len(self.undo_stack),
+                'redo_entries': len(self.redo_stack),
+                'spilled_entries': sum(isinstance(entry[0], SpilledCommand) for entry in self.undo_stack),
+                'bytes': self.bytes,
+                'spill_file_bytes': spill_bytes,
+                'checkpoints': len(self.checkpoints),
+                'checkpoint_states': sum(len(checkpoint) for checkpoint in self.checkpoints.values()),
+                'max_bytes': self.max_bytes,
+                'max_entries': self.max_entries}
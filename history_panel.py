@@ -0,0 +1,45 @@
+from PyQt5 import QtGui, QtWidgets
+
+class HistoryPanel(QtWidgets.QDockWidget):
+    # Lists the history of the view, row n is the document after n entries.
+    # Selecting a row jumps straight to it, entries past the current
+    # position are greyed out until they are redone or replaced.
+    def __init__(self, view, parent=None):
+        super().__init__("History", parent)
+        self.setObjectName("history")
+        self.view = view
+        self.position = 0
+        self.list = QtWidgets.QListWidget()
+        self.list.setUniformItemSizes(True)
+        self.list.addItem("Open")
+        self.list.setCurrentRow(0)
+        self.setWidget(self.list)
+        self.list.currentRowChanged.connect(self.on_row_changed)
+        view.history_changed.connect(self.refresh)
+
+    def refresh(self):
+        # Only the rows of the entries changed since the last refresh are
+        # rebuilt, long histories stay cheap to follow
+        history = self.view.history
+        changed_from = min(history.take_changes(), len(history))
+        position = history.position()
+        self.list.blockSignals(True)
+        while self.list.count() > changed_from + 1:
+            self.list.takeItem(self.list.count() - 1)
+        for index in range(self.list.count() - 1, len(history)):
+            self.list.addItem(history.name(index))
+            self.paint_row(index + 1, position)
+        for row in range(min(self.position, position) + 1, min(max(self.position, position), len(history)) + 1):
+            self.paint_row(row, position)
+        self.position = position
+        self.list.setCurrentRow(position)
+        self.list.blockSignals(False)
+
+    def paint_row(self, row, position):
+        color = self.palette().color(QtGui.QPalette.Disabled if row > position else QtGui.QPalette.Active,
+                                     QtGui.QPalette.Text)
+        self.list.item(row).setForeground(color)
+
+    def on_row_changed(self, row):
+        if row >= 0 and row != self.view.history.position():
+            self.view.jump_to(row)
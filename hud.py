@@ -0,0 +1,140 @@
+import collections
+import time
+
+from PyQt5 import QtCore, QtWidgets
+
+INPUT_EVENTS = {QtCore.QEvent.MouseButtonPress, QtCore.QEvent.MouseButtonRelease, QtCore.QEvent.MouseMove,
+                QtCore.QEvent.MouseButtonDblClick, QtCore.QEvent.Wheel}
+
+def percentile(values, fraction):
+    # Nearest rank percentile of sorted values
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+class RollingStats:
+    # The last SIZE samples of one measure, in ms
+    SIZE = 600
+
+    def __init__(self):
+        self.samples = collections.deque(maxlen=self.SIZE)
+
+    def add(self, value):
+        self.samples.append(value)
+
+    def clear(self):
+        self.samples.clear()
+
+    def summary(self):
+        values = sorted(self.samples)
+        return {'count': len(values), 'last': self.samples[-1] if values else 0.0,
+                'p50': percentile(values, 0.5), 'p95': percentile(values, 0.95), 'p99': percentile(values, 0.99)}
+
+class FrameMetrics(QtCore.QObject):
+    # Frame and input latency measures of a view, fed by its paintEvent and
+    # an event filter on its viewport. Nothing is measured until start().
+    #   frame     time between two paints, pauses over IDLE_MS are not frames
+    #   paint     time spent in paintEvent
+    #   latency   first mouse event after a paint to the end of the next paint
+    #   queue     mouse events delivered between two paints
+    IDLE_MS = 250
+
+    def __init__(self, view, parent=None):
+        super().__init__(parent)
+        self.view = view
+        self.enabled = False
+        self.users = 0
+        self.stats = {name: RollingStats() for name in ('frame', 'paint', 'latency', 'queue')}
+        self.last_paint = None
+        self.input_time = None
+        self.queued = 0
+
+    def start(self):
+        # Measuring is reference counted : the HUD and a test may both use it
+        self.users += 1
+        if not self.enabled:
+            self.enabled = True
+            self.view.viewport().installEventFilter(self)
+
+    def stop(self):
+        self.users = max(0, self.users - 1)
+        if self.enabled and not self.users:
+            self.enabled = False
+            self.view.viewport().removeEventFilter(self)
+            self.last_paint = self.input_time = None
+            self.queued = 0
+
+    def reset(self):
+        for stats in self.stats.values():
+            stats.clear()
+
+    def eventFilter(self, watched, event):
+        if event.type() in INPUT_EVENTS:
+            self.queued += 1
+            if self.input_time is None:
+                self.input_time = time.perf_counter()
+        return False
+
+    def painted(self, start, end):
+        # Called by the view around its paintEvent, times from perf_counter
+        if self.last_paint is not None and (start - self.last_paint) * 1000 < self.IDLE_MS:
+            self.stats['frame'].add((start - self.last_paint) * 1000)
+        self.last_paint = start
+        self.stats['paint'].add((end - start) * 1000)
+        if self.input_time is not None:
+            self.stats['latency'].add((end - self.input_time) * 1000)
+            self.stats['queue'].add(self.queued)
+            self.input_time = None
+            self.queued = 0
+
+    def snapshot(self):
+        # {'frame': {'count', 'last', 'p50', 'p95', 'p99'}, ..., 'items': n}
+        snapshot = {name: stats.summary() for name, stats in self.stats.items()}
+        snapshot['items'] = len(self.view.spatial_index)
+        return snapshot
+
+class HudOverlay(QtWidgets.QLabel):
+    # Text overlay in the top right corner of the view, refreshed every
+    # REFRESH_MS. It is opaque so that refreshing it never repaints the
+    # viewport underneath and never shows up in the measures.
+    REFRESH_MS = 250
+    ROWS = [('frame', "frame ms"), ('paint', "paint ms"), ('latency', "latency ms"), ('queue', "events/frame")]
+
+    def __init__(self, view):
+        super().__init__(view)
+        self.view = view
+        self.setAutoFillBackground(True)
+        self.setStyleSheet("QLabel { background-color: rgb(32, 32, 32); color: rgb(160, 255, 160);"
+                           " font-family: monospace; padding: 4px; }")
+        self.setAttribute(QtCore.Qt.WA_TransparentForMouseEvents)
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.hide()
+
+    def set_visible(self, visible):
+        if visible == self.timer.isActive():
+            return
+        if visible:
+            self.view.frame_metrics.start()
+            self.timer.start(self.REFRESH_MS)
+            self.refresh()
+            self.show()
+        else:
+            self.timer.stop()
+            self.view.frame_metrics.stop()
+            self.hide()
+
+    def refresh(self):
+        snapshot = self.view.frame_metrics.snapshot()
+        lines = ["{:<15} {:>7} {:>7} {:>7}".format("", "p50", "p95", "p99")]
+        for name, label in self.ROWS:
+            stats = snapshot[name]
+            lines.append("{:<15} {:>7.1f} {:>7.1f} {:>7.1f}".format(label, stats['p50'], stats['p95'], stats['p99']))
+        lines.append("{:<15} {:>7}".format("items", snapshot['items']))
+        self.setText("\n".join(lines))
+        self.place()
+
+    def place(self):
+        self.adjustSize()
+        viewport = self.view.viewport().geometry()
+        self.move(viewport.right() - self.width() - 4, viewport.top() + 4)
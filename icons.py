@@ -0,0 +1,48 @@
+import functools
+import os
+
+from PyQt5.QtCore import Qt, QSize
+from PyQt5.QtGui import QIcon, QPixmap, QPainter, QPen, QColor
+
+# Icons are built once and shared. Menu icons are only set when their menu
+# is first shown, see LazyMenuIcons.
+
+ICON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Icons")
+
+@functools.lru_cache(maxsize=None)
+def icon(name):
+    return QIcon(os.path.join(ICON_DIR, name + ".png"))
+
+LINE_ICON_SIZE = QSize(32, 32)
+
+@functools.lru_cache(maxsize=None)
+def create_line_icon(width):
+    size = LINE_ICON_SIZE
+    pixmap = QPixmap(size)
+    pixmap.fill(Qt.transparent)
+    painter = QPainter(pixmap)
+    painter.setRenderHint(QPainter.Antialiasing)
+    pen = QPen(QColor(0, 0, 0))  # Black color
+    pen.setWidth(width)
+    painter.setPen(pen)
+    painter.drawLine(4, size.height() // 2, size.width() - 4, size.height() // 2)
+    painter.end()
+    return QIcon(pixmap)
+
+class LazyMenuIcons:
+    # action -> icon factory, applied to the actions of a menu (submenus
+    # included) right before it is shown for the first time
+    def __init__(self):
+        self.pending = {}
+
+    def add(self, action, factory):
+        self.pending[action] = factory
+
+    def watch(self, menu):
+        menu.aboutToShow.connect(lambda menu=menu: self.load(menu))
+
+    def load(self, menu):
+        for action in menu.actions():
+            factory = self.pending.pop(action, None)
+            if factory is not None:
+                action.setIcon(factory())
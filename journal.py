@@ -0,0 +1,230 @@
+import json
+import os
+import time
+
+from PyQt5 import QtCore
+
+from document import json_shape
+from shapes import ITEM_ID, item_id, shape_to_item
+
+# Append-only journal of the changes made since the last full save.
+#
+# The first line names the base document, every following line is either
+#   {"op": "put", "id": ..., "shape": {...}}   item added or changed
+#   {"op": "del", "id": ...}                   item removed
+# Records hold absolute item states, so replaying one twice is harmless.
+# The records of a command are appended right after it, the journal is
+# rewritten with one record per changed item by compact() on autosave.
+# Each running window leaves a session marker next to the untitled
+# journals : a marker whose process is gone points to an unclean journal.
+
+SUFFIX = ".journal"
+JOURNAL_DIR = os.path.join(os.path.expanduser("~"), ".paint")
+
+def journal_path(filename):
+    if filename:
+        return filename + SUFFIX
+    return os.path.join(JOURNAL_DIR, "untitled-{}{}".format(os.getpid(), SUFFIX))
+
+def session_path(pid=None):
+    return os.path.join(JOURNAL_DIR, "session-{}.json".format(pid or os.getpid()))
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+def find_unclean():
+    # Journals left behind by windows that did not exit cleanly
+    journals = []
+    if not os.path.isdir(JOURNAL_DIR):
+        return journals
+    for name in sorted(os.listdir(JOURNAL_DIR)):
+        if not (name.startswith("session-") and name.endswith(".json")):
+            continue
+        marker = os.path.join(JOURNAL_DIR, name)
+        try:
+            pid = int(name[len("session-"):-len(".json")])
+            if process_alive(pid) and pid != os.getpid():
+                continue
+            with open(marker) as file:
+                path = json.load(file)['journal']
+        except (ValueError, KeyError, OSError):
+            continue
+        if os.path.exists(path):
+            journals.append((marker, path))
+        else:
+            os.remove(marker)
+    return journals
+
+def read_journal(path):
+    with open(path) as file:
+        header = json.loads(file.readline())
+        records = []
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break  # torn last line of an interrupted write
+    return header.get('base'), records
+
+def replay(scene, records):
+    # Applies the records to the scene, returns the items they touched.
+    items = {item_id(item): item for item in scene.items() if item.data(ITEM_ID) is not None}
+    touched = {}
+    for record in records:
+        old_item = items.pop(record['id'], None)
+        if old_item is not None:
+            scene.removeItem(old_item)
+            touched[record['id']] = old_item
+        if record['op'] == 'put':
+            item = shape_to_item(record['shape'])
+            if item:
+                scene.addItem(item)
+                items[record['id']] = item
+                touched[record['id']] = item
+    return list(touched.values())
+
+class Journal(QtCore.QObject):
+    # Changes are recorded by item and written from the document, which
+    # also holds the shapes of items kept out of the scene. The pending
+    # records are appended from the event loop in slices of SLICE_MS, so a
+    # bulk edit does not freeze the window while its records are written.
+    SLICE_MS = 8
+    COMPACT_RATIO = 2  # records per changed item before compact() rewrites the journal
+
+    def __init__(self, document, base=None, parent=None):
+        super().__init__(parent)
+        self.document = document
+        self.base = base
+        self.path = journal_path(base)
+        self.pending = {}      # id -> item changed since its last record was written
+        self.since_save = None  # id -> item changed since the oldest save in flight
+        self.changed = set()   # ids changed since base
+        self.lines = 0         # records in the journal file
+        self.written = False
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.write_slice)
+
+    def record(self, items):
+        ids = list(map(item_id, items))
+        pending = self.pending
+        for id_ in ids:
+            pending.pop(id_, None)  # written after the older records
+        pending.update(zip(ids, items))
+        self.changed.update(ids)
+        if self.since_save is not None:
+            self.since_save.update(zip(ids, items))
+        if self.pending and not self.timer.isActive():
+            self.timer.start()
+
+    def write_slice(self):
+        self.write(time.perf_counter() + self.SLICE_MS / 1000.0)
+        if self.pending:
+            self.timer.start()
+
+    def flush(self):
+        # Writes every pending record now
+        self.timer.stop()
+        return self.write()
+
+    def write(self, deadline=None):
+        # Appends the oldest pending records, until deadline if given
+        lines = []
+        while self.pending:
+            id_ = next(iter(self.pending))
+            del self.pending[id_]
+            lines.append(self.line(id_))
+            if deadline is not None and len(lines) % 64 == 0 and time.perf_counter() > deadline:
+                break
+        if lines:
+            self.append(lines)
+        return len(lines)
+
+    def line(self, id_):
+        if id_ not in self.document:
+            return json.dumps({'op': 'del', 'id': id_})
+        return json.dumps({'op': 'put', 'id': id_, 'shape': json_shape(self.document.shape(id_))})
+
+    def append(self, lines):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'a' if self.written else 'w') as file:
+            if not self.written:
+                file.write(self.header())
+            self.write_lines(file, lines)
+        self.lines += len(lines)
+        if not self.written:
+            self.written = True
+            self.write_session()
+
+    def header(self):
+        return json.dumps({'journal': 1, 'base': self.base}) + "\n"
+
+    def write_lines(self, file, lines):
+        file.write("\n".join(lines) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+
+    def compact(self):
+        # Autosave : once items changed again and again made the journal
+        # COMPACT_RATIO times longer than needed, it is rewritten with one
+        # record per changed item, O(changes) not O(document). The new file
+        # replaces the old one only once complete.
+        self.flush()
+        if not self.written or self.lines <= self.COMPACT_RATIO * len(self.changed):
+            return False
+        lines = [self.line(id_) for id_ in self.changed]
+        temporary = self.path + ".tmp"
+        with open(temporary, 'w') as file:
+            file.write(self.header())
+            self.write_lines(file, lines)
+        os.replace(temporary, self.path)
+        self.lines = len(lines)
+        return True
+
+    def write_session(self):
+        os.makedirs(JOURNAL_DIR, exist_ok=True)
+        with open(session_path(), 'w') as file:
+            json.dump({'journal': os.path.abspath(self.path)}, file)
+
+    def remove_files(self):
+        for path in (self.path, session_path()):
+            if os.path.exists(path):
+                os.remove(path)
+        self.written = False
+        self.lines = 0
+
+    def reset(self, base):
+        # The scene now matches base : the journal starts over.
+        self.remove_files()
+        self.timer.stop()
+        self.pending.clear()
+        self.changed.clear()
+        self.base = base
+        self.path = journal_path(base)
+
+    def begin_save(self):
+        if self.since_save is None:
+            self.since_save = {}
+
+    def end_save(self, filename, success, busy):
+        # Compaction : once filename holds a full copy of the document, the
+        # journal only keeps what changed after the snapshot was taken.
+        changed = list(self.since_save.values()) if self.since_save else []
+        if success:
+            self.reset(filename)
+            self.record(changed)
+        if not busy:
+            self.since_save = None
+
+    def discard(self):
+        self.timer.stop()
+        self.pending.clear()
+        self.changed.clear()
+        self.remove_files()
@@ -0,0 +1,230 @@
+import codecs
+import json
+import os
+from collections import deque
+
+from PyQt5 import QtCore
+
+class ShapeReader(QtCore.QThread):
+    # Parses a JSON shape file off the GUI thread and hands the records
+    # over in batches as soon as they are decoded.
+    shapes_parsed = QtCore.pyqtSignal(object)  # list of records : a list signal would convert each one
+    bytes_read = QtCore.pyqtSignal(int)
+    failed = QtCore.pyqtSignal(str)
+
+    CHUNK_SIZE = 1 << 20
+    BATCH_SIZE = 2000
+
+    def __init__(self, filename, backlog=None, parent=None):
+        super().__init__(parent)
+        self.filename = filename
+        self.backlog = backlog  # callable returning the number of records not yet added
+
+    def run(self):
+        try:
+            self.parse()
+        except Exception as e:
+            self.failed.emit(str(e))
+
+    def wait_for_consumer(self):
+        while self.backlog and self.backlog() > 4 * self.BATCH_SIZE and not self.isInterruptionRequested():
+            self.msleep(5)
+
+    def parse(self):
+        decoder = json.JSONDecoder()
+        text_decoder = codecs.getincrementaldecoder('utf-8')()
+        buffer, index, total = "", 0, 0
+        last = None  # '[', ',' or '}' : what the records read so far end with
+        batch = []
+        with open(self.filename, 'rb') as file:
+            eof = False
+            while not eof and not self.isInterruptionRequested():
+                chunk = file.read(self.CHUNK_SIZE)
+                eof = not chunk
+                total += len(chunk)
+                buffer = buffer[index:] + text_decoder.decode(chunk, final=eof)
+                index = 0
+                whole = True  # the records of the chunk are first decoded at once
+                while True:
+                    while index < len(buffer) and buffer[index] in " \t\r\n":
+                        index += 1
+                    if index == len(buffer):
+                        break
+                    if last is None:
+                        if buffer[index] != '[':
+                            raise ValueError("a shape file must contain a JSON list")
+                        last = '['
+                        index += 1
+                        continue
+                    if buffer[index] == ',':
+                        if last != '}':
+                            raise ValueError("unexpected ',' in the shape list")
+                        last = ','
+                        index += 1
+                        continue
+                    if buffer[index] == ']':
+                        if last == ',':
+                            raise ValueError("unexpected ',' in the shape list")
+                        eof = True
+                        break
+                    if last == '}':
+                        raise ValueError("missing ',' between two shapes")
+                    if whole:
+                        whole = False
+                        shapes, index = decode_records(buffer, index)
+                        if shapes:
+                            last = '}'
+                            batch.extend(shapes)
+                            if len(batch) >= self.BATCH_SIZE:
+                                self.shapes_parsed.emit(batch)
+                                batch = []
+                                self.wait_for_consumer()
+                            continue
+                    try:
+                        shape, index = decoder.raw_decode(buffer, index)
+                    except json.JSONDecodeError:
+                        if eof:
+                            raise
+                        break  # incomplete record, read the next chunk
+                    last = '}'
+                    batch.append(shape)
+                    if len(batch) >= self.BATCH_SIZE:
+                        self.shapes_parsed.emit(batch)
+                        batch = []
+                        self.wait_for_consumer()
+                self.bytes_read.emit(total)
+        if batch:
+            self.shapes_parsed.emit(batch)
+
+def decode_records(buffer, index):
+    # The records of buffer from index up to its last closing brace, decoded
+    # in one call, and the index after them. Nothing when that brace does
+    # not end a record, e.g. it is inside a text : the caller decodes them
+    # one by one.
+    end = buffer.rfind('}', index) + 1
+    if end:
+        try:
+            return json.loads('[' + buffer[index:end] + ']'), end
+        except ValueError:
+            pass
+    return [], index
+
+class StreamingLoader(QtCore.QObject):
+    # Hands the records parsed by a ShapeReader over in QTimer driven slices
+    # so the GUI keeps repainting and handling input while loading. Each
+    # slice goes to insert in one batch, see Window.insert_shapes : its items
+    # join the scene at once and the view repaints as usual between two
+    # slices. A slice is sized to fill FRAME_BUDGET_MS, or LOOP_RATIO times
+    # what the event loop took since the previous one when that is longer :
+    # the repaints grow with the drawing, the slices with them, so the load
+    # keeps the same share of the GUI thread whatever the size.
+    # The source may also be records already at hand, e.g. the ids of the
+    # shapes of a binary file, added to the document at once : only their
+    # items are built by the same slices.
+    progress = QtCore.pyqtSignal(int)  # per mille of the file
+    finished = QtCore.pyqtSignal()
+    failed = QtCore.pyqtSignal(str)
+
+    FRAME_BUDGET_MS = 8
+    LOOP_RATIO = 2
+    MIN_BATCH = 64
+    MAX_BATCH = 1 << 16
+
+    def __init__(self, source, insert, parent=None):
+        super().__init__(parent)
+        self.insert = insert  # callable adding a list of shape records to the document and the scene
+        self.pending = deque()
+        self.batch_size = self.MIN_BATCH
+        self.loop_clock = QtCore.QElapsedTimer()  # since the end of the last slice
+        self.item_count = 0
+        self.parsed_bytes = 0
+        self.reading = False
+        self.reader = None
+        if isinstance(source, str):
+            self.size = max(os.path.getsize(source), 1)
+            self.reader = ShapeReader(source, backlog=lambda: len(self.pending) - self.batch_size)
+            self.reader.shapes_parsed.connect(self.on_shapes_parsed)
+            self.reader.bytes_read.connect(self.on_bytes_read)
+            self.reader.failed.connect(self.on_failed)
+            self.reader.finished.connect(self.on_reader_finished)
+        else:
+            self.pending.extend(source)
+            self.size = max(len(self.pending), 1)
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.add_batch)
+
+    def start(self):
+        if self.reader:
+            self.reading = True
+            self.reader.start()
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+
+    def cancel(self):
+        if self.reader:
+            self.reader.requestInterruption()
+            self.reader.wait()
+        self.pending.clear()
+        self.stop()
+        self.reading = False
+
+    def is_running(self):
+        return self.reading or bool(self.pending)
+
+    def on_shapes_parsed(self, shapes):
+        self.pending.extend(shapes)
+
+    def on_bytes_read(self, count):
+        self.parsed_bytes = count
+
+    def on_failed(self, message):
+        self.cancel()
+        self.failed.emit(message)
+
+    def on_reader_finished(self):
+        self.reading = False
+
+    def next_shape(self):
+        if self.pending:
+            if not self.reader:
+                self.parsed_bytes += 1  # progress counts the records
+            return self.pending.popleft()
+        return None
+
+    def add_batch(self):
+        loop_ms = self.loop_clock.nsecsElapsed() / 1e6 if self.loop_clock.isValid() else 0
+        clock = QtCore.QElapsedTimer()
+        clock.start()
+        try:
+            count = self.insert_slice()
+        except Exception as e:
+            self.on_failed(str(e))
+            return
+        if count:
+            # the next slice takes as many records as fit in the budget
+            elapsed = max(clock.nsecsElapsed() / 1e6, 0.1)
+            budget = max(self.FRAME_BUDGET_MS, self.LOOP_RATIO * loop_ms)
+            self.batch_size = min(max(int(count * budget / elapsed), self.MIN_BATCH), self.MAX_BATCH)
+        self.item_count += count
+        self.progress.emit(min(1000, self.parsed_bytes * 1000 // self.size))
+        if not self.reading and not self.pending:
+            self.stop()
+            self.finished.emit()
+        else:
+            self.loop_clock.start()
+
+    def insert_slice(self):
+        # Hands the next batch_size records over to insert, returns their
+        # number
+        shapes = []
+        while len(shapes) < self.batch_size:
+            shape = self.next_shape()
+            if shape is None:
+                break
+            shapes.append(shape)
+        if shapes:
+            self.insert(shapes)
+        return len(shapes)
@@ -0,0 +1,134 @@
+import collections
+
+import numpy as np
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+from geometry import path_to_arrays, arrays_to_path
+
+# Level of detail for zoomed out views. Paths keep simplified copies of
+# their geometry at a few tolerances, built in the background by vertex
+# clustering (one NumPy pass per level, far cheaper than RDP), and paint
+# the coarsest one whose error stays under PIXEL_TOLERANCE on screen. Text
+# smaller than TEXT_MIN_PIXELS is drawn as a box, and items smaller than a
+# pixel are not drawn at all.
+
+LEVELS = (1.0, 4.0, 16.0, 64.0)  # simplification tolerances, scene units
+PIXEL_TOLERANCE = 1.0
+MIN_ELEMENTS = 32     # shorter paths are always painted in full
+TEXT_MIN_PIXELS = 4.0
+
+def cluster_points(points, tolerance):
+    # Keeps the first point entering each tolerance-sized grid cell and the
+    # last point : every dropped point is within a cell of a kept one.
+    if len(points) < 3:
+        return points
+    cells = np.floor(points / tolerance)
+    keep = np.empty(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    keep[1:-1] = np.any(cells[1:-1] != cells[:-2], axis=1)
+    return points[keep]
+
+def sub_pixel(rect, scale):
+    return rect.width() * scale < 1.0 and rect.height() * scale < 1.0
+
+class LodPathItem(QtWidgets.QGraphicsPathItem):
+    def __init__(self, path=None, parent=None):
+        super().__init__(path if path is not None else QtGui.QPainterPath(), parent)
+        self.levels = None  # simplified paths, one per LEVELS entry, once built
+
+    def setPath(self, path):
+        super().setPath(path)
+        self.levels = None
+
+    def build_levels(self):
+        # Each level is clustered from the previous one
+        path = self.path()
+        levels = []
+        if path.elementCount() >= MIN_ELEMENTS:
+            arrays = path_to_arrays(path)
+            for tolerance in LEVELS:
+                arrays = [cluster_points(points, tolerance) for points in arrays]
+                levels.append(arrays_to_path(arrays))
+        self.levels = levels
+
+    def level_path(self, scale):
+        # Coarsest ready level precise enough at scale, None for the full path
+        if not self.levels:
+            return None
+        allowed = PIXEL_TOLERANCE / scale
+        path = None
+        for tolerance, level in zip(LEVELS, self.levels):
+            if tolerance > allowed:
+                break
+            path = level
+        return path
+
+    def paint(self, painter, option, widget=None):
+        scale = option.levelOfDetailFromTransform(painter.worldTransform())
+        if sub_pixel(self.boundingRect(), scale):
+            return
+        path = self.level_path(scale)
+        if path is None:
+            super().paint(painter, option, widget)
+            return
+        painter.setPen(self.pen())
+        painter.setBrush(self.brush())
+        painter.drawPath(path)
+
+class LodTextItem(QtWidgets.QGraphicsTextItem):
+    def __init__(self, text="", parent=None):
+        super().__init__(text, parent)
+        self.text_height = QtGui.QFontMetricsF(self.font()).height()
+
+    def setFont(self, font):
+        super().setFont(font)
+        self.text_height = QtGui.QFontMetricsF(font).height()
+
+    def paint(self, painter, option, widget=None):
+        scale = option.levelOfDetailFromTransform(painter.worldTransform())
+        rect = self.boundingRect()
+        if sub_pixel(rect, scale):
+            return
+        if self.text_height * scale < TEXT_MIN_PIXELS:
+            # too small to read : skip the layout, keep the footprint
+            color = QtGui.QColor(self.defaultTextColor())
+            color.setAlpha(64)
+            margin = self.document().documentMargin()
+            painter.fillRect(rect.adjusted(margin, margin, -margin, -margin), color)
+            return
+        super().paint(painter, option, widget)
+
+class LodBuilder(QtCore.QObject):
+    # Builds path levels in FRAME_BUDGET_MS slices of the event loop, so
+    # loading or zooming never waits for them. Paths without levels yet
+    # are painted in full.
+    FRAME_BUDGET_MS = 8
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.queue = collections.deque()
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.build)
+
+    def add(self, items):
+        for item in items:
+            if isinstance(item, LodPathItem) and item.levels is None:
+                self.queue.append(item)
+        if self.queue and not self.timer.isActive():
+            self.timer.start()
+
+    def clear(self):
+        # The scene was cleared : the queued items are deleted
+        self.queue.clear()
+        self.timer.stop()
+
+    def build(self):
+        clock = QtCore.QElapsedTimer()
+        clock.start()
+        while self.queue and clock.elapsed() < self.FRAME_BUDGET_MS:
+            item = self.queue.popleft()
+            if item.levels is None:
+                item.build_levels()
+        if not self.queue:
+            self.timer.stop()
@@ -1,17 +1,84 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
+import time
+started = time.perf_counter()
+
+import logging
+import os
 import sys
-from PyQt5 import QtCore,QtGui,QtWidgets
+from PyQt5 import QtCore,QtWidgets
 
 from window import Window
+from journal import find_unclean
+from metrics import log
+from startup import StartupReport
 
-print(QtCore.QT_VERSION_STR)
+# PAINT_LOG=debug traces the tool, pen and resize handlers
+logging.basicConfig(level=os.environ.get("PAINT_LOG", "warning").upper())
+log.info("Qt %s", QtCore.QT_VERSION_STR)
 
 app=QtWidgets.QApplication(sys.argv)
+startup = StartupReport(started)
+startup.mark("import")
 
 position=0,0
 dimension=600,400
 mw=Window(position,dimension)
+startup.mark("window")
+startup.watch_first_paint(mw.view.viewport())
 mw.show()
+startup.mark("show")
+# PAINT_STARTUP_REPORT=file.json writes the startup report,
+# PAINT_STARTUP_QUIT=1 also exits once it is written
+if os.environ.get("PAINT_STARTUP_REPORT"):
+    startup.finished.connect(lambda report: startup.dump(os.environ["PAINT_STARTUP_REPORT"]))
+if os.environ.get("PAINT_STARTUP_QUIT"):
+    startup.finished.connect(lambda report: mw.close())
+# PAINT_STALL_MS sets the watchdog threshold, 0 turns it off
+stall_ms = int(os.environ.get("PAINT_STALL_MS", Window.STALL_MS))
+if stall_ms > 0:
+    mw.start_watchdog(stall_ms)
+
+def offer_recovery(window, unclean):
+    # Every journal left by a crashed session is offered : the chosen one
+    # is recovered, the others stay for the next start unless discarded.
+    if len(unclean) == 1:
+        reply = QtWidgets.QMessageBox.question(
+            window, "Recover Changes",
+            "Unsaved changes from a previous session were found in\n{}\nDo you want to recover them?".format(unclean[0][1]),
+            QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No
+        )
+        chosen = unclean[0] if reply == QtWidgets.QMessageBox.Yes else None
+    else:
+        labels = ["{}  ({})".format(journal, time.strftime("%Y-%m-%d %H:%M", time.localtime(os.path.getmtime(journal))))
+                  for marker, journal in unclean]
+        label, ok = QtWidgets.QInputDialog.getItem(
+            window, "Recover Changes",
+            "Unsaved changes from {} previous sessions were found.\nChoose the session to recover :".format(len(unclean)),
+            labels, 0, False)
+        chosen = unclean[labels.index(label)] if ok else None
+    if chosen is not None:
+        window.recover_journal(chosen[1])
+        os.remove(chosen[0])
+    others = [entry for entry in unclean if entry is not chosen]
+    if not others:
+        return
+    if len(unclean) > 1:
+        reply = QtWidgets.QMessageBox.question(
+            window, "Recover Changes",
+            "Discard the unsaved changes of the {} other session(s)?\n"
+            "Otherwise they are offered again at the next start.".format(len(others)),
+            QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No
+        )
+        if reply != QtWidgets.QMessageBox.Yes:
+            return
+    for marker, journal in others:
+        if os.path.exists(journal):
+            os.remove(journal)
+        os.remove(marker)
+
+unclean = find_unclean()
+if unclean:
+    offer_recovery(mw, unclean)
 
 sys.exit(app.exec_())
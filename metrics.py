@@ -0,0 +1,76 @@
+import json
+import logging
+import os
+import threading
+import time
+
+# Named counters and timers of the hot paths, plus the application logger.
+#
+#   metrics.count("commands.executed")
+#   started = metrics.start()
+#   ...
+#   metrics.stop("save.write", started)
+#
+# Both are a flag check when metrics are disabled, the default. Setting
+# PAINT_METRICS=file.json enables them and the window dumps them to that
+# file every DUMP_MS and on exit. dump() returns them as JSON on demand.
+
+log = logging.getLogger("paint")
+
+DUMP_MS = 10000
+
+class Metrics:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()  # the saver and loader threads report too
+        self.counters = {}
+        self.timers = {}  # name -> [count, total ms, max ms]
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.timers.clear()
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def start(self):
+        # Start time for stop(), None when metrics are disabled
+        return time.perf_counter() if self.enabled else None
+
+    def stop(self, name, started):
+        if started is None:
+            return
+        elapsed = (time.perf_counter() - started) * 1000
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = [0, 0.0, 0.0]
+            timer[0] += 1
+            timer[1] += elapsed
+            timer[2] = max(timer[2], elapsed)
+
+    def snapshot(self):
+        with self.lock:
+            return {'counters': dict(self.counters),
+                    'timers': {name: {'count': count, 'total_ms': total, 'mean_ms': total / count, 'max_ms': worst}
+                               for name, (count, total, worst) in self.timers.items()}}
+
+    def dump(self, filename=None):
+        # JSON of the counters and timers, also written to filename if given
+        text = json.dumps(self.snapshot(), indent=2, sort_keys=True)
+        if filename:
+            with open(filename, 'w') as file:
+                file.write(text)
+        return text
+
+registry = Metrics(enabled=bool(os.environ.get("PAINT_METRICS")))
+count = registry.count
+start = registry.start
+stop = registry.stop
+dump = registry.dump
@@ -0,0 +1,330 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Recording and replay of editing sessions (.prec).
+#
+#   header | base document name | events
+#
+# The header holds the viewport size, zoom, scroll position, tool and pen
+# when the recording started, the base document is the file that was open
+# (empty for a new document). A document with unsaved changes is first
+# written next to the recording, which names that copy as its base.
+# Every event is one fixed-width record : time since the start in ms,
+# kind, button, buttons, modifiers, viewport x, y, and a code whose meaning
+# depends on the kind (key, wheel delta, tool or action index, pen width)
+# followed by the key text as a code point, or a color as RGBA.
+# Settings chosen in dialogs are recorded by value : simplification
+# tolerances as x. A selection transform is followed by three data records,
+# each holding two doubles of its matrix.
+#
+# Replay : python3 recorder.py session.prec             as fast as possible
+#          python3 recorder.py session.prec --realtime  with the recorded timing
+# Prints the handler latency of every kind of event.
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+from hud import percentile
+
+SUFFIX = ".prec"
+BASE_SUFFIX = ".base.pbin"  # unsaved document a recording starts from
+MAGIC = b"PAINTREC"
+VERSION = 2
+
+HEADER = struct.Struct("<8sIiidiiBxxxIiI")  # magic, version, viewport w, h, scale, scroll x, y,
+                                             # tool, pen color, pen width, base name size
+EVENT = struct.Struct("<IBBBxIffiI")  # time ms, kind, button, buttons, modifiers, x, y, code, text
+DATA = struct.Struct("<IBxxxddI")  # time ms, kind, two values, unused : same size as EVENT
+
+(PRESS, RELEASE, MOVE, DOUBLE_CLICK, WHEEL, KEY_PRESS, KEY_RELEASE, TOOL, ACTION,
+ PEN_COLOR, PEN_WIDTH, TEXT_COLOR, TOLERANCE, SIMPLIFY, TRANSFORM, DATA_KIND) = range(16)
+KIND_NAMES = ['press', 'release', 'move', 'double-click', 'wheel', 'key-press', 'key-release', 'tool', 'action',
+              'pen-color', 'pen-width', 'text-color', 'tolerance', 'simplify', 'transform', 'data']
+MOUSE_KINDS = {
+    QtCore.QEvent.MouseButtonPress: PRESS,
+    QtCore.QEvent.MouseButtonRelease: RELEASE,
+    QtCore.QEvent.MouseMove: MOVE,
+    QtCore.QEvent.MouseButtonDblClick: DOUBLE_CLICK,
+}
+MOUSE_EVENTS = {kind: event for event, kind in MOUSE_KINDS.items()}
+KEY_KINDS = {QtCore.QEvent.KeyPress: KEY_PRESS, QtCore.QEvent.KeyRelease: KEY_RELEASE}
+TOOLS = ["select", "text", "pen", "line", "rectangle", "polygon"]
+ACTIONS = ["undo", "redo", "delete"]  # Window.action_edit_<name>, triggered by a shortcut or a menu
+
+def read_recording(filename):
+    # Returns the header as a dict and the events as tuples in EVENT order,
+    # each ending with the values of the data records that followed it
+    with open(filename, 'rb') as file:
+        data = file.read()
+    if len(data) < HEADER.size:
+        raise ValueError("not a recording : {}".format(filename))
+    magic, version, width, height, scale, scroll_x, scroll_y, tool, color, pen_width, base_size = \
+        HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("not a recording : {}".format(filename))
+    if version not in (1, VERSION):
+        raise ValueError("unsupported recording version {} : this build reads versions 1 and {}".format(
+            version, VERSION))
+    offset = HEADER.size + base_size
+    header = {'viewport': (width, height), 'scale': scale, 'scroll': (scroll_x, scroll_y),
+              'tool': TOOLS[tool], 'pen_color': color, 'pen_width': pen_width,
+              'base': data[HEADER.size:offset].decode('utf-8') or None}
+    count = (len(data) - offset) // EVENT.size  # a torn last record is dropped
+    starts = range(offset, offset + count * EVENT.size, EVENT.size)
+    if version == 1:
+        # Same header and event records, without data records : only the
+        # view input, tools, undo and redo were recorded
+        events = [EVENT.unpack_from(data, start) + ((),) for start in starts]
+        for event in events:
+            if event[1] > ACTION or (event[1] == ACTION and event[7] > ACTIONS.index("redo")):
+                raise ValueError("event kind {} code {} is not in version 1 recordings".format(event[1], event[7]))
+        return header, events
+    events = []
+    for start in starts:
+        if data[start + 4] == DATA_KIND:
+            # the values of data records are appended to the event before them
+            if events:
+                events[-1] = events[-1][:-1] + (events[-1][-1] + DATA.unpack_from(data, start)[2:4],)
+        else:
+            events.append(EVENT.unpack_from(data, start) + ((),))
+    return header, events
+
+class InputRecorder(QtCore.QObject):
+    # Logs the mouse and key events reaching the view, and the tool, pen,
+    # text color, simplification and transform changes and the edit
+    # actions of a window. The events are only observed : the filter never
+    # consumes them.
+    def __init__(self, window, filename, parent=None):
+        super().__init__(parent)
+        self.window = window
+        self.view = window.view
+        self.count = 0
+        self.clock = QtCore.QElapsedTimer()
+        base = window.filename
+        if window.dirty or (not base and len(window.document)):
+            # the file on disk lacks the unsaved changes
+            base = os.path.splitext(filename)[0] + BASE_SUFFIX
+            window.document.snapshot().write_binary(base)
+        self.file = open(filename, 'wb')
+        viewport = self.view.viewport()
+        base = os.path.abspath(base).encode('utf-8') if base else b""
+        pen = self.view.get_pen()
+        self.file.write(HEADER.pack(MAGIC, VERSION, viewport.width(), viewport.height(),
+                                    self.view.transform().m11(), self.view.horizontalScrollBar().value(),
+                                    self.view.verticalScrollBar().value(), TOOLS.index(self.view.tool),
+                                    pen.color().rgba(), pen.width(), len(base)))
+        self.file.write(base)
+        self.actions = [getattr(window, "action_edit_" + name) for name in ACTIONS]
+        self.slots = [lambda checked, index=index: self.write(ACTION, code=index) for index in range(len(ACTIONS))]
+        self.clock.start()
+        viewport.installEventFilter(self)
+        self.view.installEventFilter(self)
+        for action, slot in zip(self.actions, self.slots):
+            action.triggered.connect(slot)
+
+    def write(self, kind, button=0, buttons=0, modifiers=0, pos=QtCore.QPointF(), code=0, text=0):
+        self.file.write(EVENT.pack(self.clock.elapsed(), kind, button, buttons, int(modifiers),
+                                   pos.x(), pos.y(), code, text))
+        self.count += 1
+
+    def write_data(self, first, second):
+        self.file.write(DATA.pack(self.clock.elapsed(), DATA_KIND, first, second, 0))
+
+    def tool_changed(self, tool):
+        self.write(TOOL, code=TOOLS.index(tool))
+
+    def pen_color_changed(self, color):
+        self.write(PEN_COLOR, text=color.rgba())
+
+    def pen_width_changed(self, width):
+        self.write(PEN_WIDTH, code=width)
+
+    def text_color_changed(self, color):
+        self.write(TEXT_COLOR, text=color.rgba())
+
+    def tolerance_changed(self, tolerance):
+        self.write(TOLERANCE, pos=QtCore.QPointF(tolerance, 0.0))
+
+    def paths_simplified(self, tolerance):
+        self.write(SIMPLIFY, pos=QtCore.QPointF(tolerance, 0.0))
+
+    def transformed(self, transform):
+        self.write(TRANSFORM)
+        self.write_data(transform.m11(), transform.m12())
+        self.write_data(transform.m21(), transform.m22())
+        self.write_data(transform.dx(), transform.dy())
+
+    def eventFilter(self, watched, event):
+        kind = event.type()
+        if kind in MOUSE_KINDS:
+            self.write(MOUSE_KINDS[kind], int(event.button()), int(event.buttons()), event.modifiers(),
+                       event.localPos())
+        elif kind == QtCore.QEvent.Wheel:
+            self.write(WHEEL, 0, int(event.buttons()), event.modifiers(), event.posF(), event.angleDelta().y())
+        elif kind in KEY_KINDS:
+            text = event.text()
+            self.write(KEY_KINDS[kind], modifiers=event.modifiers(), code=event.key(),
+                       text=ord(text) if len(text) == 1 else 0)
+        return False
+
+    def stop(self):
+        self.view.viewport().removeEventFilter(self)
+        self.view.removeEventFilter(self)
+        for action, slot in zip(self.actions, self.slots):
+            action.triggered.disconnect(slot)
+        self.file.close()
+        return self.count
+
+class InputReplayer(QtCore.QObject):
+    # Feeds a recording back to a window, either with the recorded timing
+    # or as fast as possible, and times the handlers of every event.
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, window, filename, realtime=False, parent=None):
+        super().__init__(parent)
+        self.window = window
+        self.view = window.view
+        self.header, self.events = read_recording(filename)
+        self.realtime = realtime
+        self.index = 0
+        self.latencies = {}  # kind -> [ms, ...]
+        self.clock = QtCore.QElapsedTimer()
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.step)
+
+    def prepare(self):
+        # Puts the window back in the state the recording started from
+        base = self.header['base']
+        if base and os.path.exists(base):
+            self.window.load_shapes(base)
+        else:
+            base = None
+            self.window.clear_scene()
+        self.window.set_clean(base)
+        self.window.filename = base
+        viewport = self.view.viewport()
+        width, height = self.header['viewport']
+        self.window.resize(self.window.width() + width - viewport.width(),
+                           self.window.height() + height - viewport.height())
+        self.view.setTransform(QtGui.QTransform.fromScale(self.header['scale'], self.header['scale']))
+        self.view.horizontalScrollBar().setValue(self.header['scroll'][0])
+        self.view.verticalScrollBar().setValue(self.header['scroll'][1])
+        self.window.tool_actions[self.header['tool']].trigger()
+        pen = QtGui.QPen(self.view.get_pen())
+        pen.setColor(QtGui.QColor.fromRgba(self.header['pen_color']))
+        pen.setWidth(self.header['pen_width'])
+        self.view.set_pen(pen)
+
+    def start(self):
+        self.prepare()
+        self.index = 0
+        self.clock.start()
+        self.schedule()
+
+    def schedule(self):
+        if self.index >= len(self.events):
+            self.finished.emit()
+        elif self.realtime:
+            self.timer.start(max(0, self.events[self.index][0] - self.clock.elapsed()))
+        else:
+            self.timer.start(0)  # lets the view paint between two events
+
+    def step(self):
+        event = self.events[self.index]
+        self.index += 1
+        start = time.perf_counter()
+        self.send(*event)
+        self.latencies.setdefault(event[1], []).append((time.perf_counter() - start) * 1000)
+        self.schedule()
+
+    def send(self, elapsed, kind, button, buttons, modifiers, x, y, code, text, data=()):
+        modifiers = QtCore.Qt.KeyboardModifiers(modifiers)
+        pos = QtCore.QPointF(x, y)
+        if kind in MOUSE_EVENTS:
+            event = QtGui.QMouseEvent(MOUSE_EVENTS[kind], pos, QtCore.Qt.MouseButton(button),
+                                      QtCore.Qt.MouseButtons(buttons), modifiers)
+            QtWidgets.QApplication.sendEvent(self.view.viewport(), event)
+        elif kind == WHEEL:
+            event = QtGui.QWheelEvent(pos, QtCore.QPointF(self.view.viewport().mapToGlobal(pos.toPoint())),
+                                      QtCore.QPoint(), QtCore.QPoint(0, code), QtCore.Qt.MouseButtons(buttons),
+                                      modifiers, QtCore.Qt.NoScrollPhase, False)
+            QtWidgets.QApplication.sendEvent(self.view.viewport(), event)
+        elif kind in (KEY_PRESS, KEY_RELEASE):
+            # Shortcuts were recorded as actions, the rest reached the view
+            event = QtCore.QEvent.KeyPress if kind == KEY_PRESS else QtCore.QEvent.KeyRelease
+            QtWidgets.QApplication.sendEvent(self.view, QtGui.QKeyEvent(event, code, modifiers,
+                                                                       chr(text) if text else ""))
+        elif kind == TOOL:
+            self.window.tool_actions[TOOLS[code]].trigger()
+        elif kind == ACTION:
+            getattr(self.window, "action_edit_" + ACTIONS[code]).trigger()
+        elif kind == PEN_COLOR:
+            self.view.set_pen_color(QtGui.QColor.fromRgba(text).name())
+        elif kind == PEN_WIDTH:
+            action = next((action for action in self.window.action_pen_size.actions() if action.data() == code), None)
+            if action is not None:
+                action.trigger()
+            else:
+                pen = self.view.get_pen()
+                pen.setWidth(code)
+                self.view.set_pen(pen)
+        elif kind == TEXT_COLOR:
+            self.view.set_text_color(QtGui.QColor.fromRgba(text).name())
+        elif kind == TOLERANCE:
+            self.view.simplify_tolerance = x
+        elif kind == SIMPLIFY:
+            self.window.simplify_paths(x)
+        elif kind == TRANSFORM:
+            self.view.transform_selection(QtGui.QTransform(*data))
+
+    def report(self):
+        # {kind: {'count', 'p50', 'p95', 'max', 'total'}} in ms
+        report = {}
+        for kind, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            report[KIND_NAMES[kind]] = {'count': len(values), 'p50': percentile(values, 0.5),
+                                        'p95': percentile(values, 0.95), 'max': values[-1],
+                                        'total': sum(values)}
+        return report
+
+def format_report(report):
+    lines = ["{:<14} {:>8} {:>10} {:>10} {:>10} {:>10}".format("event", "count", "p50 ms", "p95 ms", "max ms", "total ms")]
+    for kind, stats in report.items():
+        lines.append("{:<14} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.1f}".format(
+            kind, stats['count'], stats['p50'], stats['p95'], stats['max'], stats['total']))
+    return "\n".join(lines)
+
+def print_report(report, file=sys.stdout):
+    # Command line only, the window sends the report to the log
+    print(format_report(report), file=file)
+
+if __name__ == "__main__":
+    from window import Window
+
+    parser = argparse.ArgumentParser(description="Replay a recorded editing session")
+    parser.add_argument("recording")
+    parser.add_argument("--realtime", action="store_true", help="keep the recorded timing")
+    parser.add_argument("--output", help="write the latency report to this JSON file")
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication(sys.argv)
+    window = Window(dimension=(1000, 800))
+    window.autosave_timer.stop()
+    window.show()
+    replayer = InputReplayer(window, args.recording, args.realtime)
+    replayer.finished.connect(app.quit)
+    start = time.perf_counter()
+    QtCore.QTimer.singleShot(0, replayer.start)
+    app.exec_()
+    print("{} events replayed in {:.2f} s".format(len(replayer.events), time.perf_counter() - start))
+    print_report(replayer.report())
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(replayer.report(), file, indent=2)
+    window.set_clean(None)  # nothing to save or recover from a replay
+    window.close()
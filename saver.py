@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+
+from PyQt5 import QtCore
+
+import metrics
+
+from binary_format import is_binary
+
+def read_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+UMASK = read_umask()  # read once here : setting it to read it is not thread safe
+
+def write_document(filename, document):
+    # Write to a temporary file next to the destination and rename it over
+    # the destination, so a failed or interrupted save keeps the old file.
+    directory = os.path.dirname(os.path.abspath(filename))
+    descriptor, temp_name = tempfile.mkstemp(prefix="." + os.path.basename(filename) + ".", suffix=".tmp", dir=directory)
+    os.close(descriptor)
+    try:
+        if is_binary(filename):
+            document.write_binary(temp_name)
+        else:
+            document.write_json(temp_name)
+        # mkstemp creates the file readable by its owner only, the saved
+        # file keeps the mode it had or gets the one open() would give it
+        if os.path.exists(filename):
+            shutil.copymode(filename, temp_name)
+        else:
+            os.chmod(temp_name, 0o666 & ~UMASK)
+        os.replace(temp_name, filename)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+
+class SaveWorker(QtCore.QThread):
+    def __init__(self, filename, snapshot, version, parent=None):
+        super().__init__(parent)
+        self.filename = filename
+        self.snapshot = snapshot
+        self.version = version
+        self.error = None
+
+    def run(self):
+        started = metrics.start()
+        try:
+            write_document(self.filename, self.snapshot)
+            metrics.stop("save.write", started)
+        except Exception as e:
+            self.error = str(e)
+        self.snapshot = None
+
+class BackgroundSaver(QtCore.QObject):
+    # Writes document snapshots on a worker thread. A save requested while
+    # another one is in flight is queued, queued saves are written in the
+    # order they were requested once the current write is done. Only the
+    # most recent queued snapshot of a file is kept : it replaces an older
+    # one, which is never written. version is handed back with the result,
+    # so the caller knows which state of its document reached the disk.
+    saved = QtCore.pyqtSignal(str, int)      # filename, version
+    failed = QtCore.pyqtSignal(str, str, int)  # filename, message, version
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.worker = None
+        self.queued = {}  # filename -> (snapshot, version), in request order
+
+    def is_busy(self):
+        return self.worker is not None or bool(self.queued)
+
+    def save(self, filename, snapshot, version=0):
+        if self.worker:
+            self.queued.pop(filename, None)  # the newer snapshot goes last
+            self.queued[filename] = (snapshot, version)
+        else:
+            self.start(filename, snapshot, version)
+
+    def start(self, filename, snapshot, version):
+        self.worker = SaveWorker(filename, snapshot, version, self)
+        self.worker.finished.connect(lambda worker=self.worker: self.on_finished(worker))
+        self.worker.start()
+
+    def on_finished(self, worker):
+        if worker is not self.worker:
+            return  # already handled by wait()
+        self.worker = None
+        worker.deleteLater()
+        if worker.error is None:
+            self.saved.emit(worker.filename, worker.version)
+        else:
+            self.failed.emit(worker.filename, worker.error, worker.version)
+        if self.queued:
+            filename = next(iter(self.queued))
+            snapshot, version = self.queued.pop(filename)
+            self.start(filename, snapshot, version)
+
+    def wait(self):
+        # Blocks until every queued save has been written. saved and failed
+        # are emitted before this returns.
+        while self.worker:
+            worker = self.worker
+            worker.wait()
+            self.on_finished(worker)
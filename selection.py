@@ -0,0 +1,57 @@
+from PyQt5 import QtCore
+
+class SelectionModel(QtCore.QObject):
+    # Ordered set of selected items. Every change emits the items actually
+    # added and removed, so observers only touch what changed, and bumps
+    # version : equal versions name the same items.
+    changed = QtCore.pyqtSignal(object, object)  # lists added, removed : a list signal would convert each item
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.items = {}  # dict keys keep the insertion order
+        self.version = 0
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def __iter__(self):
+        return iter(list(self.items))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+    def notify(self, added, removed):
+        self.version += 1
+        self.changed.emit(added, removed)
+
+    def add(self, items):
+        added = [item for item in items if item not in self.items]
+        for item in added:
+            self.items[item] = None
+        if added:
+            self.notify(added, [])
+
+    def remove(self, items):
+        removed = [item for item in items if self.items.pop(item, 0) is None]
+        if removed:
+            self.notify([], removed)
+
+    def toggle(self, item):
+        if item in self.items:
+            self.remove([item])
+        else:
+            self.add([item])
+
+    def set(self, items):
+        new_items = dict.fromkeys(items)
+        removed = [item for item in self.items if item not in new_items]
+        added = [item for item in new_items if item not in self.items]
+        self.items = new_items
+        if added or removed:
+            self.notify(added, removed)
+
+    def clear(self):
+        self.set([])
@@ -0,0 +1,263 @@
+import itertools
+import math
+
+import numpy as np
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+from geometry import array_to_polygon
+from lod import LodPathItem, LodTextItem
+
+# Conversion between scene items and the shape records stored in documents.
+# Records are plain dicts : { 'type': 'line' | 'rect' | 'path' | 'polygon' | 'text', ... }
+# Geometry is stored in item coordinates, 'pos' is only written when the
+# item was moved away from the origin. Point lists may also be (n, 2) NumPy
+# arrays, as produced by the binary format. 'id' identifies the item across
+# saves, journals and history.
+
+ITEM_ID = 0  # QGraphicsItem.data() key of the item id
+PARKED = 1   # data() key, set while a document item is kept out of the scene
+item_ids = itertools.count(1)
+last_item_id = 0
+
+def new_item_id():
+    global last_item_id
+    last_item_id = next(item_ids)
+    return last_item_id
+
+def claim_item_id(value):
+    # Ids read from a file must never be handed out again.
+    global item_ids, last_item_id
+    if value > last_item_id:
+        last_item_id = value
+        item_ids = itertools.count(value + 1)
+
+def item_id(item):
+    # The id is also kept on the Python wrapper : data() converts a QVariant
+    # on every call, which adds up over the items of a bulk edit
+    value = getattr(item, 'cached_id', None)
+    if value is None:
+        value = item.data(ITEM_ID)
+        if value is None:
+            value = new_item_id()
+            item.setData(ITEM_ID, value)
+        item.cached_id = value
+    return value
+
+def set_item_id(item, value):
+    claim_item_id(value)
+    item.setData(ITEM_ID, value)
+    item.cached_id = value
+
+def in_document(item):
+    # Committed items out of the scene only because they are off-screen
+    # are still part of the document, see virtual_scene
+    return item.scene() is not None or bool(item.data(PARKED))
+
+def transform_scale(transform):
+    # Factor item transforms scale pens by, the square root of their area ratio
+    return math.sqrt(abs(transform.determinant()))
+
+def scaled_width(width, scale):
+    # Pen width of a record scaled with its geometry, 0 is a cosmetic pen
+    if not width or abs(scale - 1.0) < 1e-9:
+        return width
+    return max(1, round(width * scale))
+
+def baked_pen(pen, transform):
+    if transform.type() < QtGui.QTransform.TxScale:
+        return pen
+    width = scaled_width(pen.width(), transform_scale(transform))
+    if width == pen.width():
+        return pen
+    pen = QtGui.QPen(pen)
+    pen.setWidth(width)
+    return pen
+
+def is_quarter_turn(transform):
+    return abs(transform.m11()) < 1e-12 and abs(transform.m22()) < 1e-12
+
+def is_axis_aligned(transform):
+    # A rect under transform is still a rect
+    return transform.type() <= QtGui.QTransform.TxScale or is_quarter_turn(transform)
+
+def snapshot_item(item, baked=True):
+    # Cheap copy of what a record needs. Qt value types (QLineF, QPainterPath,
+    # QPen, QFont...) are implicitly shared, so this does not copy geometry and
+    # the snapshot can be turned into a record from another thread.
+    # An item transform is baked into the geometry and the pen width : a
+    # rect turned by other than quarter turns becomes a polygon, text is
+    # only moved. baked=False leaves the transform out.
+    transform = item.transform() if baked else QtGui.QTransform()
+    if isinstance(item, QtWidgets.QGraphicsLineItem):
+        return ('line', item_id(item), transform.map(item.line()), baked_pen(item.pen(), transform), None,
+                item.pos())
+    elif isinstance(item, QtWidgets.QGraphicsRectItem):
+        pen = baked_pen(item.pen(), transform)
+        if is_axis_aligned(transform):
+            return ('rect', item_id(item), transform.mapRect(item.rect()), pen, item.brush(), item.pos())
+        return ('polygon', item_id(item), transform.map(QtGui.QPolygonF(item.rect())), pen, item.brush(),
+                item.pos())
+    elif isinstance(item, QtWidgets.QGraphicsPathItem):
+        path = item.path()
+        return ('path', item_id(item), path if transform.isIdentity() else transform.map(path),
+                baked_pen(item.pen(), transform), None, item.pos())
+    elif isinstance(item, QtWidgets.QGraphicsPolygonItem):
+        return ('polygon', item_id(item), transform.map(item.polygon()), baked_pen(item.pen(), transform),
+                item.brush(), item.pos())
+    elif isinstance(item, QtWidgets.QGraphicsTextItem):
+        return ('text', item_id(item), item.toPlainText(), item.font(), item.defaultTextColor(),
+                item.pos() + QtCore.QPointF(transform.dx(), transform.dy()))
+    return None  # Unsupported item type
+
+def snapshot_scene(scene):
+    snapshot = []
+    for item in scene.items():
+        item_snapshot = snapshot_item(item)
+        if item_snapshot is not None:
+            snapshot.append(item_snapshot)
+    return snapshot
+
+def snapshot_to_shape(snapshot):
+    kind, id_, geometry, pen, brush, pos = snapshot
+    if kind == 'line':
+        shape_data = {
+            'type': 'line',
+            'id': id_,
+            'start': (geometry.x1(), geometry.y1()),
+            'end': (geometry.x2(), geometry.y2()),
+            'color': pen.color().name(),
+            'width': pen.width()
+        }
+    elif kind == 'rect':
+        shape_data = {
+            'type': 'rect',
+            'id': id_,
+            'rect': (geometry.x(), geometry.y(), geometry.width(), geometry.height()),
+            'color': pen.color().name(),
+            'width': pen.width(),
+            'brush-color': brush.color().name(),
+            'brush-style': int(brush.style())
+        }
+    elif kind == 'path':  # Handling freehand pen drawings
+        shape_data = {
+            'type': 'path',
+            'id': id_,
+            'path': [[(point.x(), point.y()) for point in polygon] for polygon in geometry.toSubpathPolygons()],
+            'color': pen.color().name(),
+            'width': pen.width()
+        }
+    elif kind == 'polygon':
+        shape_data = {
+            'type': 'polygon',
+            'id': id_,
+            'points': [(point.x(), point.y()) for point in geometry],
+            'color': pen.color().name(),
+            'width': pen.width(),
+            'brush-color': brush.color().name(),
+            'brush-style': int(brush.style())
+        }
+    else:
+        # text : geometry is the plain text, pen the font and brush the color
+        return {
+            'type': 'text',
+            'id': id_,
+            'text': geometry,
+            'pos': (pos.x(), pos.y()),
+            'font': pen.toString(),
+            'color': brush.name()
+        }
+    if not pos.isNull():
+        shape_data['pos'] = (pos.x(), pos.y())
+    return shape_data
+
+def item_to_shape(item, baked=True):
+    snapshot = snapshot_item(item, baked)
+    if snapshot is None:
+        return None
+    return snapshot_to_shape(snapshot)
+
+def shape_pen(shape, styles=None):
+    # styles caches pens and brushes across the shapes of a batch : items
+    # given the same QPen share its data instead of holding a copy each
+    key = ('pen', shape['color'], shape['width'])
+    pen = styles.get(key) if styles is not None else None
+    if pen is None:
+        pen = QtGui.QPen(QtGui.QColor(shape['color']))
+        pen.setWidth(shape['width'])
+        if styles is not None:
+            styles[key] = pen
+    return pen
+
+def shape_brush(shape, styles=None):
+    key = ('brush', shape['brush-color'], shape['brush-style'])
+    brush = styles.get(key) if styles is not None else None
+    if brush is None:
+        brush = QtGui.QBrush(QtGui.QColor(shape['brush-color']))
+        brush.setStyle(QtCore.Qt.BrushStyle(shape['brush-style']))
+        if styles is not None:
+            styles[key] = brush
+    return brush
+
+def to_polygon(points):
+    if isinstance(points, np.ndarray):
+        return array_to_polygon(points)
+    return QtGui.QPolygonF([QtCore.QPointF(x, y) for x, y in points])
+
+ITEM_CLASSES = {
+    'line': QtWidgets.QGraphicsLineItem,
+    'rect': QtWidgets.QGraphicsRectItem,
+    'path': LodPathItem,
+    'polygon': QtWidgets.QGraphicsPolygonItem,
+    'text': LodTextItem,
+}
+
+def apply_shape(item, shape, styles=None):
+    # Gives an item of the record's type the geometry, style, position and
+    # id of the record, items are reused this way by item virtualization
+    kind = shape['type']
+    if kind == 'line':
+        item.setLine(*shape['start'], *shape['end'])
+        item.setPen(shape_pen(shape, styles))
+    elif kind == 'rect':
+        item.setRect(*shape['rect'])
+        item.setPen(shape_pen(shape, styles))
+        item.setBrush(shape_brush(shape, styles))
+    elif kind == 'path':  # Loading freehand pen drawings
+        path = QtGui.QPainterPath()
+        for polygon in shape['path']:
+            path.addPolygon(to_polygon(polygon))
+        item.setPath(path)
+        item.setPen(shape_pen(shape, styles))
+    elif kind == 'polygon':
+        item.setPolygon(to_polygon(shape['points']))
+        item.setPen(shape_pen(shape, styles))
+        item.setBrush(shape_brush(shape, styles))
+    elif kind == 'text':
+        item.setPlainText(shape['text'])
+        font = QtGui.QFont()
+        font.fromString(shape['font'])
+        item.setFont(font)
+        item.setDefaultTextColor(QtGui.QColor(shape['color']))
+    item.setPos(QtCore.QPointF(*shape['pos']) if 'pos' in shape else QtCore.QPointF())
+    if not item.transform().isIdentity():
+        item.resetTransform()  # records have their transform baked in
+    if 'id' in shape:
+        set_item_id(item, shape['id'])
+
+def shape_to_item(shape, styles=None):
+    item_class = ITEM_CLASSES.get(shape['type'])
+    if item_class is None:
+        return None
+    item = item_class()
+    apply_shape(item, shape, styles)
+    return item
+
+def shapes_to_items(shapes):
+    # Items of a batch of records, unsupported records are skipped
+    styles = {}
+    items = []
+    for shape in shapes:
+        item = shape_to_item(shape, styles)
+        if item:
+            items.append(item)
+    return items
@@ -0,0 +1,86 @@
+import time
+
+import numpy as np
+from PyQt5 import QtWidgets
+
+from geometry import path_to_arrays, arrays_to_path
+
+def rdp_mask(points, tolerance):
+    # Ramer-Douglas-Peucker : boolean mask of the vertices to keep.
+    # Each split computes all point/segment distances in one NumPy pass.
+    count = len(points)
+    keep = np.ones(count, dtype=bool)
+    if count < 3 or tolerance <= 0:
+        return keep
+    keep[1:-1] = False
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start = points[first]
+        dx, dy = points[last] - start
+        inner = points[first + 1:last] - start
+        length = np.hypot(dx, dy)
+        if length == 0:
+            distances = np.hypot(inner[:, 0], inner[:, 1])
+        else:
+            distances = np.abs(dx * inner[:, 1] - dy * inner[:, 0]) / length
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            index += first + 1
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return keep
+
+def simplify_points(points, tolerance):
+    return points[rdp_mask(points, tolerance)]
+
+class SimplifyStats:
+    def __init__(self):
+        self.paths = 0
+        self.vertices_before = 0
+        self.vertices_after = 0
+        self.seconds = 0.0
+
+    def ratio(self):
+        if self.vertices_before == 0:
+            return 1.0
+        return self.vertices_after / self.vertices_before
+
+    def add(self, before, after):
+        self.paths += 1
+        self.vertices_before += before
+        self.vertices_after += after
+
+    def __str__(self):
+        return "Simplified {} path(s) : {} -> {} vertices ({:.1%}) in {:.1f} ms".format(
+            self.paths, self.vertices_before, self.vertices_after, self.ratio(), self.seconds * 1000)
+
+def simplify_path(path, tolerance, stats=None):
+    start = time.perf_counter()
+    before = after = 0
+    simplified = []
+    for points in path_to_arrays(path):
+        kept = simplify_points(points, tolerance)
+        before += len(points)
+        after += len(kept)
+        simplified.append(kept)
+    result = arrays_to_path(simplified)
+    if stats is not None:
+        stats.add(before, after)
+        stats.seconds += time.perf_counter() - start
+    return result
+
+def simplify_path_items(items, tolerance, stats=None):
+    # Batch pass over existing path items : returns (item, old_path, new_path)
+    # for every path item that lost vertices, the scene is left untouched.
+    changes = []
+    for item in items:
+        if isinstance(item, QtWidgets.QGraphicsPathItem):
+            old_path = item.path()
+            new_path = simplify_path(old_path, tolerance, stats)
+            if new_path.elementCount() < old_path.elementCount():
+                changes.append((item, old_path, new_path))
+    return changes
@@ -0,0 +1,314 @@
+import itertools
+import math
+import operator
+
+import numpy as np
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+from geometry import path_to_arrays, polygon_to_array
+
+class GridIndex:
+    # Uniform grid over the scene bounds of the committed items.
+    # Rect, lasso and nearest-item queries only look at the cells they
+    # cover. Items spanning too many cells are kept aside in a short list
+    # that every query checks.
+    MAX_CELLS_PER_ITEM = 256
+
+    def __init__(self, cell_size=64.0):
+        self.cell_size = cell_size
+        self.cells = {}    # (column, row) -> set of items
+        self.entries = {}  # item -> [scene rect, [left, top, right, bottom] cells or None, segments, sequence]
+        self.large = set()
+        self.sequence = itertools.count()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, item):
+        return item in self.entries
+
+    def clear(self):
+        self.cells.clear()
+        self.entries.clear()
+        self.large.clear()
+
+    def cell_range(self, rect):
+        size = self.cell_size
+        return (math.floor(rect.left() / size), math.floor(rect.top() / size),
+                math.floor(rect.right() / size), math.floor(rect.bottom() / size))
+
+    def insert(self, item):
+        self.remove(item)
+        self.insert_many([item])
+
+    def remove(self, item):
+        entry = self.entries.pop(item, None)
+        if entry is None:
+            return None
+        self.unfile(item, entry[1])
+        return entry[0]
+
+    def unfile(self, item, cells):
+        # Takes item out of the cells range, or out of the large items
+        if cells is None:
+            self.large.discard(item)
+            return
+        left, top, right, bottom = cells
+        for column in range(left, right + 1):
+            for row in range(top, bottom + 1):
+                cell = self.cells[(column, row)]
+                cell.discard(item)
+                if not cell:
+                    del self.cells[(column, row)]
+
+    def remove_many(self, items):
+        # Drops items from the index, returns their scene rects. When they
+        # are many, the cells are filtered at once instead of item by item.
+        items = [item for item in dict.fromkeys(items) if item in self.entries]
+        if len(items) * 4 < len(self.entries):
+            return [self.remove(item) for item in items]
+        entries = [self.entries.pop(item) for item in items]
+        if len(self.entries) < len(items):
+            # fewer items stay than go : refill the grid with them
+            self.cells.clear()
+            self.large.clear()
+            self.reinsert(list(self.entries))
+            return [entry[0] for entry in entries]
+        gone = set(items)
+        if self.large:
+            self.large -= gone
+        for key, cell in list(self.cells.items()):
+            if not cell.isdisjoint(gone):
+                rest = cell - gone
+                if rest:
+                    self.cells[key] = rest
+                else:
+                    del self.cells[key]
+        return [entry[0] for entry in entries]
+
+    def insert_many(self, items):
+        # Items to index, none of them is indexed yet. Their cells are found
+        # and filled at once with NumPy. Returns their united bounds.
+        rects = list(map(QtWidgets.QGraphicsItem.sceneBoundingRect, items))  # unbound : no lookup per item
+        if not rects:
+            return QtCore.QRectF()
+        coords = np.fromiter(itertools.chain.from_iterable(map(QtCore.QRectF.getCoords, rects)),
+                             dtype=float, count=4 * len(rects)).reshape(-1, 4)
+        for index in np.flatnonzero((coords[:, 0] == coords[:, 2]) | (coords[:, 1] == coords[:, 3])).tolist():
+            rects[index].adjust(-0.5, -0.5, 0.5, 0.5)  # empty rects never intersect
+            coords[index] += (-0.5, -0.5, 0.5, 0.5)
+        cells = np.floor(coords / self.cell_size).astype(np.int64)
+        widths, heights = cells[:, 2] - cells[:, 0] + 1, cells[:, 3] - cells[:, 1] + 1
+        large = widths * heights > self.MAX_CELLS_PER_ITEM
+        self.fill_cells(items, cells, widths, heights, np.flatnonzero(~large))
+        sequences = itertools.islice(self.sequence, len(rects))
+        entries = list(map(list, zip(rects, cells.tolist(), itertools.repeat(None), sequences)))
+        for index in np.flatnonzero(large).tolist():
+            entries[index][1] = None
+            self.large.add(items[index])
+        self.entries.update(zip(items, entries))
+        (left, top), (right, bottom) = coords[:, :2].min(axis=0), coords[:, 2:].max(axis=0)
+        return QtCore.QRectF(left, top, right - left, bottom - top)
+
+    def reinsert(self, items):
+        # Puts indexed items back into the cells their entries name
+        if not items:
+            return
+        keys = [self.entries[item][1] for item in items]
+        self.large.update(item for item, cells in zip(items, keys) if cells is None)
+        small = [index for index, cells in enumerate(keys) if cells is not None]
+        cells = np.array([keys[index] for index in small], dtype=np.int64).reshape(-1, 4)
+        widths, heights = cells[:, 2] - cells[:, 0] + 1, cells[:, 3] - cells[:, 1] + 1
+        self.fill_cells([items[index] for index in small], cells, widths, heights, np.arange(len(small)))
+
+    def fill_cells(self, items, cells, widths, heights, rows):
+        # Adds items[rows] to every cell of their ranges : (item, cell)
+        # pairs are sorted by cell and each cell takes its group at once
+        if not len(rows):
+            return
+        counts = widths[rows] * heights[rows]
+        owners = np.repeat(rows, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        columns = cells[owners, 0] + offsets % widths[owners]
+        cell_rows = cells[owners, 1] + offsets // widths[owners]
+        order = np.lexsort((cell_rows, columns))
+        columns, cell_rows, owners = columns[order], cell_rows[order], owners[order]
+        starts = np.flatnonzero(np.concatenate([[True], (np.diff(columns) != 0) | (np.diff(cell_rows) != 0)]))
+        ends = np.append(starts[1:], len(owners))
+        members = np.empty(len(items), dtype=object)
+        members[:] = items
+        members = members[owners].tolist()
+        cells = self.cells
+        for key, start, end in zip(zip(columns[starts].tolist(), cell_rows[starts].tolist()),
+                                   starts.tolist(), ends.tolist()):
+            cell = cells.get(key)
+            if cell is None:
+                cells[key] = set(members[start:end])
+            else:
+                cell.update(members[start:end])
+
+    def update(self, items):
+        # Reindexes items after a change, items no longer in a scene are
+        # dropped. Returns the united new scene bounds, the old ones were
+        # already in the scene rect.
+        self.remove_many(items)
+        scenes = map(QtWidgets.QGraphicsItem.scene, items)
+        return self.insert_many([item for item, scene in zip(items, scenes) if scene is not None])
+
+    def translate(self, items, dx, dy):
+        # Reindexes items that all moved by (dx, dy), e.g. a nudged
+        # selection : their rects are shifted without asking the items for
+        # their bounds and only the ones crossing a cell border change
+        # cells. Returns the united new scene bounds, like update.
+        entries = list(map(self.entries.get, items))
+        if not entries or None in entries:
+            return self.update(items)
+        rects = list(map(operator.itemgetter(0), entries))
+        old = np.fromiter(itertools.chain.from_iterable(map(QtCore.QRectF.getCoords, rects)),
+                          dtype=float, count=4 * len(rects)).reshape(-1, 4)
+        coords = old + (dx, dy, dx, dy)
+        # new rects : the old ones may still be held, e.g. as tile damage
+        rects = map(QtCore.QRectF.translated, rects, itertools.repeat(dx), itertools.repeat(dy))
+        for entry, rect in zip(entries, rects):
+            entry[0] = rect
+            entry[2] = None
+        cells = np.floor(coords / self.cell_size).astype(np.int64)
+        widths, heights = cells[:, 2] - cells[:, 0] + 1, cells[:, 3] - cells[:, 1] + 1
+        large = widths * heights > self.MAX_CELLS_PER_ITEM
+        was_large = np.fromiter(map(operator.is_, map(operator.itemgetter(1), entries), itertools.repeat(None)),
+                                dtype=bool, count=len(entries))
+        moved = (np.floor(old / self.cell_size).astype(np.int64) != cells).any(axis=1) | large | was_large
+        rows = np.flatnonzero(moved)
+        for index in rows.tolist():
+            entry = entries[index]
+            self.unfile(items[index], entry[1])
+            entry[1] = None if large[index] else cells[index].tolist()
+        self.large.update(items[index] for index in np.flatnonzero(large).tolist())
+        self.fill_cells(items, cells, widths, heights, rows[~large[rows]])
+        (left, top), (right, bottom) = coords[:, :2].min(axis=0), coords[:, 2:].max(axis=0)
+        return QtCore.QRectF(left, top, right - left, bottom - top)
+
+    def rebuild(self, items):
+        self.clear()
+        self.insert_many(list(items))
+
+    def bounds_many(self, items):
+        # Scene rects of items, None for the ones not indexed
+        get = self.entries.get
+        return [entry[0] if entry else None for entry in map(get, items)]
+
+    def bounds(self, item):
+        entry = self.entries.get(item)
+        return entry[0] if entry else None
+
+    def candidates(self, rect):
+        left, top, right, bottom = self.cell_range(rect)
+        if (right - left + 1) * (bottom - top + 1) > len(self.cells):
+            found = set(self.entries)  # query wider than the populated grid
+        else:
+            found = set(self.large)
+            for column in range(left, right + 1):
+                for row in range(top, bottom + 1):
+                    cell = self.cells.get((column, row))
+                    if cell:
+                        found |= cell
+        return found
+
+    def query_rect(self, rect):
+        # Items whose scene bounds intersect rect, bottom-most first
+        found = [item for item in self.candidates(rect) if self.entries[item][0].intersects(rect)]
+        found.sort(key=lambda item: self.entries[item][3])
+        return found
+
+    def query_lasso(self, polygon):
+        # Items whose shape intersects the closed scene polygon
+        lasso = QtGui.QPainterPath()
+        lasso.addPolygon(polygon)
+        lasso.closeSubpath()
+        return [item for item in self.query_rect(polygon.boundingRect())
+                if lasso.intersects(item.sceneTransform().map(item.shape()))]
+
+    def segments(self, item):
+        entry = self.entries[item]
+        if entry[2] is None:
+            entry[2] = item_segments(item)
+        return entry[2]
+
+    def distance(self, item, point):
+        x, y = point.x(), point.y()
+        segments = self.segments(item)
+        if segments is None or filled(item, point):
+            rect = self.entries[item][0]
+            dx = max(rect.left() - x, 0.0, x - rect.right())
+            dy = max(rect.top() - y, 0.0, y - rect.bottom())
+            return math.hypot(dx, dy)
+        if len(segments) == 0:
+            return math.inf
+        return float(segment_distances(segments, x, y).min()) - pen_half_width(item)
+
+    def nearest(self, point, tolerance):
+        # Topmost item within tolerance of point, by distance to its outline
+        probe = QtCore.QRectF(point.x() - tolerance, point.y() - tolerance, 2 * tolerance, 2 * tolerance)
+        best, best_key = None, None
+        for item in self.candidates(probe):
+            if not self.entries[item][0].intersects(probe):
+                continue
+            distance = self.distance(item, point)
+            if distance > tolerance:
+                continue
+            key = (max(distance, 0.0), -item.zValue(), -self.entries[item][3])
+            if best_key is None or key < best_key:
+                best, best_key = item, key
+        return best
+
+def pen_half_width(item):
+    if hasattr(item, 'pen'):
+        return item.pen().widthF() / 2.0
+    return 0.0
+
+def filled(item, point):
+    # Text and filled shapes are hit anywhere inside their outline
+    if isinstance(item, QtWidgets.QGraphicsTextItem):
+        return True
+    if isinstance(item, (QtWidgets.QGraphicsRectItem, QtWidgets.QGraphicsPolygonItem)):
+        if item.brush().style() != QtCore.Qt.NoBrush:
+            return item.contains(item.mapFromScene(point))
+    return False
+
+def item_segments(item):
+    # (n, 4) array of x1, y1, x2, y2 outline segments in scene coordinates,
+    # None for items hit-tested on their bounds
+    if isinstance(item, QtWidgets.QGraphicsLineItem):
+        line = item.line()
+        runs = [np.array([[line.x1(), line.y1()], [line.x2(), line.y2()]])]
+    elif isinstance(item, QtWidgets.QGraphicsRectItem):
+        rect = item.rect()
+        runs = [np.array([[rect.left(), rect.top()], [rect.right(), rect.top()],
+                          [rect.right(), rect.bottom()], [rect.left(), rect.bottom()],
+                          [rect.left(), rect.top()]])]
+    elif isinstance(item, QtWidgets.QGraphicsPathItem):
+        runs = path_to_arrays(item.path())
+    elif isinstance(item, QtWidgets.QGraphicsPolygonItem):
+        points = polygon_to_array(item.polygon())
+        runs = [np.vstack([points, points[:1]])] if len(points) else []
+    else:
+        return None
+    transform = item.sceneTransform()
+    matrix = np.array([[transform.m11(), transform.m12()],
+                       [transform.m21(), transform.m22()]])
+    offset = np.array([transform.dx(), transform.dy()])
+    segments = [np.hstack([run[:-1], run[1:]]) for run in runs if len(run) > 1]
+    if not segments:
+        return np.empty((0, 4))
+    segments = np.vstack(segments)
+    segments[:, 0:2] = segments[:, 0:2] @ matrix + offset
+    segments[:, 2:4] = segments[:, 2:4] @ matrix + offset
+    return segments
+
+def segment_distances(segments, x, y):
+    x1, y1, x2, y2 = segments.T
+    dx, dy = x2 - x1, y2 - y1
+    length2 = dx * dx + dy * dy
+    t = ((x - x1) * dx + (y - y1) * dy) / np.where(length2 > 0, length2, 1.0)
+    t = np.clip(np.where(length2 > 0, t, 0.0), 0.0, 1.0)
+    return np.hypot(x1 + t * dx - x, y1 + t * dy - y)
@@ -0,0 +1,60 @@
+import json
+import os
+import time
+
+from PyQt5 import QtCore
+
+from metrics import log
+
+class StartupReport(QtCore.QObject):
+    # Time spent in each phase of a cold start, from the first line of
+    # main.py to the end of the first paint of the view :
+    #   import   modules imported and QApplication created
+    #   window   Window constructed
+    #   show     window shown
+    #   paint    first paint of the view done
+    # Over BUDGET_MS (PAINT_STARTUP_BUDGET_MS) the report is a warning.
+    BUDGET_MS = 1000
+    finished = QtCore.pyqtSignal(dict)
+
+    def __init__(self, started, budget_ms=None, parent=None):
+        super().__init__(parent)
+        self.started = self.last = started  # time.perf_counter()
+        self.budget = budget_ms or int(os.environ.get("PAINT_STARTUP_BUDGET_MS", self.BUDGET_MS))
+        self.phases = {}
+        self.widget = None
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = round((now - self.last) * 1000, 1)
+        self.last = now
+
+    def watch_first_paint(self, widget):
+        self.widget = widget
+        widget.installEventFilter(self)
+
+    def eventFilter(self, watched, event):
+        if event.type() == QtCore.QEvent.Paint:
+            watched.removeEventFilter(self)
+            QtCore.QTimer.singleShot(0, self.finish)  # after the paint itself
+        return False
+
+    def finish(self):
+        self.mark("paint")
+        report = self.report()
+        message = "startup %.0f ms (%s), budget %d ms"
+        args = (report['total_ms'], ", ".join("{} {}".format(*phase) for phase in self.phases.items()), self.budget)
+        if report['over_budget']:
+            log.warning(message, *args)
+        else:
+            log.info(message, *args)
+        self.finished.emit(report)
+
+    def report(self):
+        total = round((self.last - self.started) * 1000, 1)
+        return {'phases_ms': dict(self.phases), 'total_ms': total, 'budget_ms': self.budget,
+                'over_budget': total > self.budget}
+
+    def dump(self, filename):
+        with open(filename, 'w') as file:
+            json.dump(self.report(), file, indent=2)
@@ -0,0 +1,65 @@
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+from lod import LodPathItem
+
+class LiveStrokeItem(QtWidgets.QGraphicsItem):
+    # Freehand stroke being drawn : points are appended in place and only
+    # the rectangle of the new segment is invalidated.
+    CHUNK_SIZE = 256    # points per polyline chunk, painting skips hidden chunks
+    GROW_MARGIN = 64.0  # bounds grow by steps so the scene reindexes rarely
+
+    def __init__(self, start, pen, parent=None):
+        super().__init__(parent)
+        self.pen = QtGui.QPen(pen)
+        self.margin = max(self.pen.widthF(), 1.0) / 2.0 + 1.0
+        self.path = QtGui.QPainterPath()
+        self.path.moveTo(start)
+        self.last_point = QtCore.QPointF(start)
+        self.chunks = [[QtGui.QPolygonF([QtCore.QPointF(start)]), self.segment_rect(start, start)]]
+        self.bounds = self.segment_rect(start, start).adjusted(-self.GROW_MARGIN, -self.GROW_MARGIN,
+                                                                self.GROW_MARGIN, self.GROW_MARGIN)
+        self.setFlag(QtWidgets.QGraphicsItem.ItemUsesExtendedStyleOption)
+
+    def segment_rect(self, p1, p2):
+        m = self.margin
+        return QtCore.QRectF(p1, p2).normalized().adjusted(-m, -m, m, m)
+
+    def point_count(self):
+        return self.path.elementCount()
+
+    def add_point(self, point):
+        point = QtCore.QPointF(point)
+        self.path.lineTo(point)
+        chunk = self.chunks[-1]
+        if chunk[0].size() >= self.CHUNK_SIZE:
+            chunk = [QtGui.QPolygonF([self.last_point]), self.segment_rect(self.last_point, self.last_point)]
+            self.chunks.append(chunk)
+        chunk[0].append(point)
+        segment = self.segment_rect(self.last_point, point)
+        chunk[1] = chunk[1].united(segment)
+        if not self.bounds.contains(segment):
+            self.prepareGeometryChange()
+            g = self.GROW_MARGIN
+            self.bounds = self.bounds.united(segment.adjusted(-g, -g, g, g))
+        self.last_point = point
+        self.update(segment)
+
+    def commit(self):
+        # QPainterPath is implicitly shared : the committed item reuses the
+        # path built during the stroke instead of rebuilding it.
+        item = LodPathItem(self.path)
+        item.setPen(QtGui.QPen(self.pen))
+        return item
+
+    def boundingRect(self):
+        return self.bounds
+
+    def shape(self):
+        return self.path
+
+    def paint(self, painter, option, widget=None):
+        painter.setPen(self.pen)
+        exposed = option.exposedRect
+        for polygon, rect in self.chunks:
+            if rect.intersects(exposed):
+                painter.drawPolyline(polygon)
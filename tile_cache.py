@@ -0,0 +1,173 @@
+import collections
+import math
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+from lod import sub_pixel
+
+class FlattenedLayer(QtWidgets.QGraphicsItem):
+    # Hidden parent of the flattened items : the scene skips the whole
+    # subtree in one step when it paints.
+    def __init__(self):
+        super().__init__()
+        self.hide()
+
+    def boundingRect(self):
+        return QtCore.QRectF()
+
+    def paint(self, painter, option, widget=None):
+        pass
+
+class TileCache:
+    # Flattened layer : the committed items are rasterized into QImage tiles
+    # keyed by zoom level and tile coordinate, the view blits the tiles and
+    # only paints the live items itself. Flattened items are moved under a
+    # hidden FlattenedLayer so the scene does not visit them. Tiles are
+    # dropped when an item inside them changes through the command layer.
+    TILE_SIZE = 256   # device pixels
+    MAX_TILES = 384   # 96 MB of ARGB32 tiles
+    PADDING = 2.0     # device pixels of antialiasing around an item
+
+    def __init__(self, index):
+        self.index = index
+        self.enabled = False
+        self.tiles = collections.OrderedDict()  # (zoom, column, row) -> QImage, least recent first
+        self.zooms = collections.Counter()      # zoom -> cached tiles
+        self.live = set()
+        self.layer = None
+        self.rendered = 0
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def clear(self):
+        # The scene was cleared : the layer went with the items
+        self.tiles.clear()
+        self.zooms.clear()
+        self.live.clear()
+        self.layer = None
+
+    def set_enabled(self, enabled, items):
+        # items : every committed item, flattened or restored at once
+        for item in items:
+            self.flatten(item, enabled)
+        self.enabled = enabled
+        self.tiles.clear()
+        self.zooms.clear()
+        self.live.clear()
+
+    def flatten(self, item, flattened):
+        if flattened:
+            if self.layer is None:
+                self.layer = FlattenedLayer()
+                item.scene().addItem(self.layer)
+            if item.parentItem() is not self.layer:
+                item.setParentItem(self.layer)
+        elif self.layer is not None and item.parentItem() is self.layer:
+            item.setParentItem(None)
+
+    def items_changed(self, items, old_bounds):
+        # Called once the index is up to date. Returns the damaged scene
+        # rects, the scene does not repaint flattened items by itself.
+        if not self.enabled and self.layer is None:
+            return []  # nothing flattened : the scene repaints the items
+        new_bounds = self.index.bounds_many(items)
+        damaged = [bounds for bounds in old_bounds + new_bounds if bounds is not None]
+        if self.enabled or self.layer is not None:
+            for item, bounds in zip(items, new_bounds):
+                self.flatten(item, self.enabled and bounds is not None and item not in self.live)
+        if self.enabled:
+            self.invalidate(damaged)
+        return damaged
+
+    def set_live(self, items):
+        # Items changing outside the command layer, e.g. while dragged, are
+        # painted by the scene until they are committed again.
+        items = set(items) if self.enabled else set()
+        damaged = []
+        for item in self.live - items:
+            if item in self.index:
+                self.flatten(item, True)
+                damaged.append(self.index.bounds(item))
+        for item in items - self.live:
+            self.flatten(item, False)
+            damaged.append(self.index.bounds(item) or item.sceneBoundingRect())
+        self.live = items
+        self.invalidate(damaged)
+        return damaged
+
+    def tile_range(self, rect, zoom):
+        size = self.TILE_SIZE
+        pad = self.PADDING
+        return (math.floor((rect.left() * zoom - pad) / size), math.floor((rect.top() * zoom - pad) / size),
+                math.floor((rect.right() * zoom + pad) / size), math.floor((rect.bottom() * zoom + pad) / size))
+
+    def invalidate(self, rects):
+        for zoom in list(self.zooms):
+            for rect in rects:
+                left, top, right, bottom = self.tile_range(rect, zoom)
+                for column in range(left, right + 1):
+                    for row in range(top, bottom + 1):
+                        self.discard((zoom, column, row))
+
+    def discard(self, key):
+        if self.tiles.pop(key, None) is not None:
+            self.zooms[key[0]] -= 1
+            if not self.zooms[key[0]]:
+                del self.zooms[key[0]]
+
+    def tile(self, zoom, column, row, hints):
+        key = (zoom, column, row)
+        image = self.tiles.get(key)
+        if image is None:
+            image = self.render(zoom, column, row, hints)
+            self.tiles[key] = image
+            self.zooms[zoom] += 1
+            while len(self.tiles) > self.MAX_TILES:
+                self.discard(next(iter(self.tiles)))
+        else:
+            self.tiles.move_to_end(key)
+        return image
+
+    def render(self, zoom, column, row, hints):
+        size = self.TILE_SIZE
+        image = QtGui.QImage(size, size, QtGui.QImage.Format_ARGB32_Premultiplied)
+        image.fill(0)
+        area = QtCore.QRectF(column * size / zoom, row * size / zoom, size / zoom, size / zoom)
+        painter = QtGui.QPainter(image)
+        painter.setRenderHints(hints)
+        painter.translate(-column * size, -row * size)
+        painter.scale(zoom, zoom)
+        base = painter.transform()
+        option = QtWidgets.QStyleOptionGraphicsItem()
+        for item in self.index.query_rect(area):
+            if item in self.live or sub_pixel(self.index.bounds(item), zoom):
+                continue
+            painter.setTransform(item.sceneTransform() * base)
+            option.exposedRect = item.boundingRect()
+            item.paint(painter, option, None)
+        painter.end()
+        self.rendered += 1
+        return image
+
+    def draw(self, painter, rect):
+        # Blits the tiles covering the exposed scene rect. The view only
+        # scales and scrolls, tiles are drawn unscaled at whole pixels.
+        transform = painter.worldTransform()
+        zoom = round(transform.m11(), 6)
+        size = self.TILE_SIZE
+        dx, dy = round(transform.dx()), round(transform.dy())
+        left, top = math.floor(rect.left() * zoom / size), math.floor(rect.top() * zoom / size)
+        right, bottom = math.floor(rect.right() * zoom / size), math.floor(rect.bottom() * zoom / size)
+        hints = painter.renderHints()
+        painter.save()
+        painter.resetTransform()
+        for column in range(left, right + 1):
+            for row in range(top, bottom + 1):
+                painter.drawImage(QtCore.QPoint(column * size + dx, row * size + dy),
+                                  self.tile(zoom, column, row, hints))
+        painter.restore()
+
+    def memory_usage(self):
+        return {'tiles': len(self.tiles), 'bytes': sum(image.byteCount() for image in self.tiles.values()),
+                'zoom_levels': len(self.zooms), 'rendered': self.rendered}
@@ -0,0 +1,101 @@
+import numpy as np
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+# Affine transforms of whole selections.
+#
+# A group transform is one QTransform in scene coordinates. Item positions
+# go through it as one NumPy array, and its linear part is composed into
+# the item transforms : items that had the same transform share the
+# composed one. Text is only moved, its anchor follows the group, since
+# shape records can not rotate or scale text. Records bake item transforms
+# into their geometry, see shapes.snapshot_item, and Document.transform
+# applies the same matrix to the stored coordinates at once.
+
+def rotation(angle, center):
+    # angle in degrees, clockwise on screen as y points down
+    return (QtGui.QTransform.fromTranslate(-center.x(), -center.y())
+            * QtGui.QTransform().rotate(angle)
+            * QtGui.QTransform.fromTranslate(center.x(), center.y()))
+
+def scaling(sx, sy, center):
+    return (QtGui.QTransform.fromTranslate(-center.x(), -center.y())
+            * QtGui.QTransform.fromScale(sx, sy)
+            * QtGui.QTransform.fromTranslate(center.x(), center.y()))
+
+def flip(horizontal, center):
+    return scaling(-1.0, 1.0, center) if horizontal else scaling(1.0, -1.0, center)
+
+def translation(dx, dy):
+    return QtGui.QTransform.fromTranslate(dx, dy)
+
+def linear_part(transform):
+    # Row vector convention of Qt : p' = p @ matrix + offset
+    return (np.array([[transform.m11(), transform.m12()], [transform.m21(), transform.m22()]]),
+            np.array([transform.dx(), transform.dy()]))
+
+def item_positions(items):
+    # (n, 2) array of the item positions, unbound methods mapped over the
+    # items, see TransformCommand.apply
+    return np.column_stack([list(map(QtWidgets.QGraphicsItem.x, items)),
+                            list(map(QtWidgets.QGraphicsItem.y, items))]).reshape(-1, 2)
+
+def transform_items(items, transform):
+    # States of items before and after the scene transform, each a
+    # (positions, transforms) pair with positions as an (n, 2) array.
+    # An item maps c to c * T + pos, so c * T * L + pos * L + offset is
+    # T * L at the moved position.
+    positions = item_positions(items)
+    matrix, offset = linear_part(transform)
+    moved = positions @ matrix + offset
+    linear = QtGui.QTransform(transform.m11(), transform.m12(), transform.m21(), transform.m22(), 0.0, 0.0)
+    old_transforms, new_transforms = [], []
+    last_old = last_new = None
+    for item, old in zip(items, map(QtWidgets.QGraphicsItem.transform, items)):
+        if last_old is None or old != last_old:
+            last_old, last_new = old, old * linear
+        old_transforms.append(last_old)
+        new_transforms.append(last_old if isinstance(item, QtWidgets.QGraphicsTextItem) else last_new)
+    return (positions, old_transforms), (moved, new_transforms)
+
+def selection_center(document, ids):
+    # Center of the scene bounds of the shapes ids
+    left, top, right, bottom = document.extent(ids)
+    return QtCore.QPointF((left + right) / 2.0, (top + bottom) / 2.0)
+
+class TransformDialog(QtWidgets.QDialog):
+    # Numeric entry of a selection transform : scale, then rotate, both
+    # about the selection center, then move
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Transform Selection")
+        layout = QtWidgets.QFormLayout(self)
+        self.move_x = self.spin_box(-100000.0, 100000.0, 0.0, " px")
+        self.move_y = self.spin_box(-100000.0, 100000.0, 0.0, " px")
+        self.angle = self.spin_box(-360.0, 360.0, 0.0, " °")
+        self.scale_x = self.spin_box(-10000.0, 10000.0, 100.0, " %")
+        self.scale_y = self.spin_box(-10000.0, 10000.0, 100.0, " %")
+        layout.addRow("Move X :", self.move_x)
+        layout.addRow("Move Y :", self.move_y)
+        layout.addRow("Rotate :", self.angle)
+        layout.addRow("Scale X :", self.scale_x)
+        layout.addRow("Scale Y :", self.scale_y)
+        buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addRow(buttons)
+
+    def spin_box(self, low, high, value, suffix):
+        box = QtWidgets.QDoubleSpinBox()
+        box.setRange(low, high)
+        box.setDecimals(2)
+        box.setValue(value)
+        box.setSuffix(suffix)
+        return box
+
+    def transform(self, center):
+        # Scene transform entered, None when it would collapse the selection
+        sx, sy = self.scale_x.value() / 100.0, self.scale_y.value() / 100.0
+        if sx == 0 or sy == 0:
+            return None
+        return (scaling(sx, sy, center) * rotation(self.angle.value(), center)
+                * translation(self.move_x.value(), self.move_y.value()))
@@ -1,6 +1,25 @@
+import gc
+import logging
+import itertools
 import sys
+import time
 from PyQt5 import QtCore, QtGui, QtWidgets
 
+from stroke import LiveStrokeItem
+from simplify import SimplifyStats, simplify_path
+from spatial_index import GridIndex
+from tile_cache import TileCache
+from damage import DamageRegion, RepaintMeter
+from hud import FrameMetrics, HudOverlay
+import metrics
+from metrics import log
+from lod import LodBuilder, LodPathItem, LodTextItem
+from selection import SelectionModel
+from shapes import is_axis_aligned, item_id, item_to_shape, scaled_width, transform_scale
+from geometry import path_to_arrays, arrays_to_path
+from history import History, item_size, apply_state
+from transform import item_positions, transform_items
+
 class TextToolbar(QtWidgets.QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -31,35 +50,156 @@ class TextToolbar(QtWidgets.QWidget):
         self.setLayout(layout)
 
 class Command:
+    name = "Edit"  # shown in the history panel
+    translation = None  # (dx, dy) : the last execute or undo moved every item by it and changed nothing else
+
     def execute(self):
         pass
     
     def undo(self):
         pass
 
+    def items(self):
+        # Items whose state changes when the command is executed or undone
+        return []
+
+    def merge(self, other):
+        # Absorbs other, executed right after this command, into a single
+        # history entry. Returns False when the commands cannot be merged.
+        return False
+
+    def size(self):
+        # Approximate memory pinned by the command, in bytes
+        return 96
+
+    def to_record(self):
+        # Picklable form used when the history spills to disk, turned back
+        # into a command by View.restore_command. None keeps the command in
+        # memory.
+        return None
+
+    def update_document(self, document, undo=False):
+        # Edits the rows of the document the command changes, before it is
+        # executed or undone on its items by update_items
+        pass
+
+    def update_items(self, document, undo=False):
+        # Brings the items in line with the rows update_document changed. By
+        # default the command runs on its items, whose rows are then stored
+        # again from them.
+        if undo:
+            self.undo()
+        else:
+            self.execute()
+        document.update_items(self.items())
+
+def show_item(scene, item, shown):
+    # Adds item to the scene or takes it out, as its row is in the document
+    # or not
+    if shown and item.scene() is None:
+        scene.addItem(item)
+        metrics.count("items.added")
+    elif not shown and item.scene() is not None:
+        scene.removeItem(item)
+        metrics.count("items.removed")
+
+def item_record(item):
+    # The item transform is kept apart from the shape : the history sets it
+    # again on an item rebuilt from the record, so that a spilled
+    # TransformCommand restores the transforms it recorded
+    record = {'id': item_id(item), 'shape': item_to_shape(item, baked=False)}
+    if not item.transform().isIdentity():
+        record['transform'] = matrix_record(item.transform())
+    return record
+
+def matrix_record(transform):
+    return (transform.m11(), transform.m12(), transform.m21(), transform.m22(), transform.dx(), transform.dy())
+
 class AddItemCommand(Command):
+    # A new shape only exists as the item just drawn : its row is built from
+    # the item once, then taken out of the document by undo and put back as
+    # is by redo. The item is in the scene while its row is in the document.
+    name = "Add"
+
     def __init__(self, scene, item):
         self.scene = scene
         self.item = item
+        self.taken = None  # rows taken out by undo
     
     def execute(self):
         self.scene.addItem(self.item)
+        metrics.count("items.added")
     
     def undo(self):
         self.scene.removeItem(self.item)
+        metrics.count("items.removed")
+
+    def items(self):
+        return [self.item]
+
+    def size(self):
+        return 96 + item_size(self.item)
+
+    def to_record(self):
+        return {'command': 'add', 'item': item_record(self.item)}
+
+    def update_document(self, document, undo=False):
+        if undo:
+            self.taken = document.take([item_id(self.item)])
+        elif self.taken is not None:
+            document.restore(self.taken)
+        else:
+            document.store([self.item])
+
+    def update_items(self, document, undo=False):
+        show_item(self.scene, self.item, item_id(self.item) in document)
 
 class RemoveItemCommand(Command):
+    name = "Delete"
+
     def __init__(self, scene, item):
         self.scene = scene
         self.item = item
+        self.taken = None  # rows taken out of the document, see remove_rows
     
     def execute(self):
         self.scene.removeItem(self.item)
+        metrics.count("items.removed")
     
     def undo(self):
         self.scene.addItem(self.item)
+        metrics.count("items.added")
+
+    def items(self):
+        return [self.item]
+
+    def size(self):
+        return 96 + item_size(self.item)
+
+    def to_record(self):
+        return {'command': 'remove', 'item': item_record(self.item)}
+
+    def update_document(self, document, undo=False):
+        remove_rows(document, [self], undo)
+
+    def update_items(self, document, undo=False):
+        show_item(self.scene, self.item, item_id(self.item) in document)
+
+def remove_rows(document, removes, undo=False):
+    # Takes the rows of the RemoveItemCommands removes out of the document
+    # in one batch, kept by the first one : undo puts the same rows back.
+    # Commands restored from the history have no rows and rebuild them from
+    # their items.
+    if not undo:
+        removes[0].taken = document.take([item_id(command.item) for command in removes])
+    elif removes[0].taken is not None:
+        document.restore(removes[0].taken)
+    else:
+        document.store([command.item for command in removes])
 
 class MoveItemCommand(Command):
+    name = "Move"
+
     def __init__(self, item, old_pos, new_pos):
         self.item = item
         self.old_pos = old_pos
@@ -71,7 +211,334 @@ class MoveItemCommand(Command):
     def undo(self):
         self.item.setPos(self.old_pos)
 
+    def items(self):
+        return [self.item]
+
+    def merge(self, other):
+        if isinstance(other, MoveItemCommand) and other.item is self.item:
+            self.new_pos = other.new_pos
+            return True
+        return False
+
+    def to_record(self):
+        return {'command': 'move', 'item': item_record(self.item),
+                'old': (self.old_pos.x(), self.old_pos.y()), 'new': (self.new_pos.x(), self.new_pos.y())}
+
+    def update_document(self, document, undo=False):
+        move_rows(document, [self], undo)
+
+    def update_items(self, document, undo=False):
+        pos = self.old_pos if undo else self.new_pos
+        (x, y), = document.positions([item_id(self.item)], [(pos.x(), pos.y())]).tolist()
+        self.item.setPos(x, y)
+
+def move_rows(document, moves, undo=False):
+    # Moves the rows of the MoveItemCommands moves, one Document.translate
+    # per offset : the moves of a dragged or nudged selection share theirs
+    offsets = {}
+    for move in moves:
+        offsets.setdefault((move.new_pos.x() - move.old_pos.x(), move.new_pos.y() - move.old_pos.y()),
+                           []).append(move.item)
+    for (dx, dy), items in offsets.items():
+        ids = [item_id(item) for item in items]
+        missing = [item for item, id_ in zip(items, ids) if id_ not in document]
+        if missing:
+            # stored as they are before the move
+            document.update_items(missing)
+            ids = [id_ for id_ in ids if id_ in document]
+        document.translate(ids, -dx if undo else dx, -dy if undo else dy)
+
+class MoveItemsCommand(Command):
+    # One offset applied to many items, as a drag or a nudge moves the
+    # selection. Positions are an (n, 2) array, see TransformCommand, and
+    # the rows are moved by one Document.translate, the items then take the
+    # positions of their rows. Nudges of the same items share a merge_key,
+    # which names them, and collapse into one entry.
+    name = "Move"
+
+    def __init__(self, items, old, offset, merge_key=None, name=None, ids=None):
+        self.changed = items
+        self.old = old
+        self.offset = offset  # (dx, dy)
+        self.merge_key = merge_key
+        self.ids = ids  # item ids, taken on the first document update
+        if name:
+            self.name = name
+
+    def following(self, offset):
+        # The next move of the same items, from where this one left them :
+        # nothing is read back from the items
+        return MoveItemsCommand(self.changed, self.old + self.offset, offset, self.merge_key, self.name, self.ids)
+
+    def execute(self):
+        self.apply(self.old + self.offset)
+        self.translation = self.offset
+
+    def undo(self):
+        self.apply(self.old)
+        self.translation = (-self.offset[0], -self.offset[1])
+
+    def apply(self, positions):
+        xs, ys = positions.T.tolist()
+        list(map(QtWidgets.QGraphicsItem.setPos, self.changed, xs, ys))
+
+    def items(self):
+        return self.changed
+
+    def merge(self, other):
+        if self.merge_key is None or not isinstance(other, MoveItemsCommand) or other.merge_key != self.merge_key:
+            return False
+        self.offset = (self.offset[0] + other.offset[0], self.offset[1] + other.offset[1])
+        return True
+
+    def size(self):
+        return 96 + 24 * len(self.changed)
+
+    def to_record(self):
+        return {'command': 'move-items', 'items': [item_record(item) for item in self.changed],
+                'old': self.old, 'offset': self.offset, 'name': self.name}
+
+    def update_document(self, document, undo=False):
+        dx, dy = self.offset
+        if undo:
+            dx, dy = -dx, -dy
+        if self.ids is None:
+            self.ids = list(map(item_id, self.changed))
+        try:
+            document.translate(self.ids, dx, dy)
+        except KeyError:
+            # items not stored yet, e.g. rebuilt from a spilled record, are
+            # stored as they are before the move
+            document.update_items([item for item, id_ in zip(self.changed, self.ids) if id_ not in document])
+            document.translate([id_ for id_ in self.ids if id_ in document], dx, dy)
+
+    def update_items(self, document, undo=False):
+        self.apply(document.positions(self.ids, self.old if undo else self.old + self.offset))
+        self.translation = (-self.offset[0], -self.offset[1]) if undo else self.offset
+
+class MacroCommand(Command):
+    # Commands of one gesture, undone and redone as a single history entry.
+    # Macros sharing a merge_key collapse into one entry.
+    def __init__(self, commands, merge_key=None, name=None):
+        self.commands = list(commands)
+        self.merge_key = merge_key
+        self.name = name or (self.commands[0].name if self.commands else Command.name)
+        # merges keep the items of the commands
+        self.changed = list(dict.fromkeys(itertools.chain.from_iterable(command.items() for command in self.commands)))
+
+    def execute(self):
+        for command in self.commands:
+            command.execute()
+
+    def undo(self):
+        for command in reversed(self.commands):
+            command.undo()
+
+    def items(self):
+        return self.changed
+
+    def merge(self, other):
+        if (self.merge_key is None or not isinstance(other, MacroCommand)
+                or other.merge_key != self.merge_key or len(other.commands) != len(self.commands)):
+            return False
+        # Check every pair before merging so a refusal leaves self untouched
+        if not all(type(mine) is type(theirs) and mine.items() == theirs.items()
+                   for mine, theirs in zip(self.commands, other.commands)):
+            return False
+        return all([mine.merge(theirs) for mine, theirs in zip(self.commands, other.commands)])
+
+    def size(self):
+        return 64 + sum(command.size() for command in self.commands)
+
+    def update_document(self, document, undo=False):
+        if self.commands and all(isinstance(command, MoveItemCommand) for command in self.commands):
+            move_rows(document, self.commands, undo)
+            return
+        if self.commands and all(isinstance(command, RemoveItemCommand) for command in self.commands):
+            remove_rows(document, self.commands, undo)
+            return
+        for command in reversed(self.commands) if undo else self.commands:
+            command.update_document(document, undo)
+
+    def update_items(self, document, undo=False):
+        for command in reversed(self.commands) if undo else self.commands:
+            command.update_items(document, undo)
+
+    def to_record(self):
+        # A spilled macro is too old to be merged again : the key is dropped
+        records = [command.to_record() for command in self.commands]
+        if any(record is None for record in records):
+            return None
+        return {'command': 'macro', 'name': self.name, 'commands': records}
+
+class SetPathCommand(Command):
+    name = "Simplify"
+
+    def __init__(self, changes):
+        self.changes = changes  # [(item, old_path, new_path), ...]
+
+    def execute(self):
+        for item, old_path, new_path in self.changes:
+            item.setPath(new_path)
+
+    def undo(self):
+        for item, old_path, new_path in self.changes:
+            item.setPath(old_path)
+
+    def items(self):
+        return [item for item, old_path, new_path in self.changes]
+
+    def size(self):
+        return 96 + sum(40 * (old_path.elementCount() + new_path.elementCount())
+                        for item, old_path, new_path in self.changes)
+
+    def to_record(self):
+        return {'command': 'set-path',
+                'changes': [(item_record(item), path_to_arrays(old_path), path_to_arrays(new_path))
+                            for item, old_path, new_path in self.changes]}
+
+    def update_document(self, document, undo=False):
+        # Only the geometry runs of the rows change, baked with the item
+        # transform as shapes.snapshot_item does
+        for item, old_path, new_path in self.changes:
+            id_ = item_id(item)
+            if id_ not in document:
+                continue
+            path = old_path if undo else new_path
+            transform = item.transform()
+            shape = document.shape(id_)
+            shape['path'] = path_to_arrays(path if transform.isIdentity() else transform.map(path))
+            document.put(id_, shape)
+        document.compact_if_needed()
+
+    def update_items(self, document, undo=False):
+        # The rows hold the paths baked with the item transforms, the items
+        # take them unbaked from the command
+        if undo:
+            self.undo()
+        else:
+            self.execute()
+
+class TransformCommand(Command):
+    # One scene transform applied to many items, see transform.py. States
+    # are (positions, transforms) pairs, positions an (n, 2) array. The
+    # document rows are transformed in bulk instead of rebuilt per item,
+    # then the items take the positions of their rows.
+    name = "Transform"
+
+    def __init__(self, items, old, new, transform):
+        self.changed = items
+        self.old = old
+        self.new = new
+        self.transform = transform
+        self.ids = None  # item ids, taken on the first document update
+        self.rects = None  # indexes of the rect items, see Document.transform_rects
+
+    def execute(self):
+        self.apply(self.new)
+
+    def undo(self):
+        self.apply(self.old)
+
+    def apply(self, state):
+        # Unbound methods mapped over the items skip the attribute lookup on
+        # every item wrapper
+        positions, transforms = state
+        xs, ys = positions.T.tolist()
+        list(map(QtWidgets.QGraphicsItem.setPos, self.changed, xs, ys))
+        list(map(QtWidgets.QGraphicsItem.setTransform, self.changed, transforms))
+
+    def update_document(self, document, undo=False):
+        # Rects may turn into polygons and back, as the item transform they
+        # get is a quarter turn or not. Pen widths follow the scale of each
+        # item transform, as shapes.baked_pen computes them.
+        transform, state = (self.transform.inverted()[0], self.old) if undo else (self.transform, self.new)
+        transforms = state[1]
+        if self.ids is None:
+            self.ids = list(map(item_id, self.changed))
+            self.rects = [index for index, item in enumerate(self.changed)
+                          if isinstance(item, QtWidgets.QGraphicsRectItem)]
+        missing = [item for item, id_ in zip(self.changed, self.ids) if id_ not in document]
+        if missing:
+            # items not stored yet, e.g. rebuilt from a spilled record, are
+            # stored as they are before the transform
+            document.update_items(missing)
+        stored = document.index
+        rects = [index for index in self.rects if self.ids[index] in stored]
+        if rects or missing:
+            skipped = set(rects)
+            rows = [(index, id_) for index, id_ in enumerate(self.ids) if id_ in stored and index not in skipped]
+        else:
+            rows = list(enumerate(self.ids))
+        document.transform([id_ for index, id_ in rows], transform)
+        if rects:
+            document.transform_rects([self.ids[index] for index in rects], transform,
+                                     [is_axis_aligned(transforms[index]) for index in rects])
+            rows += [(index, self.ids[index]) for index in rects]
+        if abs(transform_scale(transform) - 1.0) < 1e-9:
+            return
+        scales = {}
+        ids, widths = [], []
+        for index, id_ in rows:
+            item = self.changed[index]
+            if isinstance(item, QtWidgets.QGraphicsTextItem):
+                continue
+            key = id(transforms[index])  # items of a group share their transform
+            if key not in scales:
+                scales[key] = transform_scale(transforms[index])
+            ids.append(id_)
+            widths.append(scaled_width(item.pen().width(), scales[key]))
+        document.set_widths(ids, widths)
+
+    def update_items(self, document, undo=False):
+        positions, transforms = self.old if undo else self.new
+        self.apply((document.positions(self.ids, positions), transforms))
+
+    def items(self):
+        return self.changed
+
+    def size(self):
+        return 96 + 160 * len(self.changed)
+
+    def to_record(self):
+        # Both states are recorded : a spilled command is rebuilt while a
+        # jump moves the items, so their state then tells nothing
+        return {'command': 'transform', 'items': [item_record(item) for item in self.changed],
+                'matrix': matrix_record(self.transform),
+                'old': state_record(self.old), 'new': state_record(self.new)}
+
+def state_record(state):
+    # (positions, matrices, index of the matrix of each item) : items of a
+    # group share their transform, see transform_items
+    positions, transforms = state
+    matrices, index, keys = [], [], {}
+    for transform in transforms:
+        key = id(transform)
+        if key not in keys:
+            keys[key] = len(matrices)
+            matrices.append(matrix_record(transform))
+        index.append(keys[key])
+    return positions, matrices, index
+
+def record_state(record):
+    positions, matrices, index = record
+    transforms = [QtGui.QTransform(*matrix) for matrix in matrices]
+    return positions, [transforms[i] for i in index]
+
 class View(QtWidgets.QGraphicsView):
+    stroke_simplified = QtCore.pyqtSignal(object)
+    # list of the items touched by a command, its undo or redo, sent as an
+    # object : a list signal would convert every item
+    document_changed = QtCore.pyqtSignal(object)
+    history_changed = QtCore.pyqtSignal()
+    PICK_TOLERANCE = 4  # pixels around the cursor for click selection
+    SELECTION_MARGIN = 2  # pixels between an item and its selection frame
+    POLYGON_HANDLE_SIZE = 4  # pixels, vertices of the polygon in progress
+    ZOOM_RANGE = (0.01, 64.0)
+    ZOOM_STEP = 1.0015  # scale factor per wheel delta unit, 1/8 of a degree
+    BULK_ITEMS = 1000  # commands touching this many items run with the scene index suspended
+    FIND_SCAN_RATIO = 8  # find_items scans the whole index for more than 1/8 of its items
+
     def __init__(self, position=(0,0), dimension=(600,400)):
         QtWidgets.QGraphicsView.__init__(self)
         x, y = position
@@ -81,36 +548,48 @@ class View(QtWidgets.QGraphicsView):
         self.begin, self.end = QtCore.QPoint(0,0), QtCore.QPoint(0,0)
         self.pen, self.brush = None, None
         self.tool = "select"
-        self.selected_items = []
+        self.selection = SelectionModel(self)
+        self.selection.changed.connect(self.on_selection_changed)
+        self.selection_bounds = {}  # selected item -> cached scene bounds
         self.rubberBand = None
         self.dragging = False
         self.drag_start_pos = None
-        self.item_original_positions = {}
-        self.current_path = None
+        self.drag_items = []
+        self.drag_positions = None  # positions of drag_items when pressed
+        self.drag_extent = QtCore.QRectF()  # selection bounds when pressed
+        self.drag_offset = (0.0, 0.0)  # of the selection, drawn translated until released
+        self.drag_bulk = False  # the drag runs with the scene index suspended
         self.current_text_item = None
-        self.undo_stack = []
-        self.redo_stack = []
+        self.history = History(self.restore_command, self.find_items)
+        self.simplify_tolerance = 0.0  # scene units, 0 keeps every pen sample
+        self.spatial_index = GridIndex()
+        self.tile_cache = TileCache(self.spatial_index)
+        self.lod_builder = LodBuilder(self)
+        self.index_suspended = 0  # nesting of suspend_indexing calls
+        self.suspended_update_mode = None
+        self.collector_enabled = True  # gc state before the outermost suspend_indexing
+        self.virtualizer = None  # ItemVirtualizer while off-screen items are virtual
+        self.document = None  # Document kept by the window, commands edit its rows
+        self.jump_items = {}  # items changed so far by the jump in progress
+        self.pan_start = None
+        self.damage = DamageRegion(self.viewport(), self)
+        self.repaint_meter = RepaintMeter()
+        self.frame_metrics = FrameMetrics(self, self)
+        self.hud = HudOverlay(self)
+        self.setTransformationAnchor(QtWidgets.QGraphicsView.AnchorUnderMouse)
         
         self.create_style()
         self.temp_item = None  # Temporary item for real-time drawing
         
-        self.text_toolbar = TextToolbar(self)
-        self.text_toolbar.hide()
+        self.text_toolbar = None  # built by get_text_toolbar on first use
         
         self.current_font = QtGui.QFont()
         self.text_color = QtGui.QColor(QtCore.Qt.black)
-        self.original_colors = {}
 
         self.polygons = []
-        self.current_polygon = []
+        self.current_polygon = QtGui.QPolygonF()  # scene points of the polygon in progress
         self.drawing_polygon = False
-        
-        # Connect toolbar signals
-        self.text_toolbar.font_family.currentFontChanged.connect(self.update_font)
-        self.text_toolbar.font_size.currentTextChanged.connect(self.update_font)
-        self.text_toolbar.bold_button.toggled.connect(self.update_font)
-        self.text_toolbar.italic_button.toggled.connect(self.update_font)
-        self.text_toolbar.underline_button.toggled.connect(self.update_font)
+        self.polygon_cursor = None  # scene end of the rubber line
 
     def __repr__(self):
         return "<View({},{},{})>".format(self.pen, self.brush, self.tool)
@@ -123,15 +602,19 @@ class View(QtWidgets.QGraphicsView):
         if self.current_text_item:
             self.current_text_item.setDefaultTextColor(self.text_color)
         # Update the color of selected text items
-        for item in self.selected_items:
-            if isinstance(item, QtWidgets.QGraphicsTextItem):
-                item.setDefaultTextColor(self.text_color)
+        recolored = [item for item in self.selection if isinstance(item, QtWidgets.QGraphicsTextItem)]
+        for item in recolored:
+            item.setDefaultTextColor(self.text_color)
+        if recolored:
+            if self.document is not None:
+                self.document.update_items(recolored)
+            self.items_changed(recolored)
 
     def set_pen(self, pen):
         self.pen = QtGui.QPen(pen)
 
     def set_pen_color(self, color):
-        print("View.set_pen_color(self,color)", color)
+        log.debug("View.set_pen_color %s", color)
         self.pen.setColor(QtGui.QColor(color))
 
     def get_brush(self):
@@ -141,14 +624,14 @@ class View(QtWidgets.QGraphicsView):
         self.brush = brush
 
     def set_brush_color(self, color):
-        print("View.set_brush_color(self,color)", color)
+        log.debug("View.set_brush_color %s", color)
         self.brush.setColor(QtGui.QColor(color))
 
     def get_tool(self):
         return self.tool
 
     def set_tool(self, tool):
-        print("View.set_tool(self,tool)", tool)
+        log.debug("View.set_tool %s", tool)
         if self.tool == "text":
             self.finalize_text_input()
         self.tool = tool
@@ -172,12 +655,26 @@ class View(QtWidgets.QGraphicsView):
         self.brush.setColor(QtCore.Qt.blue)
         self.brush.setStyle(QtCore.Qt.CrossPattern)
 
+    def get_text_toolbar(self):
+        # The font combo box enumerates and previews every system font, most
+        # sessions never need it
+        if self.text_toolbar is None:
+            self.text_toolbar = TextToolbar(self)
+            self.text_toolbar.font_family.currentFontChanged.connect(self.update_font)
+            self.text_toolbar.font_size.currentTextChanged.connect(self.update_font)
+            self.text_toolbar.bold_button.toggled.connect(self.update_font)
+            self.text_toolbar.italic_button.toggled.connect(self.update_font)
+            self.text_toolbar.underline_button.toggled.connect(self.update_font)
+        return self.text_toolbar
+
     def show_text_toolbar(self):
-        self.text_toolbar.show()
-        self.text_toolbar.setGeometry(0, 0, self.width(), 40)
+        toolbar = self.get_text_toolbar()
+        toolbar.show()
+        toolbar.setGeometry(0, 0, self.width(), 40)
 
     def hide_text_toolbar(self):
-        self.text_toolbar.hide()
+        if self.text_toolbar:
+            self.text_toolbar.hide()
 
     def update_font(self):
         font = self.text_toolbar.font_family.currentFont()
@@ -200,7 +697,7 @@ class View(QtWidgets.QGraphicsView):
             if self.current_text_item:
                 self.finalize_text_input()
             
-            self.current_text_item = QtWidgets.QGraphicsTextItem()
+            self.current_text_item = LodTextItem()
             self.current_text_item.setTextInteractionFlags(QtCore.Qt.TextEditorInteraction)
             self.current_text_item.setPos(self.mapToScene(pos))
             self.current_text_item.setFont(self.current_font)
@@ -217,123 +714,417 @@ class View(QtWidgets.QGraphicsView):
                 self.execute_command(AddItemCommand(self.scene(), self.current_text_item))
             self.current_text_item = None
 
+    def find_items(self, ids):
+        # {id: item} for the committed items with the given ids. Each is
+        # looked for in the index cells around its document bounds, or all
+        # at once in one pass over the index when they are many.
+        ids = set(ids)
+        # items changed by the steps of a jump so far are not reindexed yet
+        found = {item_id(item): item for item in self.jump_items if item_id(item) in ids}
+        wanted = ids - found.keys()
+        if self.virtualizer:
+            for id_ in wanted:
+                item = self.virtualizer.items.get(id_, self.virtualizer.parked.get(id_))
+                if item is not None:
+                    found[id_] = item
+            return found
+        if self.document is not None:
+            wanted = {id_ for id_ in wanted if id_ in self.document}
+            if len(wanted) * self.FIND_SCAN_RATIO < len(self.spatial_index):
+                near = list(wanted)
+                bounds = self.document.rows['bounds'][self.document.rows_of(near)].tolist()
+                for id_, (left, top, right, bottom) in zip(near, bounds):
+                    for item in self.spatial_index.candidates(QtCore.QRectF(left, top, right - left, bottom - top)):
+                        if item_id(item) == id_:
+                            found[id_] = item
+                            break
+        missing = wanted - found.keys()
+        if missing:
+            for item in self.spatial_index.entries:
+                if item_id(item) in missing:
+                    found[item_id(item)] = item
+        return found
+
+    def realize(self, items):
+        # Items kept out of the scene by virtualization go back in before a
+        # command changes them
+        if self.virtualizer:
+            self.virtualizer.realize(items)
+
     def execute_command(self, command):
-        command.execute()
-        self.undo_stack.append(command)
-        self.redo_stack.clear()
+        self.realize(command.items())
+        self.history.prepare(command)
+        bulk = self.begin_bulk(command.items())
+        try:
+            self.run_command(command)
+            self.history.push(command)
+            metrics.count("commands.executed")
+            self.command_done(command)
+        finally:
+            self.end_bulk(bulk)
     
     def undo(self):
-        if self.undo_stack:
-            command = self.undo_stack.pop()
-            command.undo()
-            self.redo_stack.append(command)
-            self.scene().update()
+        command = self.history.undo()
+        if command:
+            self.realize(command.items())
+            bulk = self.begin_bulk(command.items())
+            try:
+                self.run_command(command, undo=True)
+                self.scene().update()
+                metrics.count("commands.undone")
+                self.command_done(command)
+            finally:
+                self.end_bulk(bulk)
 
     def redo(self):
-        if self.redo_stack:
-            command = self.redo_stack.pop()
-            command.execute()
-            self.undo_stack.append(command)
+        command = self.history.redo()
+        if command:
+            self.realize(command.items())
+            bulk = self.begin_bulk(command.items())
+            try:
+                self.run_command(command)
+                self.history.enforce_budget()
+                self.scene().update()
+                metrics.count("commands.redone")
+                self.command_done(command)
+            finally:
+                self.end_bulk(bulk)
+
+    def begin_bulk(self, items):
+        # Commands touching many items run, and are indexed afterwards,
+        # with the scene index suspended. Returns whether it is, for end_bulk.
+        bulk = len(items) >= self.BULK_ITEMS
+        if bulk:
+            self.suspend_indexing()
+        return bulk
+
+    def end_bulk(self, bulk):
+        if bulk:
+            self.resume_indexing()
+
+    def run_command(self, command, undo=False):
+        # With a document the command edits its rows first, then its items
+        # are updated from the changed rows
+        if self.document is None:
+            if undo:
+                command.undo()
+            else:
+                command.execute()
+        else:
+            command.update_document(self.document, undo)
+            command.update_items(self.document, undo)
+
+    def clear_history(self):
+        self.history.clear()
+        self.history_changed.emit()
+
+    def jump_to(self, position):
+        # Moves the document to any point of the history with one repaint
+        states, steps, replayed = self.history.jump(position)
+        touched = list(states) + [item for command in replayed for item in command.items()]
+        self.realize(touched)
+        bulk = self.begin_bulk(touched)
+        items = self.jump_items = {}
+        try:
+            for item, state in states.items():
+                if state[0] != (item.scene() is not None):
+                    if state[0]:
+                        self.scene().addItem(item)
+                    else:
+                        self.scene().removeItem(item)
+                    items[item] = None
+                if apply_state(item, state):
+                    items[item] = None
+            if self.document is not None:
+                self.document.update_items(list(states))
+            for _ in range(steps):
+                # one at a time : undo() may rebuild a spilled command from
+                # the items the previous step left
+                command = self.history.undo()
+                self.realize(command.items())
+                step_bulk = self.begin_bulk(command.items())
+                try:
+                    self.run_command(command, undo=True)
+                finally:
+                    self.end_bulk(step_bulk)
+                items.update(dict.fromkeys(command.items()))
+            for command in replayed:
+                self.run_command(command)
+                items.update(dict.fromkeys(command.items()))
             self.scene().update()
+            self.history.enforce_budget()
+            self.items_changed(list(items))
+        finally:
+            self.jump_items = {}
+            self.end_bulk(bulk)
+
+    def restore_command(self, record, resolve):
+        # Rebuilds a command spilled by the history, resolve(item record)
+        # returns the live item with that id or a new one built from its shape
+        kind = record['command']
+        if kind == 'add':
+            return AddItemCommand(self.scene(), resolve(record['item']))
+        elif kind == 'remove':
+            return RemoveItemCommand(self.scene(), resolve(record['item']))
+        elif kind == 'move':
+            return MoveItemCommand(resolve(record['item']), QtCore.QPointF(*record['old']), QtCore.QPointF(*record['new']))
+        elif kind == 'move-items':
+            return MoveItemsCommand([resolve(item) for item in record['items']], record['old'], record['offset'],
+                                    name=record['name'])
+        elif kind == 'macro':
+            return MacroCommand([self.restore_command(command, resolve) for command in record['commands']],
+                                name=record['name'])
+        elif kind == 'set-path':
+            return SetPathCommand([(resolve(item), arrays_to_path(old_path), arrays_to_path(new_path))
+                                   for item, old_path, new_path in record['changes']])
+        elif kind == 'transform':
+            return TransformCommand([resolve(item) for item in record['items']], record_state(record['old']),
+                                    record_state(record['new']), QtGui.QTransform(*record['matrix']))
+        raise ValueError("unknown command record {}".format(kind))
+
+    def command_done(self, command):
+        self.items_changed(command.items(), command.translation)
+
+    def items_changed(self, items, translation=None):
+        self.index_items(items, translation=translation)
+        self.refresh_selection(items)
+        self.document_changed.emit(items)
+        self.history_changed.emit()
+
+    def index_items(self, items, new=False, translation=None):
+        # Reindexes committed items added or changed outside of a gesture,
+        # new items were just added to the scene and never indexed, items
+        # all moved by translation keep their indexed bounds shifted
+        if new:
+            old_bounds = [None] * len(items)
+            bounds = self.spatial_index.insert_many(items)
+        else:
+            # the old bounds are only damage for the tiles
+            old_bounds = self.spatial_index.bounds_many(items) if self.tile_cache.enabled else [None] * len(items)
+            bounds = (self.spatial_index.translate(items, *translation) if translation
+                      else self.spatial_index.update(items))
+        damaged = self.tile_cache.items_changed(items, old_bounds)
+        if self.tile_cache.enabled:
+            self.update_scene_rects(damaged)
+        if not translation:
+            self.lod_builder.add(items)  # a translation keeps the shapes, and their levels
+        # the scene rect only grows, so the drawing can always be panned to
+        if not bounds.isNull() and not self.scene().sceneRect().contains(bounds):
+            self.scene().setSceneRect(self.scene().sceneRect().united(bounds))
+
+    def insert_items(self, items):
+        # Adds new committed items in one batch. Large batches are added
+        # with the scene index suspended, then the index and the viewport
+        # catch up at once. Resuming rebuilds the index over every item, so
+        # smaller batches, e.g. the slices of a streaming load into a large
+        # scene, go into the index as they are.
+        bulk = len(items) >= self.BULK_ITEMS and len(items) * 4 >= len(self.spatial_index)
+        if bulk:
+            self.suspend_indexing()
+        try:
+            add_item = self.scene().addItem
+            for item in items:
+                add_item(item)
+            self.index_items(items, new=True)
+        finally:
+            if bulk:
+                self.resume_indexing()
+
+    def remove_items(self, items):
+        # Takes committed items out of the scene in one batch, without
+        # changing the document
+        self.suspend_indexing()
+        try:
+            remove_item = self.scene().removeItem
+            for item in items:
+                remove_item(item)
+            old_bounds = self.spatial_index.remove_many(items)
+            damaged = self.tile_cache.items_changed(items, old_bounds)
+            if self.tile_cache.enabled:
+                self.update_scene_rects(damaged)
+        finally:
+            self.resume_indexing()
+
+    def suspend_indexing(self):
+        # Bulk changes : the scene keeps no BSP tree and schedules no repaint
+        # per item until the matching resume_indexing. The cyclic collector
+        # is paused as well : the few objects allocated per item would
+        # otherwise make it rescan the whole drawing many times per batch.
+        self.index_suspended += 1
+        if self.index_suspended == 1:
+            self.collector_enabled = gc.isenabled()
+            gc.disable()
+            self.scene().setItemIndexMethod(QtWidgets.QGraphicsScene.NoIndex)
+            self.suspended_update_mode = self.viewportUpdateMode()
+            self.setViewportUpdateMode(QtWidgets.QGraphicsView.NoViewportUpdate)
+
+    def resume_indexing(self):
+        self.index_suspended -= 1
+        if not self.index_suspended:
+            self.scene().setItemIndexMethod(self.scene_index_method())  # rebuilt once, on the next query
+            self.setViewportUpdateMode(self.suspended_update_mode)
+            self.suspended_update_mode = None
+            if self.collector_enabled:
+                gc.enable()
+            self.viewport().update()
+
+    def scene_index_method(self):
+        # Flattened items are painted from tiles and hit-tested through the
+        # spatial index : the scene does not need its own index meanwhile.
+        if self.index_suspended or self.tile_cache.enabled:
+            return QtWidgets.QGraphicsScene.NoIndex
+        return QtWidgets.QGraphicsScene.BspTreeIndex
+
+    def set_flattened(self, enabled):
+        self.tile_cache.set_enabled(enabled, list(self.spatial_index.entries))
+        self.scene().setItemIndexMethod(self.scene_index_method())
+        self.viewport().update()
+
+    def refresh_selection(self, items):
+        # Selected items changed by a command : drop the ones that left the
+        # scene, move the highlight of the others.
+        # items_changed has just reindexed items : the index holds exactly
+        # the ones still in the scene
+        selected = self.selection.items
+        indexed = self.spatial_index.entries
+        changed = [item for item in items if item in selected]
+        self.selection.remove([item for item in changed if item not in indexed])
+        changed = [item for item in changed if item in selected]
+        if len(changed) >= self.BULK_ITEMS:
+            # the whole view is repainted anyway after a bulk change
+            self.selection_bounds.update(zip(changed, self.spatial_index.bounds_many(changed)))
+            self.viewport().update()
+            return
+        damaged = QtCore.QRectF()
+        for item in changed:
+            damaged = damaged.united(self.selection_bounds[item])
+            self.selection_bounds[item] = self.spatial_index.bounds(item)
+            damaged = damaged.united(self.selection_bounds[item])
+        self.update_scene_rect(damaged)
+
+    def item_at(self, pos):
+        # Committed item under the viewport position pos, thin strokes are
+        # picked within PICK_TOLERANCE pixels
+        scale = self.transform().m11() or 1.0
+        return self.spatial_index.nearest(self.mapToScene(pos), self.PICK_TOLERANCE / scale)
 
     def start_polygon(self, pos):
+        # The polygon in progress is a foreground overlay, only the finished
+        # polygon is added to the scene
+        point = self.mapToScene(pos)
         if not self.drawing_polygon:
             self.drawing_polygon = True
-            self.current_polygon = [self.mapToScene(pos)]
+            self.current_polygon = QtGui.QPolygonF([point])
+        elif self.is_near_start_point(point):
+            self.finish_polygon()
+            return
         else:
-            if self.is_near_start_point(self.mapToScene(pos)):
-                self.finish_polygon()
-            else:
-                self.current_polygon.append(self.mapToScene(pos))
-        self.update()
+            self.update_scene_rect(self.polygon_rect([self.current_polygon.last(), point]))
+            self.current_polygon.append(point)
+        self.move_polygon_cursor(point)
 
     def is_near_start_point(self, point):
         if len(self.current_polygon) > 2:
-            start = self.current_polygon[0]
+            start = self.current_polygon.first()
             return (start.x() - 5 <= point.x() <= start.x() + 5 and
                     start.y() - 5 <= point.y() <= start.y() + 5)
         return False
 
     def finish_polygon(self):
+        preview = QtGui.QPolygonF(self.current_polygon)
+        if self.polygon_cursor is not None:
+            preview.append(self.polygon_cursor)
+        self.update_scene_rect(self.polygon_rect(preview))
         if len(self.current_polygon) > 2:
-            self.current_polygon.append(self.current_polygon[0])  # Close the polygon
-            polygon_item = QtWidgets.QGraphicsPolygonItem(QtGui.QPolygonF(self.current_polygon))
+            self.current_polygon.append(self.current_polygon.first())  # Close the polygon
+            polygon_item = QtWidgets.QGraphicsPolygonItem(self.current_polygon)
             polygon_item.setPen(self.pen)
             #polygon_item.setBrush(self.brush)
             self.execute_command(AddItemCommand(self.scene(), polygon_item))
             self.polygons.append(polygon_item)
-        self.current_polygon = []
+        self.current_polygon = QtGui.QPolygonF()
         self.drawing_polygon = False
-        self.update()
+        self.polygon_cursor = None
 
-    def paintEvent(self, event):
-        super().paintEvent(event)
-        painter = QtGui.QPainter(self.viewport())
+    def polygon_rect(self, points):
+        # Scene rect covering points with the pen width, never empty
+        pad = (self.pen.widthF() / 2 if self.pen else 0.0) + 1.0 / (self.transform().m11() or 1.0)
+        return QtGui.QPolygonF(points).boundingRect().adjusted(-pad, -pad, pad, pad)
+
+    def move_polygon_cursor(self, point):
+        # Only the old and the new rubber line are repainted, whatever the
+        # number of vertices
+        last = self.current_polygon.last()
+        if self.polygon_cursor is not None:
+            self.update_scene_rect(self.polygon_rect([last, self.polygon_cursor]))
+        self.polygon_cursor = point
+        self.update_scene_rect(self.polygon_rect([last, point]))
+
+    def draw_polygon_preview(self, painter):
+        painter.save()
         painter.setPen(self.pen)
+        painter.setBrush(QtCore.Qt.NoBrush)
+        painter.drawPolyline(self.current_polygon)
+        if self.polygon_cursor is not None:
+            painter.drawLine(self.current_polygon.last(), self.polygon_cursor)
+        handle = QtGui.QPen(QtCore.Qt.red, self.POLYGON_HANDLE_SIZE)
+        handle.setCosmetic(True)
+        painter.setPen(handle)
+        painter.drawPoints(self.current_polygon)
+        painter.restore()
 
-        # Draw the current polygon
-        if len(self.current_polygon) > 1:
-            for i in range(len(self.current_polygon) - 1):
-                painter.drawLine(self.mapFromScene(self.current_polygon[i]), self.mapFromScene(self.current_polygon[i + 1]))
+    def set_hud_visible(self, visible):
+        self.hud.set_visible(visible)
 
-        # Draw a line from the last point to the cursor for real-time feedback
-        if self.drawing_polygon and len(self.current_polygon) > 0:
-            painter.drawLine(self.mapFromScene(self.current_polygon[-1]), self.mapFromGlobal(QtGui.QCursor.pos()))
+    def paintEvent(self, event):
+        if self.frame_metrics.enabled:
+            start = time.perf_counter()
+            super().paintEvent(event)
+            self.frame_metrics.painted(start, time.perf_counter())
+        else:
+            super().paintEvent(event)
+        self.repaint_meter.add(event.region())
+        metrics.count("view.paints")
     # Events
     def mousePressEvent(self, event):
+        if event.button() == QtCore.Qt.MiddleButton:
+            self.pan_start = event.pos()
+            self.viewport().setCursor(QtCore.Qt.ClosedHandCursor)
+            return
         if self.tool == "text" and self.current_text_item:
             self.finalize_text_input()
         
         self.begin = self.end = event.pos()
         if self.scene():
             if self.tool == "polygon":
-                # Check if we need to start or finish the polygon
-                point = self.mapToScene(event.pos())
-                
-                if not self.current_polygon:  # Starting a new polygon
-                    self.current_polygon.append(point)
-                else:
-                    # Check if the new point is close to the starting point
-                    if self.is_near_start_point(point):
-                        self.finish_polygon()  # Finish the polygon if clicked near the start point
-                    else:
-                        self.current_polygon.append(point)
-                        # Draw the line segment to connect points
-                        last_point = self.current_polygon[-2]
-                        new_line = QtWidgets.QGraphicsLineItem(QtCore.QLineF(last_point, point))
-                        new_line.setPen(self.pen)
-                        self.scene().addItem(new_line)
-
-                # Force the scene to update immediately
-                self.update()
+                # Starts, extends, or finishes when clicked near the start point
+                self.start_polygon(event.pos())
             elif self.tool == "select":
-                clicked_item = self.scene().itemAt(self.mapToScene(self.begin), QtGui.QTransform())
+                clicked_item = self.item_at(self.begin)
                 if clicked_item:
                     if event.modifiers() & QtCore.Qt.ControlModifier:
                         # Toggle selection with Ctrl key
-                        if clicked_item in self.selected_items:
-                            self.selected_items.remove(clicked_item)
-                            clicked_item.setSelected(False)
-                        else:
-                            self.selected_items.append(clicked_item)
-                            clicked_item.setSelected(True)
-                    else:
+                        self.selection.toggle(clicked_item)
+                    elif clicked_item not in self.selection:
                         # If clicked item is not in selection, clear previous selection
-                        if clicked_item not in self.selected_items:
-                            for item in self.selected_items:
-                                item.setSelected(False)
-                            self.selected_items = []
-                        self.selected_items.append(clicked_item)
-                        clicked_item.setSelected(True)
+                        self.selection.set([clicked_item])
                     
                     self.dragging = True
                     self.drag_start_pos = self.mapToScene(event.pos())
-                    self.item_original_positions = {item: item.pos() for item in self.selected_items}
+                    self.drag_items = list(self.selection)
+                    self.drag_offset = (0.0, 0.0)
+                    # the scene index would follow every item at each move :
+                    # many items are moved unindexed, their frames bound the
+                    # repaint, see drag_extent
+                    self.drag_bulk = self.begin_bulk(self.drag_items)
+                    self.drag_positions = item_positions(self.drag_items)
+                    self.drag_extent = QtCore.QRectF()
+                    for bounds in self.selection_bounds.values():
+                        self.drag_extent = self.drag_extent.united(bounds)
+                    self.update_scene_rects(self.tile_cache.set_live(self.selection))
                 else:
                     # Clear selection if clicking on empty space
-                    for item in self.selected_items:
-                        item.setSelected(False)
-                    self.selected_items = []
+                    self.selection.clear()
                     # Start rubber band selection
                     self.rubberBand = QtWidgets.QRubberBand(QtWidgets.QRubberBand.Rectangle, self)
                     self.rubberBand.setGeometry(QtCore.QRect(self.begin, QtCore.QSize()))
@@ -342,59 +1133,69 @@ class View(QtWidgets.QGraphicsView):
                 self.start_text_input(event.pos())
             elif self.tool in ["pen","line", "rectangle"]:
                 self.start_drawing(event.pos())
-            self.highlight_selected_items()
         else:
-            print("View needs a scene to display items!")
+            log.warning("View needs a scene to display items!")
 
     def mouseMoveEvent(self, event):
+        if self.pan_start is not None:
+            delta = event.pos() - self.pan_start
+            self.pan_start = event.pos()
+            self.horizontalScrollBar().setValue(self.horizontalScrollBar().value() - delta.x())
+            self.verticalScrollBar().setValue(self.verticalScrollBar().value() - delta.y())
+            return
         self.end = event.pos()
         if self.scene():
-            if self.drawing_polygon:
-                if self.temp_item:
-                    self.scene().removeItem(self.temp_item)
-                
-                # Create a temporary line from the last polygon point to the current mouse position
-                last_point = self.current_polygon[-1]
-                current_pos = self.mapToScene(event.pos())
-                self.temp_item = self.scene().addLine(QtCore.QLineF(last_point, current_pos), self.pen)
-                
-                # Update the scene to reflect changes
-                self.update()
-            elif self.tool == "pen" and self.current_path:
-                self.current_path.lineTo(self.mapToScene(event.pos()))
-                self.scene().removeItem(self.temp_item)
-                self.temp_item = self.scene().addPath(self.current_path, self.pen)
-            elif self.dragging and self.selected_items and self.tool == "select":
-                current_pos = self.mapToScene(event.pos())
-                delta = current_pos - self.drag_start_pos
-                for item in self.selected_items:
-                    item.setPos(self.item_original_positions[item] + delta)
+            if self.tool == "polygon" and self.drawing_polygon:
+                self.move_polygon_cursor(self.mapToScene(event.pos()))
+            elif self.tool == "pen" and isinstance(self.temp_item, LiveStrokeItem):
+                self.temp_item.add_point(self.mapToScene(event.pos()))
+            elif self.dragging and self.selection and self.tool == "select":
+                delta = self.mapToScene(event.pos()) - self.drag_start_pos
+                xs, ys = (self.drag_positions + (delta.x(), delta.y())).T.tolist()
+                list(map(QtWidgets.QGraphicsItem.setPos, self.drag_items, xs, ys))
+                # the selection frames move with the painter, see drawForeground
+                self.update_scene_rect(self.drag_extent.translated(*self.drag_offset).united(
+                    self.drag_extent.translated(delta)))
+                self.drag_offset = (delta.x(), delta.y())
             elif self.rubberBand:
                 self.rubberBand.setGeometry(QtCore.QRect(self.begin, event.pos()).normalized())
             elif self.temp_item:
                 self.update_temp_item(event.pos())
-            self.viewport().update()
+            # Every branch reports its own damage : scene items repaint
+            # their old and new bounds, the rest goes through self.damage
         else:
-            print("View needs a scene to display items!")
+            log.warning("View needs a scene to display items!")
 
     def mouseReleaseEvent(self, event):
+        if event.button() == QtCore.Qt.MiddleButton and self.pan_start is not None:
+            self.pan_start = None
+            self.viewport().unsetCursor()
+            return
         self.end = event.pos()
         if self.scene():
-            if self.tool == "pen":
-                if self.current_path:
-                    final_path_item = QtWidgets.QGraphicsPathItem(self.current_path)
-                    final_path_item.setPen(QtGui.QPen(self.pen))
-                    self.execute_command(AddItemCommand(self.scene(), final_path_item))
-                self.current_path = None
-                self.temp_item = None
-            elif self.dragging and self.selected_items and self.tool == "select":
+            if self.dragging:
                 self.dragging = False
-                for item in self.selected_items:
-                    old_pos = self.item_original_positions[item]
-                    new_pos = item.pos()
-                    self.execute_command(MoveItemCommand(item, old_pos, new_pos))
+                offset, self.drag_offset = self.drag_offset, (0.0, 0.0)
+                try:
+                    if offset != (0.0, 0.0):
+                        self.execute_command(MoveItemsCommand(self.drag_items, self.drag_positions, offset))
+                finally:
+                    self.end_bulk(self.drag_bulk)
+                    self.drag_bulk = False
+                self.update_scene_rects(self.tile_cache.set_live([]))
                 self.drag_start_pos = None
-                self.item_original_positions.clear()
+                self.drag_items = []
+                self.drag_positions = None
+            elif self.tool == "pen":
+                if isinstance(self.temp_item, LiveStrokeItem):
+                    self.scene().removeItem(self.temp_item)
+                    final_path_item = self.temp_item.commit()
+                    if self.simplify_tolerance > 0:
+                        stats = SimplifyStats()
+                        final_path_item.setPath(simplify_path(final_path_item.path(), self.simplify_tolerance, stats))
+                        self.stroke_simplified.emit(stats)
+                    self.execute_command(AddItemCommand(self.scene(), final_path_item))
+                self.temp_item = None
             elif self.rubberBand:
                 rect = self.rubberBand.geometry()
                 self.rubberBand.hide()
@@ -403,20 +1204,75 @@ class View(QtWidgets.QGraphicsView):
             elif self.temp_item:
                 self.finalize_drawing()
         else:
-            print("View needs a scene to display items!")
-        self.highlight_selected_items()
+            log.warning("View needs a scene to display items!")
+
+    def wheelEvent(self, event):
+        # Zooms around the cursor, panning is done with the middle button
+        self.zoom_by(self.ZOOM_STEP ** event.angleDelta().y())
+
+    def zoom_by(self, factor):
+        scale = self.transform().m11()
+        low, high = self.ZOOM_RANGE
+        factor = min(max(scale * factor, low), high) / scale
+        if factor != 1.0:
+            self.scale(factor, factor)
+            if self.virtualizer:
+                self.virtualizer.schedule()
+
+    def scrollContentsBy(self, dx, dy):
+        super().scrollContentsBy(dx, dy)
+        if self.virtualizer:
+            self.virtualizer.schedule()
+
+    NUDGES = {
+        QtCore.Qt.Key_Left: QtCore.QPointF(-1, 0),
+        QtCore.Qt.Key_Right: QtCore.QPointF(1, 0),
+        QtCore.Qt.Key_Up: QtCore.QPointF(0, -1),
+        QtCore.Qt.Key_Down: QtCore.QPointF(0, 1),
+    }
 
     def keyPressEvent(self, event):
         if self.tool == "text" and self.current_text_item and event.key() == QtCore.Qt.Key_Return and not event.modifiers() & QtCore.Qt.ShiftModifier:
             self.finalize_text_input()
+        elif self.tool == "select" and self.selection and event.key() in self.NUDGES and not self.dragging:
+            self.nudge_selection(self.NUDGES[event.key()] * (10 if event.modifiers() & QtCore.Qt.ShiftModifier else 1))
+        elif self.tool == "select" and self.selection and event.key() in (QtCore.Qt.Key_Delete, QtCore.Qt.Key_Backspace):
+            self.delete_selection()
         else:
             super().keyPressEvent(event)
 
+    def nudge_selection(self, delta):
+        # Nudges of an unchanged selection follow the last one : its items
+        # are exactly where that command left them
+        offset = (delta.x(), delta.y())
+        key = ("nudge", self.selection.version)
+        last = self.history.top()
+        if isinstance(last, MoveItemsCommand) and last.merge_key == key:
+            self.execute_command(last.following(offset))
+        else:
+            items = list(self.selection)
+            self.execute_command(MoveItemsCommand(items, item_positions(items), offset, merge_key=key, name="Nudge"))
+
+    def transform_selection(self, transform):
+        # Applies the scene transform to the selection as one history entry
+        items = list(self.selection)
+        if not items or transform.isIdentity():
+            return
+        self.realize(items)
+        bulk = self.begin_bulk(items)
+        try:
+            old, new = transform_items(items, transform)
+            self.execute_command(TransformCommand(items, old, new, transform))
+        finally:
+            self.end_bulk(bulk)
+
+    def delete_selection(self):
+        items = list(self.selection)
+        self.execute_command(MacroCommand([RemoveItemCommand(self.scene(), item) for item in items]))
+
     def start_drawing(self, pos):
         if self.tool == "pen":
-            self.current_path = QtGui.QPainterPath()
-            self.current_path.moveTo(self.mapToScene(pos))
-            self.temp_item = self.scene().addPath(self.current_path, self.pen)
+            self.temp_item = LiveStrokeItem(self.mapToScene(pos), self.pen)
         elif self.tool == "line":
             self.temp_item = QtWidgets.QGraphicsLineItem(QtCore.QLineF(self.mapToScene(pos), self.mapToScene(pos)))
             self.temp_item.setPen(self.pen)
@@ -446,7 +1302,7 @@ class View(QtWidgets.QGraphicsView):
                 final_item.setPen(self.pen)
                 final_item.setBrush(self.brush)
             elif isinstance(self.temp_item, QtWidgets.QGraphicsPathItem):
-                final_item = QtWidgets.QGraphicsPathItem(self.temp_item.path())
+                final_item = LodPathItem(self.temp_item.path())
                 final_item.setPen(self.pen)
             elif isinstance(self.temp_item, QtWidgets.QGraphicsPolygonItem):
                 final_item = QtWidgets.QGraphicsPolygonItem(self.temp_item.polygon())
@@ -456,46 +1312,68 @@ class View(QtWidgets.QGraphicsView):
                 return  # If it's not a recognized item, don't add it
             self.execute_command(AddItemCommand(self.scene(), final_item))
             self.temp_item = None
-            
-            # Update the scene and viewport to force a redraw
-            self.scene().update()  # Ensures scene is updated
-            self.viewport().update()  # Forces a redraw of the vi
-
-
-    def highlight_selected_items(self):
-        for item in self.scene().items():
-            if item in self.selected_items:
-                if isinstance(item, (QtWidgets.QGraphicsLineItem, QtWidgets.QGraphicsRectItem, QtWidgets.QGraphicsPathItem)):
-                    if item not in self.original_colors:
-                        self.original_colors[item] = item.pen()
-                    highlight_pen = QtGui.QPen(QtCore.Qt.red, 2, QtCore.Qt.DashLine)
-                    item.setPen(highlight_pen)
-                elif isinstance(item, QtWidgets.QGraphicsTextItem):
-                    # Do not change the color of text items when selected
-                    pass
-            else:
-                self.restore_item_color(item)
-    
-    def restore_item_color(self, item):
-        if item in self.original_colors:
-            if isinstance(item, (QtWidgets.QGraphicsLineItem, QtWidgets.QGraphicsRectItem, QtWidgets.QGraphicsPathItem)):
-                item.setPen(self.original_colors[item])
-            del self.original_colors[item]
+
+
+    def on_selection_changed(self, added, removed):
+        metrics.count("selection.changes")
+        damaged = QtCore.QRectF()
+        for item in removed:
+            damaged = damaged.united(self.selection_bounds.pop(item, QtCore.QRectF()))
+        for item in added:
+            bounds = self.spatial_index.bounds(item) or item.sceneBoundingRect()
+            self.selection_bounds[item] = bounds
+            damaged = damaged.united(bounds)
+        self.update_scene_rect(damaged)
+
+    def update_scene_rect(self, rect):
+        if not rect.isNull():
+            margin = self.SELECTION_MARGIN + 1
+            self.damage.add(self.mapFromScene(rect).boundingRect().adjusted(-margin, -margin, margin, margin))
+
+    def update_scene_rects(self, rects):
+        for rect in rects:
+            self.update_scene_rect(rect)
+
+    def drawBackground(self, painter, rect):
+        super().drawBackground(painter, rect)
+        if self.tile_cache.enabled:
+            self.tile_cache.draw(painter, rect)
+
+    def drawForeground(self, painter, rect):
+        super().drawForeground(painter, rect)
+        if self.drawing_polygon:
+            self.draw_polygon_preview(painter)
+        if not self.selection_bounds:
+            return
+        # Selection is an overlay : item pens are never touched
+        painter.save()
+        pen = QtGui.QPen(QtCore.Qt.red, 1, QtCore.Qt.DashLine)
+        pen.setCosmetic(True)
+        painter.setPen(pen)
+        painter.setBrush(QtCore.Qt.NoBrush)
+        margin = self.SELECTION_MARGIN / (self.transform().m11() or 1.0)
+        if self.drag_offset != (0.0, 0.0):
+            painter.translate(*self.drag_offset)
+            rect = rect.translated(-self.drag_offset[0], -self.drag_offset[1])
+        for bounds in self.selection_bounds.values():
+            if bounds.intersects(rect):
+                painter.drawRect(bounds.adjusted(-margin, -margin, margin, margin))
+        painter.restore()
 
     def select_items_in_rect(self, rect):
-        self.selected_items = []
-        for item in self.scene().items():
-            if rect.intersects(self.mapFromScene(item.sceneBoundingRect()).boundingRect()):
-                self.selected_items.append(item)
-                item.setSelected(True)
+        self.selection.set(self.spatial_index.query_rect(self.mapToScene(rect).boundingRect()))
 
 
     def resizeEvent(self, event):
             super().resizeEvent(event)
-            if self.tool == "text":
+            if self.tool == "text" and self.text_toolbar:
                 self.text_toolbar.setGeometry(0, 0, self.width(), 40)
-            print("View.resizeEvent()")
-            print("width : {}, height : {}".format(self.size().width(), self.size().height()))
+            if self.hud.isVisible():
+                self.hud.place()
+            if self.virtualizer:
+                self.virtualizer.schedule()
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("View.resizeEvent %dx%d", self.size().width(), self.size().height())
 
 if __name__ == "__main__":  
     app = QtWidgets.QApplication(sys.argv)
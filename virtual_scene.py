@@ -0,0 +1,184 @@
+from PyQt5 import QtCore
+
+import metrics
+from shapes import ITEM_CLASSES, PARKED, apply_shape, item_id
+
+# Item virtualization : only the shapes near the viewport are scene items,
+# the others are document rows only.
+#
+# sync() asks the document for the shapes intersecting the visible area
+# grown by MARGIN viewports on each side, builds the missing items and
+# takes out the ones that left that area. Items no command ever touched go
+# back to a pool per type and are given the next shape of that type.
+# Items touched by commands may be held by the history, so they are parked
+# instead : out of the scene, flagged PARKED, and brought back as the same
+# object. Selected items and the text being edited are never taken out.
+# The view calls realize() on the items of a command before running it, so
+# commands, undo and redo always act on scene items.
+
+ITEM_KINDS = {item_class: kind for kind, item_class in ITEM_CLASSES.items()}
+
+class ItemVirtualizer(QtCore.QObject):
+    MARGIN = 0.5  # viewports materialized on each side of the visible area
+    SYNC_MS = 30  # scrolls and zooms are coalesced over this delay
+    POOL_SIZE = 4096  # recycled items kept per type
+
+    def __init__(self, view, document, parent=None):
+        super().__init__(parent)
+        self.view = view
+        self.document = document
+        self.enabled = False
+        self.items = {}      # id -> item in the scene
+        self.parked = {}     # id -> item touched by a command, out of the scene
+        self.commanded = set()  # ids of the items touched by commands
+        self.pool = {kind: [] for kind in ITEM_CLASSES}
+        self.styles = {}     # pens and brushes shared by the items built here
+        self.extent_rows = None  # document rows when the scene rect was last grown
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(self.SYNC_MS)
+        self.timer.timeout.connect(self.sync)
+
+    def set_enabled(self, enabled):
+        if enabled == self.enabled:
+            return
+        if enabled:
+            self.enabled = True
+            self.view.virtualizer = self
+            self.items = {item_id(item): item for item in self.view.spatial_index.entries}
+            self.set_stacking(list(self.items.values()))
+            self.sync()
+        else:
+            self.realize_ids(self.document.ids().tolist())
+            self.enabled = False
+            self.view.virtualizer = None
+            self.timer.stop()
+            self.clear()
+
+    def clear(self):
+        # The scene was cleared, pooled items were out of it and survive
+        self.items.clear()
+        self.parked.clear()
+        self.commanded.clear()
+        self.extent_rows = None
+
+    def schedule(self):
+        if self.enabled and not self.timer.isActive():
+            self.timer.start()
+
+    def area(self):
+        # Scene (left, top, right, bottom) kept materialized
+        rect = self.view.mapToScene(self.view.viewport().rect()).boundingRect()
+        dx, dy = rect.width() * self.MARGIN, rect.height() * self.MARGIN
+        return rect.left() - dx, rect.top() - dy, rect.right() + dx, rect.bottom() + dy
+
+    def sync(self):
+        if not self.enabled:
+            return
+        self.timer.stop()
+        self.grow_scene_rect()
+        wanted = set(self.document.query_rect(self.area()).tolist())
+        kept = {item_id(item) for item in self.view.selection}
+        if self.view.current_text_item is not None:
+            kept.add(item_id(self.view.current_text_item))
+        self.release([id_ for id_ in self.items if id_ not in wanted and id_ not in kept])
+        self.realize_ids([id_ for id_ in wanted if id_ not in self.items])
+
+    def grow_scene_rect(self):
+        # Virtual shapes must be reachable by scrolling
+        if self.extent_rows == self.document.row_count or not len(self.document):
+            return
+        self.extent_rows = self.document.row_count
+        bounds = self.document.rows['bounds'][self.document.live_rows()]
+        left, top = bounds[:, :2].min(axis=0)
+        right, bottom = bounds[:, 2:].max(axis=0)
+        scene = self.view.scene()
+        extent = QtCore.QRectF(left, top, right - left, bottom - top)
+        if not scene.sceneRect().contains(extent):
+            scene.setSceneRect(scene.sceneRect().united(extent))
+
+    def release(self, ids):
+        items = [self.items.pop(id_) for id_ in ids]
+        if not items:
+            return
+        self.view.remove_items(items)
+        for id_, item in zip(ids, items):
+            if id_ in self.commanded:
+                item.setData(PARKED, True)
+                self.parked[id_] = item
+            else:
+                pool = self.pool.get(ITEM_KINDS.get(type(item)))
+                if pool is not None and len(pool) < self.POOL_SIZE:
+                    pool.append(item)
+        metrics.count("virtual.released", len(items))
+
+    def realize_ids(self, ids):
+        # Brings the shapes ids into the scene : unparked, recycled or built
+        if not self.enabled:
+            return
+        items = []
+        for id_ in ids:
+            if id_ in self.items or id_ not in self.document:
+                continue
+            item = self.parked.pop(id_, None)
+            if item is not None:
+                item.setData(PARKED, False)
+            else:
+                shape = self.document.shape(id_)
+                pool = self.pool[shape['type']]
+                item = pool.pop() if pool else ITEM_CLASSES[shape['type']]()
+                apply_shape(item, shape, self.styles)
+            self.items[id_] = item
+            items.append(item)
+        self.insert(items)
+
+    def realize(self, items):
+        # Items a command is about to change. An item rebuilt by the history
+        # for a shape that is out of the scene takes the place of its item.
+        # It keeps the geometry and transform of its record, the ones the
+        # command undoes from : the document row only fills an empty item.
+        realized = []
+        for item in items:
+            if item.scene() is not None:
+                continue
+            id_ = item_id(item)
+            if id_ not in self.document or id_ in self.items:
+                continue
+            if self.parked.pop(id_, None) is not item and item.boundingRect().isEmpty():
+                apply_shape(item, self.document.shape(id_), self.styles)
+            item.setData(PARKED, False)
+            self.items[id_] = item
+            realized.append(item)
+        self.insert(realized)
+
+    def insert(self, items):
+        if items:
+            self.set_stacking(items)
+            self.view.insert_items(items)
+            metrics.count("virtual.realized", len(items))
+
+    def set_stacking(self, items):
+        # Items are materialized in any order : the z value keeps the
+        # stacking order of the document
+        if not self.enabled or not items:
+            return
+        orders = self.document.orders([item_id(item) for item in items]).tolist()
+        for item, order in zip(items, orders):
+            item.setZValue(order)
+
+    def items_changed(self, items):
+        # Items touched by a command, once the document has them
+        if not self.enabled:
+            return
+        added = []
+        for item in items:
+            id_ = item_id(item)
+            self.commanded.add(id_)
+            if item.scene() is not None:
+                if self.items.get(id_) is not item:
+                    self.items[id_] = item
+                    added.append(item)
+            elif self.items.get(id_) is item:
+                del self.items[id_]
+        self.set_stacking(added)
+        self.schedule()
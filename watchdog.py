@@ -0,0 +1,100 @@
+import json
+import logging
+import logging.handlers
+import os
+import sys
+import threading
+import time
+import traceback
+
+from PyQt5 import QtCore
+
+from journal import JOURNAL_DIR
+
+# Detects GUI thread stalls : a watchdog thread pings the event loop every
+# PING_MS, a ping left unanswered for threshold ms is a stall. The stack of
+# the GUI thread is captured while it is stuck, together with the context
+# of the window, and one JSON line per stall goes to a rotating log once
+# the loop answers again.
+
+LOG_PATH = os.path.join(JOURNAL_DIR, "stalls.log")
+
+class StallWatchdog(QtCore.QObject):
+    ping = QtCore.pyqtSignal(float)
+    PING_MS = 100
+    LOG_BYTES = 1 << 20
+    LOG_BACKUPS = 3
+
+    def __init__(self, context=None, threshold_ms=500, path=LOG_PATH, parent=None):
+        # context() returns a dict describing the window, it runs on the
+        # watchdog thread and must only read plain Python attributes
+        super().__init__(parent)
+        self.context = context or dict
+        self.threshold = threshold_ms / 1000.0
+        self.path = path
+        self.gui_thread = threading.get_ident()
+        self.lock = threading.Lock()
+        self.pinged = None    # time of the ping in flight
+        self.stall = None     # report of the stall in progress
+        self.stalls = []      # reports written so far, most recent last
+        self.stopping = threading.Event()
+        self.thread = None
+        self.logger = None
+        self.ping.connect(self.pong, QtCore.Qt.QueuedConnection)
+
+    def start(self):
+        if self.thread:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(self.path, maxBytes=self.LOG_BYTES,
+                                                       backupCount=self.LOG_BACKUPS)
+        self.logger = logging.getLogger("paint.stalls.{}".format(id(self)))
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(handler)
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name="stall-watchdog", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if not self.thread:
+            return
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+        for handler in list(self.logger.handlers):
+            handler.close()
+            self.logger.removeHandler(handler)
+
+    def run(self):
+        while not self.stopping.wait(self.PING_MS / 1000.0):
+            now = time.monotonic()
+            with self.lock:
+                pinged = self.pinged
+                if pinged is None:
+                    self.pinged = now
+                elif now - pinged >= self.threshold and self.stall is None:
+                    self.stall = self.capture(pinged)
+            if pinged is None:
+                self.ping.emit(now)
+
+    def capture(self, since):
+        frame = sys._current_frames().get(self.gui_thread)
+        stack = traceback.format_stack(frame) if frame is not None else []
+        try:
+            context = self.context()
+        except Exception as e:  # the window may be half updated
+            context = {'error': repr(e)}
+        return {'time': time.time() - (time.monotonic() - since), 'stack': stack, 'context': context}
+
+    def pong(self, pinged):
+        # Runs on the GUI thread once the event loop got to the ping
+        now = time.monotonic()
+        with self.lock:
+            self.pinged = None
+            stall, self.stall = self.stall, None
+        if stall is not None:
+            stall['duration_ms'] = round((now - pinged) * 1000, 1)
+            self.stalls.append(stall)
+            del self.stalls[:-100]
+            self.logger.info(json.dumps(stall))
@@ -1,23 +1,33 @@
 import os
 import json
-from PyQt5 import QtCore, QtGui, QtWidgets
-from PyQt5.QtGui import QIcon, QPixmap, QPainter, QPen, QColor
-from PyQt5.QtCore import Qt, QSize
-from view import View
-
-def create_line_icon(width, size=QSize(32, 32)):
-    pixmap = QPixmap(size)
-    pixmap.fill(Qt.transparent)
-    painter = QPainter(pixmap)
-    painter.setRenderHint(QPainter.Antialiasing)
-    pen = QPen(QColor(0, 0, 0))  # Black color
-    pen.setWidth(width)
-    painter.setPen(pen)
-    painter.drawLine(4, size.height() // 2, size.width() - 4, size.height() // 2)
-    painter.end()
-    return QIcon(pixmap)
+import logging
+import sys
+from PyQt5 import QtCore, QtWidgets
+from PyQt5.QtCore import Qt
+from view import View, SetPathCommand
+from history_panel import HistoryPanel
+from simplify import SimplifyStats, simplify_path_items
+from loader import StreamingLoader
+from saver import BackgroundSaver
+from journal import Journal, read_journal, replay
+from binary_format import BinaryDocument, is_binary, SUFFIX as BINARY_SUFFIX
+from document import Document
+from virtual_scene import ItemVirtualizer
+from shapes import item_id
+from transform import TransformDialog, flip, rotation, selection_center
+import metrics
+from metrics import log
+from watchdog import StallWatchdog
+from icons import LazyMenuIcons, create_line_icon, icon
+from recorder import InputRecorder, InputReplayer, format_report, SUFFIX as RECORDING_SUFFIX
+
+FILE_FILTERS = "Shape Files (*.json);;Binary Shape Files (*{})".format(BINARY_SUFFIX)
 
 class Window(QtWidgets.QMainWindow):
+    AUTOSAVE_MS = 30000  # journal compaction period
+    REPAINT_RATE_MS = 1000
+    STALL_MS = 500  # event loop pauses reported by the watchdog
+    STREAMING_MIN_BYTES = 1 << 20  # smaller files load at once, within a frame or two
     def __init__(self, position=(0, 0), dimension=(500, 300)):
         QtWidgets.QMainWindow.__init__(self)
         self.setWindowTitle("CAI  2425A : New File ")
@@ -28,6 +38,9 @@ class Window(QtWidgets.QMainWindow):
         self.scene = QtWidgets.QGraphicsScene()   # model 
         self.view.setScene(self.scene)
         self.setCentralWidget(self.view)
+        self.history_panel = HistoryPanel(self.view, self)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.history_panel)
+        self.history_panel.hide()
 
         self.view.setGeometry(x, y, w, h)
         self.scene.setSceneRect(x, y, w, h)
@@ -38,6 +51,33 @@ class Window(QtWidgets.QMainWindow):
         self.create_toolbar()
 
         self.filename = None
+        self.loader = None
+        self.load_started = None
+        self.recorder = None
+        self.replayer = None
+        self.saver = BackgroundSaver(self)
+        self.saver.saved.connect(self.on_save_finished)
+        self.saver.failed.connect(self.on_save_failed)
+
+        self.dirty = False
+        self.version = 0  # bumped by every change, a save is clean once it wrote the current version
+        self.document = Document()  # what gets saved, follows every command
+        self.view.document = self.document
+        self.virtualizer = ItemVirtualizer(self.view, self.document, self)
+        self.journal = Journal(self.document, parent=self)
+        self.view.document_changed.connect(self.on_document_changed)
+        self.autosave_timer = QtCore.QTimer(self)
+        self.autosave_timer.timeout.connect(self.autosave)
+        self.autosave_timer.start(self.AUTOSAVE_MS)
+        self.repaint_timer = QtCore.QTimer(self)
+        self.repaint_timer.timeout.connect(self.show_repaint_rate)
+        self.repaint_timer.start(self.REPAINT_RATE_MS)
+        self.watchdog = None
+        self.metrics_file = os.environ.get("PAINT_METRICS")
+        self.metrics_timer = QtCore.QTimer(self)
+        self.metrics_timer.timeout.connect(self.dump_metrics)
+        if self.metrics_file:
+            self.metrics_timer.start(metrics.DUMP_MS)
  
     def get_view(self):
         return self.view
@@ -51,64 +91,110 @@ class Window(QtWidgets.QMainWindow):
     def set_scene(self, scene):
         self.scene = scene
 
+    def lazy_action(self, name, text):
+        # Action shown in menus only : its icon is loaded with the menu
+        action = QtWidgets.QAction(text, self)
+        self.menu_icons.add(action, lambda: icon(name))
+        return action
+
     def create_actions(self):
+        self.menu_icons = LazyMenuIcons()
         # File actions
-        self.action_file_new = QtWidgets.QAction(QtGui.QIcon('Icons/new.png'), "New", self)
+        self.action_file_new = self.lazy_action("new", "New")
         self.action_file_new.setShortcut("Ctrl+N")
         self.action_file_new.setStatusTip("Create a new file")
 
-        self.action_file_open = QtWidgets.QAction(QtGui.QIcon('Icons/open.png'), "Open", self)
+        self.action_file_open = self.lazy_action("open", "Open")
         self.action_file_open.setShortcut("Ctrl+O")
         self.action_file_open.setStatusTip("Open file")
 
-        self.action_file_save = QtWidgets.QAction(QtGui.QIcon('Icons/save.png'), "Save", self)
+        self.action_file_save = self.lazy_action("save", "Save")
         self.action_file_save.setShortcut("Ctrl+S")
         self.action_file_save.setStatusTip("Save file")
 
-        self.action_file_save_as = QtWidgets.QAction(QtGui.QIcon('Icons/save_as.png'), "Save as", self)
+        self.action_file_save_as = self.lazy_action("save_as", "Save as")
         self.action_file_save_as.setStatusTip("Save as")
 
         # Tools actions
         self.action_tools = QtWidgets.QActionGroup(self)
         self.action_tools.setExclusive(True)
 
-        self.action_tools_select = QtWidgets.QAction(QtGui.QIcon('Icons/select_cursor.png'), self.tr("&Select"), self)
+        self.action_tools_select = QtWidgets.QAction(icon("select_cursor"), self.tr("&Select"), self)
         self.action_tools_select.setCheckable(True)
         self.action_tools_select.setChecked(True)
         self.action_tools.addAction(self.action_tools_select)
 
-        self.action_tools_text = QtWidgets.QAction(QtGui.QIcon('Icons/tool_text.png'), self.tr("&Text"), self)
+        self.action_tools_text = QtWidgets.QAction(icon("tool_text"), self.tr("&Text"), self)
         self.action_tools_text.setCheckable(True)
         self.action_tools.addAction(self.action_tools_text)
 
-        self.action_tools_pen = QtWidgets.QAction(QtGui.QIcon('Icons/tool_pen.png'), self.tr("&Pen"), self)
+        self.action_tools_pen = QtWidgets.QAction(icon("tool_pen"), self.tr("&Pen"), self)
         self.action_tools_pen.setCheckable(True)
         self.action_tools.addAction(self.action_tools_pen)
 
-        self.action_tools_line = QtWidgets.QAction(QtGui.QIcon('Icons/tool_line.png'), self.tr("&Line"), self)
+        self.action_tools_line = self.lazy_action("tool_line", self.tr("&Line"))
         self.action_tools_line.setCheckable(True)
         self.action_tools.addAction(self.action_tools_line)
 
-        self.action_tools_rectangle = QtWidgets.QAction(QtGui.QIcon('Icons/tool_rectangle.png'), self.tr("&Rectangle"), self)
+        self.action_tools_rectangle = self.lazy_action("tool_rectangle", self.tr("&Rectangle"))
         self.action_tools_rectangle.setCheckable(True)
         self.action_tools.addAction(self.action_tools_rectangle)
 
-        self.action_tools_polygon = QtWidgets.QAction(QtGui.QIcon('Icons/tool_polygon.png'), self.tr("&Polygone"), self)
+        self.action_tools_polygon = self.lazy_action("tool_polygon", self.tr("&Polygone"))
         self.action_tools_polygon.setCheckable(True)
         self.action_tools.addAction(self.action_tools_polygon)
+        self.tool_actions = {"select": self.action_tools_select, "text": self.action_tools_text,
+                             "pen": self.action_tools_pen, "line": self.action_tools_line,
+                             "rectangle": self.action_tools_rectangle, "polygon": self.action_tools_polygon}
 
         # Style actions    
-        self.action_style_pen_color = QtWidgets.QAction(QtGui.QIcon('Icons/colorize.png'), self.tr("&Color"), self)
-        self.action_style_text_color = QtWidgets.QAction(QtGui.QIcon('Icons/colorize.png'), self.tr("&Color"), self)
-
-        self.action_edit_undo = QtWidgets.QAction(QtGui.QIcon('Icons/undo.png'), "Undo", self)
+        self.action_style_pen_color = self.lazy_action("colorize", self.tr("&Color"))
+        self.action_style_text_color = self.lazy_action("colorize", self.tr("&Color"))
+        self.action_style_simplify = QtWidgets.QAction(self.tr("Stroke &simplification..."), self)
+        self.action_style_simplify.setStatusTip("Set the tolerance used to simplify new pen strokes")
+
+        self.action_tools_simplify = QtWidgets.QAction(self.tr("Simplify &paths"), self)
+        self.action_tools_simplify.setStatusTip("Simplify every freehand path of the document")
+
+        self.action_tools_flatten = QtWidgets.QAction(self.tr("&Flatten committed items"), self)
+        self.action_tools_flatten.setCheckable(True)
+        self.action_tools_flatten.setStatusTip("Render finished items from a cached raster layer")
+
+        self.action_tools_virtual = QtWidgets.QAction(self.tr("&Virtualize off-screen items"), self)
+        self.action_tools_virtual.setCheckable(True)
+        self.action_tools_virtual.setStatusTip("Only keep items near the view, for very large drawings")
+
+        self.action_transform_dialog = QtWidgets.QAction(self.tr("&Transform selection..."), self)
+        self.action_transform_dialog.setShortcut("Ctrl+T")
+        self.action_transform_dialog.setStatusTip("Move, rotate and scale the selection by given amounts")
+        self.action_transform_rotate_right = QtWidgets.QAction(self.tr("Rotate 90° &clockwise"), self)
+        self.action_transform_rotate_left = QtWidgets.QAction(self.tr("Rotate 90° c&ounterclockwise"), self)
+        self.action_transform_flip_horizontal = QtWidgets.QAction(self.tr("Flip &horizontally"), self)
+        self.action_transform_flip_vertical = QtWidgets.QAction(self.tr("Flip &vertically"), self)
+
+        self.action_tools_hud = QtWidgets.QAction(self.tr("Performance &HUD"), self)
+        self.action_tools_hud.setCheckable(True)
+        self.action_tools_hud.setShortcut("F12")
+        self.action_tools_hud.setStatusTip("Show frame time, paint time and input latency over the drawing")
+
+        self.action_tools_record = QtWidgets.QAction(self.tr("&Record input..."), self)
+        self.action_tools_record.setCheckable(True)
+        self.action_tools_record.setStatusTip("Record mouse, key and tool events to a file")
+
+        self.action_tools_replay = QtWidgets.QAction(self.tr("Re&play input..."), self)
+        self.action_tools_replay.setStatusTip("Replay a recorded session and report the event latencies")
+
+        self.action_edit_undo = QtWidgets.QAction(icon("undo"), "Undo", self)
         self.action_edit_undo.setShortcut("Ctrl+Z")
         self.action_edit_undo.setStatusTip("Undo last action")
 
-        self.action_edit_redo = QtWidgets.QAction(QtGui.QIcon('Icons/redo.png'), "Redo", self)
+        self.action_edit_redo = QtWidgets.QAction(icon("redo"), "Redo", self)
         self.action_edit_redo.setShortcut("Ctrl+Y")
         self.action_edit_redo.setStatusTip("Redo last undone action")
 
+        self.action_edit_delete = QtWidgets.QAction(self.tr("&Delete"), self)
+        self.action_edit_delete.setStatusTip("Delete the selection")
+
         # Pen size actions
         self.action_pen_size = QtWidgets.QActionGroup(self)
         self.action_pen_size.setExclusive(True)
@@ -119,7 +205,8 @@ class Window(QtWidgets.QMainWindow):
 
         pen_sizes = [1, 3, 5, 8]
         for size in pen_sizes:
-            action = QtWidgets.QAction(create_line_icon(size), f"{size}px", self)
+            action = QtWidgets.QAction(f"{size}px", self)
+            self.menu_icons.add(action, lambda size=size: create_line_icon(size))
             action.setCheckable(True)
             action.setData(size)
             self.action_pen_size.addAction(action)
@@ -144,9 +231,27 @@ class Window(QtWidgets.QMainWindow):
 
         self.action_style_pen_color.triggered.connect(self.style_pen_color_selection)
         self.action_style_text_color.triggered.connect(self.style_text_color_selection)
+        self.action_style_simplify.triggered.connect(self.style_simplify_tolerance)
+        self.action_tools_simplify.triggered.connect(self.simplify_paths)
+        self.action_tools_flatten.toggled.connect(self.view.set_flattened)
+        self.action_tools_virtual.toggled.connect(self.set_virtual)
+        self.view.stroke_simplified.connect(self.show_simplify_stats)
+        self.action_transform_dialog.triggered.connect(self.transform_selection_dialog)
+        self.action_transform_rotate_right.triggered.connect(lambda: self.transform_selection(
+            lambda center: rotation(90, center)))
+        self.action_transform_rotate_left.triggered.connect(lambda: self.transform_selection(
+            lambda center: rotation(-90, center)))
+        self.action_transform_flip_horizontal.triggered.connect(lambda: self.transform_selection(
+            lambda center: flip(True, center)))
+        self.action_transform_flip_vertical.triggered.connect(lambda: self.transform_selection(
+            lambda center: flip(False, center)))
+        self.action_tools_hud.toggled.connect(self.view.set_hud_visible)
+        self.action_tools_record.toggled.connect(self.toggle_recording)
+        self.action_tools_replay.triggered.connect(lambda: self.replay_input())
 
         self.action_edit_undo.triggered.connect(self.view.undo)
         self.action_edit_redo.triggered.connect(self.view.redo)
+        self.action_edit_delete.triggered.connect(self.delete_selection)
 
         # Connect pen size actions
         for action in self.action_pen_size.actions():
@@ -174,16 +279,21 @@ class Window(QtWidgets.QMainWindow):
 
     def file_new(self):
         if self.maybe_save():
-            self.scene.clear()
+            self.cancel_loading()
+            self.clear_scene()
             self.filename = None
+            self.set_clean(None)
             self.view.resetTransform()
             self.setWindowTitle("CAI 2425A : - New File")
 
     def file_open(self):
-        filename, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Open File", os.getcwd(), "Shape Files (*.json)")
+        filename, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Open File", os.getcwd(),
+                                                            "All Shape Files (*.json *{});;{}".format(BINARY_SUFFIX, FILE_FILTERS))
         if filename:
-            self.filename = filename
-            self.load_shapes(filename)
+            if os.path.getsize(filename) < self.STREAMING_MIN_BYTES:
+                self.open_shapes(filename)
+            else:
+                self.load_shapes_streaming(filename)
 
     def save(self):
         if self.filename:
@@ -192,136 +302,411 @@ class Window(QtWidgets.QMainWindow):
             return self.save_as()
 
     def save_as(self):
-        filename, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save File", os.getcwd(), "Shape Files (*.json)")
+        filename, selected = QtWidgets.QFileDialog.getSaveFileName(self, "Save File", os.getcwd(), FILE_FILTERS)
         if filename:
+            if not os.path.splitext(filename)[1]:
+                filename += BINARY_SUFFIX if BINARY_SUFFIX in selected else ".json"
+
             self.filename = filename
             return self.save_shapes(filename)
         return False
 
     def save_shapes(self, filename):
-        shapes = []
-        for item in self.scene.items():
-            if isinstance(item, QtWidgets.QGraphicsLineItem):
-                shape_data = {
-                    'type': 'line',
-                    'start': (item.line().x1(), item.line().y1()),
-                    'end': (item.line().x2(), item.line().y2()),
-                    'color': item.pen().color().name(),
-                    'width': item.pen().width()
-                }
-            elif isinstance(item, QtWidgets.QGraphicsRectItem):
-                shape_data = {
-                    'type': 'rect',
-                    'rect': (item.rect().x(), item.rect().y(), item.rect().width(), item.rect().height()),
-                    'color': item.pen().color().name(),
-                    'width': item.pen().width(),
-                    'brush-color': item.brush().color().name(),
-                    'brush-style': item.brush().style()
-                }
-            elif isinstance(item, QtWidgets.QGraphicsPathItem):  # Handling freehand pen drawings
-                shape_data = {
-                    'type': 'path',
-                    'path': [[(point.x(), point.y()) for point in polygon] for polygon in item.path().toSubpathPolygons()],
-                    'color': item.pen().color().name(),
-                    'width': item.pen().width()
-                }
-            elif isinstance(item, QtWidgets.QGraphicsTextItem):
-                shape_data = {
-                    'type': 'text',
-                    'text': item.toPlainText(),
-                    'pos': (item.pos().x(), item.pos().y()),
-                    'font': item.font().toString(),
-                    'color': item.defaultTextColor().name()
-                }
-            else:
-                continue  # Skip unsupported item types
-            shapes.append(shape_data)
+        # Only the snapshot of the document arrays is taken here, writing
+        # happens on the saver thread while the user keeps drawing.
+        started = metrics.start()
+        snapshot = self.document.snapshot()
+        metrics.stop("save.snapshot", started)
+        self.saver.save(filename, snapshot, self.version)
+        self.journal.begin_save()
+        self.statusBar().showMessage(f"Saving {os.path.basename(filename)}...")
+        return True
 
-        try:
-            with open(filename, 'w') as file:
-                json.dump(shapes, file)
-            return True
-        except Exception as e:
-            QtWidgets.QMessageBox.warning(self, "Save Error", f"Failed to save file: {str(e)}")
-            return False
+    def on_save_finished(self, filename, version):
+        self.journal.end_save(filename, True, self.saver.is_busy())
+        if version == self.version:
+            self.dirty = False  # nothing changed while it was written
+        self.statusBar().showMessage(f"Saved {os.path.basename(filename)}", 3000)
+
+    def on_save_failed(self, filename, message, version):
+        self.journal.end_save(filename, False, self.saver.is_busy())
+        self.statusBar().clearMessage()
+        QtWidgets.QMessageBox.warning(self, "Save Error", f"Failed to save file: {message}")
 
     def load_shapes(self, filename):
+        started = metrics.start()
+        if is_binary(filename):
+            with BinaryDocument(filename) as document:
+                self.clear_scene()
+                self.insert_ids(self.document.add_binary(document))
+            self.set_clean(filename)
+            metrics.stop("load", started)
+            return
+
         with open(filename, 'r') as file:
             shapes = json.load(file)
 
-        self.scene.clear()
-
-        for shape in shapes:
-            if shape['type'] == 'line':
-                line_item = QtWidgets.QGraphicsLineItem(*shape['start'], *shape['end'])
-                pen = QtGui.QPen(QtGui.QColor(shape['color']))
-                pen.setWidth(shape['width'])
-                line_item.setPen(pen)
-                self.scene.addItem(line_item)
-            elif shape['type'] == 'rect':
-                rect_item = QtWidgets.QGraphicsRectItem(*shape['rect'])
-                pen = QtGui.QPen(QtGui.QColor(shape['color']))
-                pen.setWidth(shape['width'])
-                bru = QtGui.QBrush(QtGui.QColor(shape['brush-color']))
-                bru.setStyle(QtCore.Qt.BrushStyle(shape['brush-style']))
-                rect_item.setPen(pen)
-                rect_item.setBrush(bru)
-                self.scene.addItem(rect_item)
-            elif shape['type'] == 'path':  # Loading freehand pen drawings
-                path = QtGui.QPainterPath()
-                for polygon in shape['path']:
-                    path.addPolygon(QtGui.QPolygonF([QtCore.QPointF(x, y) for x, y in polygon]))
-                path_item = QtWidgets.QGraphicsPathItem(path)
-                pen = QtGui.QPen(QtGui.QColor(shape['color']))
-                pen.setWidth(shape['width'])
-                path_item.setPen(pen)
-                self.scene.addItem(path_item)
-            elif shape['type'] == 'text':
-                text_item = QtWidgets.QGraphicsTextItem(shape['text'])
-                text_item.setPos(QtCore.QPointF(*shape['pos']))
-                font = QtGui.QFont()
-                font.fromString(shape['font'])
-                text_item.setFont(font)
-                text_item.setDefaultTextColor(QtGui.QColor(shape['color']))
-                self.scene.addItem(text_item)
+        self.clear_scene()
+        self.insert_shapes(shapes)
+        self.set_clean(filename)
+        metrics.stop("load", started)
+
+    def insert_shapes(self, shapes, streamed=False):
+        # Bulk insertion of shape records, as written by save_shapes. The
+        # scene index is suspended during the batch and rebuilt once, the
+        # view repaints once. Returns the new items.
+        return self.insert_ids(self.document.add(shapes), streamed)
+
+    def insert_ids(self, ids, streamed=False):
+        # Scene items for shapes already in the document, only the ones near
+        # the view when items are virtual
+        if self.virtualizer.enabled:
+            if streamed:
+                # The slices of a streaming load : one sync per few slices,
+                # each one queries the whole document
+                self.virtualizer.schedule()
+                return []
+            self.virtualizer.sync()
+            return [item for item in map(self.virtualizer.items.get, ids) if item is not None]
+        items = self.document.build_items(ids)
+        self.show_items(items)
+        return items
+
+    def show_items(self, items):
+        self.view.insert_items(items)
+        metrics.count("items.added", len(items))
+
+    def clear_scene(self):
+        metrics.count("items.removed", len(self.view.spatial_index))
+        self.view.selection.clear()  # before its items are deleted
+        # Items added since the last event loop pass wait for their polish
+        # in a list that deleting each one would search : polish them first.
+        # Without index, the items are not taken out of it one by one.
+        QtCore.QCoreApplication.sendPostedEvents(self.scene, QtCore.QEvent.MetaCall)
+        self.view.suspend_indexing()
+        try:
+            self.scene.clear()
+        finally:
+            self.view.resume_indexing()
+        self.view.spatial_index.clear()
+        self.view.tile_cache.clear()
+        self.view.lod_builder.clear()
+        self.view.clear_history()
+        self.document.clear()
+        self.virtualizer.clear()
+
+    def open_shapes(self, filename):
+        # File > Open of a small file : loaded at once, slices would only
+        # add event loop passes
+        self.cancel_loading()
+        try:
+            self.load_shapes(filename)
+        except Exception as e:
+            QtWidgets.QMessageBox.warning(self, "Open Error", f"Failed to open file: {str(e)}")
+            return
+        self.filename = filename
+        self.statusBar().showMessage(f"Loaded {len(self.document)} shapes", 3000)
+
+    def load_shapes_streaming(self, filename):
+        self.cancel_loading()
+        self.clear_scene()
+        self.filename = filename
+        self.set_clean(filename)
+        try:
+            if is_binary(filename):
+                # The records go into the document at once, its geometry
+                # stays mapped : only their items are built in slices
+                with BinaryDocument(filename) as document:
+                    source = self.document.add_binary(document)
+                insert = lambda ids: self.insert_ids(ids, streamed=True)
+            else:
+                source = filename
+                insert = lambda shapes: self.insert_shapes(shapes, streamed=True)
+            self.loader = StreamingLoader(source, insert, self)
+        except Exception as e:
+            self.document.clear()
+            self.filename = None
+            self.set_clean(None)
+            QtWidgets.QMessageBox.warning(self, "Open Error", f"Failed to open file: {str(e)}")
+            return
+        self.load_started = metrics.start()
+        self.loader.progress.connect(self.load_progress.setValue)
+        self.loader.finished.connect(self.on_loading_finished)
+        self.loader.failed.connect(self.on_loading_failed)
+        self.load_progress.setValue(0)
+        self.load_progress.show()
+        self.load_cancel.show()
+        self.statusBar().showMessage(f"Loading {os.path.basename(filename)}...")
+        self.loader.start()
+
+    def cancel_loading(self):
+        if self.loader and self.loader.is_running():
+            self.loader.cancel()
+            self.clear_scene()
+            self.filename = None
+            self.set_clean(None)
+            self.setWindowTitle("CAI 2425A : - New File")
+            self.statusBar().showMessage("Loading cancelled", 3000)
+        self.end_loading()
+
+    def end_loading(self):
+        if self.loader:
+            self.loader.deleteLater()
+            self.loader = None
+        self.load_progress.hide()
+        self.load_cancel.hide()
+
+    def on_loading_finished(self):
+        metrics.stop("load.streaming", self.load_started)
+        self.virtualizer.sync()
+        self.statusBar().showMessage(f"Loaded {self.loader.item_count} shapes", 3000)
+        self.end_loading()
+
+    def on_loading_failed(self, message):
+        self.end_loading()
+        self.clear_scene()
+        self.filename = None
+        self.set_clean(None)
+        QtWidgets.QMessageBox.warning(self, "Open Error", f"Failed to open file: {message}")
+
+    def set_clean(self, filename):
+        # The scene matches filename (or an empty document) again. Saves
+        # still in flight are of an older version and leave it clean.
+        self.version += 1
+        self.dirty = False
+        self.journal.reset(filename)
+
+    def on_document_changed(self, items):
+        # The commands have already edited the document rows
+        self.virtualizer.items_changed(items)
+        self.mark_dirty()
+        self.journal.record(items)
+
+    def set_virtual(self, enabled):
+        self.virtualizer.set_enabled(enabled)
+
+    def start_watchdog(self, threshold_ms=None):
+        self.watchdog = StallWatchdog(self.stall_context, threshold_ms or self.STALL_MS, parent=self)
+        self.watchdog.start()
+
+    def stall_context(self):
+        # Read from the watchdog thread while the GUI thread is stuck : only
+        # plain Python state, no Qt call
+        history = self.view.history
+        return {'tool': self.view.tool, 'items': len(self.view.spatial_index),
+                'undo_depth': history.position(), 'history': len(history),
+                'selection': len(self.view.selection.items), 'file': self.filename,
+                'loading': self.loader is not None}
+
+    def dump_metrics(self):
+        # Counters and timers as JSON, also written to PAINT_METRICS if set
+        return metrics.dump(self.metrics_file)
+
+    def autosave(self):
+        # Each command is journaled as it runs, autosave only compacts
+        if self.dirty:
+            self.journal.compact()
+
+    def recover_journal(self, path):
+        base, records = read_journal(path)
+        if base and os.path.exists(base):
+            self.load_shapes(base)
+        else:
+            base = None
+            self.clear_scene()
+            self.set_clean(None)
+        self.filename = base
+        self.virtualizer.realize_ids([record['id'] for record in records])
+        self.view.suspend_indexing()
+        try:
+            touched = replay(self.scene, records)
+            self.view.index_items(touched)
+        finally:
+            self.view.resume_indexing()
+        self.document.update_items(touched)
+        self.virtualizer.items_changed(touched)
+        self.journal.record(touched)
+        if os.path.exists(path) and os.path.abspath(path) != os.path.abspath(self.journal.path):
+            os.remove(path)
+        self.journal.flush()  # the recovered changes now live in this session's journal
+        self.mark_dirty()
+        self.statusBar().showMessage(f"Recovered {len(records)} change(s)", 5000)
+
+    def mark_dirty(self):
+        self.version += 1
+        self.dirty = True
 
     def maybe_save(self):
-        if self.scene.items():
+        # True once the document is safely on disk or the user gave it up.
+        # Saves in flight are waited for, their failure keeps it dirty.
+        self.wait_for_saves()
+        if self.dirty:
             reply = QtWidgets.QMessageBox.question(
                 self, "Save Changes",
                 "Do you want to save your changes?",
                 QtWidgets.QMessageBox.Save | QtWidgets.QMessageBox.Discard | QtWidgets.QMessageBox.Cancel
             )
             if reply == QtWidgets.QMessageBox.Save:
-                return self.save()
+                if not self.save():
+                    return False
+                self.wait_for_saves()
+                return not self.dirty
             elif reply == QtWidgets.QMessageBox.Cancel:
                 return False
         return True
 
+    def wait_for_saves(self):
+        if self.saver.is_busy():
+            QtWidgets.QApplication.setOverrideCursor(Qt.WaitCursor)
+            try:
+                self.saver.wait()
+            finally:
+                QtWidgets.QApplication.restoreOverrideCursor()
+
     def tools_selection(self, checked, tool):
-        print("Window.tools_selection()")
-        print("checked : ", checked)
-        print("tool : ", tool)
+        log.debug("Window.tools_selection %s checked=%s", tool, checked)
+        if self.recorder:
+            self.recorder.tool_changed(tool)
         self.view.set_tool(tool)
 
+    def toggle_recording(self, checked):
+        if checked and not self.recorder:
+            filename, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Record Input", os.getcwd(),
+                                                                "Input Recordings (*{})".format(RECORDING_SUFFIX))
+            if not filename:
+                self.action_tools_record.setChecked(False)
+                return
+            if not os.path.splitext(filename)[1]:
+                filename += RECORDING_SUFFIX
+            self.start_recording(filename)
+        elif not checked and self.recorder:
+            count = self.stop_recording()
+            self.statusBar().showMessage(f"Recorded {count} events", 3000)
+
+    def start_recording(self, filename):
+        self.recorder = InputRecorder(self, filename, self)
+        self.statusBar().showMessage(f"Recording input to {os.path.basename(filename)}")
+
+    def stop_recording(self):
+        count = self.recorder.stop()
+        self.recorder.deleteLater()
+        self.recorder = None
+        return count
+
+    def replay_input(self, realtime=False):
+        filename, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Replay Input", os.getcwd(),
+                                                            "Input Recordings (*{})".format(RECORDING_SUFFIX))
+        if filename and not self.replayer and self.maybe_save():
+            self.replay(filename, realtime)
+
+    def replay(self, filename, realtime=False):
+        try:
+            self.replayer = InputReplayer(self, filename, realtime, self)
+        except (OSError, ValueError) as e:
+            self.replayer = None
+            QtWidgets.QMessageBox.warning(self, "Replay Error", f"Failed to read recording: {str(e)}")
+            return
+        self.replayer.finished.connect(self.on_replay_finished)
+        self.statusBar().showMessage(f"Replaying {len(self.replayer.events)} events...")
+        self.replayer.start()
+
+    def on_replay_finished(self):
+        report = self.replayer.report()
+        log.info("Replay latencies\n%s", format_report(report))
+        worst = max(report.items(), key=lambda kind_stats: kind_stats[1]['p95'], default=None)
+        if worst:
+            self.statusBar().showMessage(f"Replayed {len(self.replayer.events)} events, "
+                                         f"slowest p95 : {worst[0]} {worst[1]['p95']:.1f} ms", 10000)
+        self.replayer.deleteLater()
+        self.replayer = None
+
     def style_pen_color_selection(self):
         color = QtWidgets.QColorDialog.getColor(QtCore.Qt.yellow, self)
         if color.isValid():
+            if self.recorder:
+                self.recorder.pen_color_changed(color)
             self.view.set_pen_color(color.name())
 
     def style_text_color_selection(self):
         color = QtWidgets.QColorDialog.getColor(QtCore.Qt.black, self)
         if color.isValid():
+            if self.recorder:
+                self.recorder.text_color_changed(color)
             self.view.set_text_color(color.name())
 
+    def style_simplify_tolerance(self):
+        tolerance, ok = QtWidgets.QInputDialog.getDouble(
+            self, "Stroke simplification",
+            "Tolerance in pixels (0 keeps every point) :",
+            self.view.simplify_tolerance, 0.0, 100.0, 2
+        )
+        if ok:
+            if self.recorder:
+                self.recorder.tolerance_changed(tolerance)
+            self.view.simplify_tolerance = tolerance
+
+    def simplify_paths(self, tolerance=None):
+        if not tolerance:
+            tolerance = self.view.simplify_tolerance or 1.0
+        if self.recorder:
+            self.recorder.paths_simplified(tolerance)
+        stats = SimplifyStats()
+        self.virtualizer.realize_ids(self.document.ids('path').tolist())
+        changes = simplify_path_items(self.scene.items(), tolerance, stats)
+        if changes:
+            self.view.execute_command(SetPathCommand(changes))
+        self.show_simplify_stats(stats)
+        return stats
+
+    def selection_center(self):
+        # Center of the selected shapes, None without a selection
+        stored = self.document.index
+        ids = [id_ for id_ in map(item_id, self.view.selection) if id_ in stored]
+        return selection_center(self.document, ids) if ids else None
+
+    def transform_selection(self, build):
+        # build(center) returns the scene transform of the selection
+        center = self.selection_center()
+        if center is None:
+            self.statusBar().showMessage("Nothing selected", 3000)
+            return
+        transform = build(center)
+        if transform is not None:
+            if self.recorder:
+                self.recorder.transformed(transform)
+            self.view.transform_selection(transform)
+
+    def delete_selection(self):
+        if not self.view.selection:
+            self.statusBar().showMessage("Nothing selected", 3000)
+            return
+        self.view.delete_selection()
+
+    def transform_selection_dialog(self):
+        if not self.view.selection:
+            self.statusBar().showMessage("Nothing selected", 3000)
+            return
+        dialog = TransformDialog(self)
+        if dialog.exec_() == QtWidgets.QDialog.Accepted:
+            self.transform_selection(dialog.transform)
+
+    def show_simplify_stats(self, stats):
+        self.statusBar().showMessage(str(stats), 5000)
+
+    def show_repaint_rate(self):
+        rate = self.view.repaint_meter.pixels_per_second()
+        self.repaint_label.setText(f"Repaint {rate / 1e6:.2f} Mpx/s")
+
     def set_pen_size(self):
         action = self.sender()
         if isinstance(action, QtWidgets.QAction):
             size = action.data()
+            if self.recorder:
+                self.recorder.pen_width_changed(size)
             pen = self.view.get_pen()
             pen.setWidth(size)
             self.view.set_pen(pen)
-            print(f"Pen size set to: {size}")
+            log.debug("Pen size set to %s", size)
 
 
     def create_menus(self):
@@ -340,11 +725,29 @@ class Window(QtWidgets.QMainWindow):
         menu_tool.addAction(self.action_tools_line)
         menu_tool.addAction(self.action_tools_rectangle)
         menu_tool.addAction(self.action_tools_polygon)
+        menu_tool.addSeparator()
+        menu_tool.addAction(self.action_tools_simplify)
+        menu_tool.addAction(self.action_tools_flatten)
+        menu_tool.addAction(self.action_tools_virtual)
+        menu_tool.addAction(self.history_panel.toggleViewAction())
+        menu_transform = menu_tool.addMenu('Tr&ansform')
+        menu_transform.addAction(self.action_transform_dialog)
+        menu_transform.addAction(self.action_transform_rotate_right)
+        menu_transform.addAction(self.action_transform_rotate_left)
+        menu_transform.addAction(self.action_transform_flip_horizontal)
+        menu_transform.addAction(self.action_transform_flip_vertical)
+        menu_tool.addSeparator()
+        menu_tool.addAction(self.action_tools_hud)
+        menu_tool.addAction(self.action_tools_record)
+        menu_tool.addAction(self.action_tools_replay)
 
         menu_style = menubar.addMenu('&Style')
-        menu_style_pen = menu_style.addMenu(QtGui.QIcon('Icons/tool_pen.png'),'&Pen')
+        menu_style_pen = menu_style.addMenu('&Pen')
+        self.menu_icons.add(menu_style_pen.menuAction(), lambda: icon("tool_pen"))
         menu_style_pen.addAction(self.action_style_pen_color)
-        menu_style_text = menu_style.addMenu(QtGui.QIcon('Icons/tool_text.png'),'&Text')
+        menu_style_pen.addAction(self.action_style_simplify)
+        menu_style_text = menu_style.addMenu('&Text')
+        self.menu_icons.add(menu_style_text.menuAction(), lambda: icon("tool_text"))
         menu_style_text.addAction(self.action_style_text_color)
 
         #menu_undo = menubar.addMenu('&Undo')
@@ -358,7 +761,8 @@ class Window(QtWidgets.QMainWindow):
         menubar.addAction(self.action_edit_redo)
         
         # Create Size submenu
-        menu_style_pen_size = menu_style_pen.addMenu(QtGui.QIcon('Icons/width.png'),'&Size')
+        menu_style_pen_size = menu_style_pen.addMenu('&Size')
+        self.menu_icons.add(menu_style_pen_size.menuAction(), lambda: icon("width"))
         for action in self.action_pen_size.actions():
             menu_style_pen_size.addAction(action)
 
@@ -371,25 +775,57 @@ class Window(QtWidgets.QMainWindow):
             background-color: #007FFF;
         }
         """
+        for menu in [menu_file, menu_tool, menu_style, menu_style_pen, menu_style_text, menu_style_pen_size]:
+            self.menu_icons.watch(menu)
         for menu in [menu_file, menu_tool, menu_style, menu_style_pen, menu_style_pen_size]:
             menu.setStyleSheet(stylesheet)
 
         # Statusbar 
         statusbar = self.statusBar()
+        self.load_progress = QtWidgets.QProgressBar()
+        self.load_progress.setRange(0, 1000)
+        self.load_progress.setMaximumWidth(200)
+        self.load_progress.setTextVisible(False)
+        self.load_cancel = QtWidgets.QPushButton("Cancel")
+        self.load_cancel.setFlat(True)
+        self.load_cancel.clicked.connect(self.cancel_loading)
+        statusbar.addPermanentWidget(self.load_progress)
+        statusbar.addPermanentWidget(self.load_cancel)
+        self.load_progress.hide()
+        self.load_cancel.hide()
+        self.repaint_label = QtWidgets.QLabel()
+        statusbar.addPermanentWidget(self.repaint_label)
 
     def resizeEvent(self, event):
-        print("MainWindow.resizeEvent() : View")
-        if self.view:
-            print("dx : ", self.size().width() - self.view.size().width())
-            print("dy : ", self.size().height() - self.view.size().height())
+        if not self.view:
+            log.warning("MainWindow needs a view!")
+        elif log.isEnabledFor(logging.DEBUG):
+            log.debug("MainWindow.resizeEvent dx=%d dy=%d menubar=%s",
+                      self.size().width() - self.view.size().width(),
+                      self.size().height() - self.view.size().height(), self.menuBar().size())
+
+    def closeEvent(self, event):
+        if not self.maybe_save():
+            event.ignore()
+            return
+        self.cancel_loading()
+        if self.recorder:
+            self.stop_recording()
+        self.wait_for_saves()
+        if self.watchdog:
+            self.watchdog.stop()
+        if self.metrics_file:
+            self.dump_metrics()
+        if self.dirty:
+            self.journal.flush()  # keep the journal so the changes can be recovered
         else:
-            print("MainWindow needs a view!")
-        print("menubar size : ", self.menuBar().size())
+            self.journal.discard()
+        super().closeEvent(event)
 
     def contextMenuEvent(self, event):
             contextMenu = QtWidgets.QMenu(self)
             toolAct = contextMenu.addAction("Tools")
-            deleteAct = contextMenu.addAction("Delete")
+            contextMenu.addAction(self.action_edit_delete)
             quitAct = contextMenu.addAction("Quit")
             action = contextMenu.exec_(self.mapToGlobal(event.pos()))
             if action == quitAct: